@@ -21,8 +21,13 @@ HDU_IX = 0
 # there is also apparently a bug in the "greedy" benchmark wrapper for astropy
 # wrt gzipped files that causes it to crash out. may fix at some point, may
 # not -- this is not really an interesting case; we know it's bad.
+
+# the ranged loaders read gzipped files through indexed_gzip. if a
+# checkpoint index (see subset.utilz.gzip_index.build_gzip_index) exists
+# next to a file, they decompress only from the nearest checkpoint before
+# each cut; otherwise they decompress each file at most once.
 LOADERS = (
-    "astropy", "astropy_s3", "fitsio"
+    "astropy", "astropy_s3", "fitsio", "ranged", "ranged_s3"
 )
 TEST_FILES = (
     'e06818/e06818-fd-full.fits.gz',
@@ -10,7 +10,8 @@ HDU_IX = 1
 # note that CompImageHDU does not expose a .section attribute -- it wouldn't
 # particularly matter anyway.
 LOADERS = (
-    "fitsio", "fitsio_preload_hdu", "astropy", "astropy_s3", "greedy_astropy"
+    "fitsio", "fitsio_preload_hdu", "astropy", "astropy_s3", "greedy_astropy",
+    "ranged", "ranged_s3"
 )
 TEST_FILES = (
     'e06818/e06818-fd-full-rice.fits',
@@ -8,7 +8,8 @@ AUTHENTICATE_S3 = False
 HDU_IX = 1
 LOADERS = (
     "astropy", "fitsio", "astropy_preload_hdu",
-    "astropy_s3_section", "astropy_s3", "greedy_astropy"
+    "astropy_s3_section", "astropy_s3", "greedy_astropy", "ranged",
+    "ranged_s3"
 )
 TEST_FILES = (
     'hst/public/j9r7/j9r755020/j9r755020_drz.fits',
@@ -14,7 +14,8 @@ AUTHENTICATE_S3 = True
 HDU_IX = 1
 LOADERS = (
     "astropy", "astropy_preload_hdu", "fitsio",
-    "astropy_s3", "astropy_s3_section", "greedy_astropy"
+    "astropy_s3", "astropy_s3_section", "greedy_astropy", "ranged",
+    "ranged_s3"
 )
 TEST_FILES = (
     'jwst/jw02733001001/jw02733001001_02101_00001_nrcb1_o001_crf.fits',
@@ -6,13 +6,19 @@ BUCKET = "nishapur"
 AUTHENTICATE_S3 = True
 HDU_IX = 1
 # note that CompImageHDU does not expose a .section attribute -- it wouldn't
-# particularly matter anyway.
+# particularly matter anyway. the ranged loaders fetch and decompress only
+# the tiles that intersect each cut, like fitsio, but without a FUSE mount.
+# the 'cached' loader reads through a block cache shared by all cases in a
+# run (including throwaway cases), so measures warm-cache performance.
 LOADERS = (
     "fitsio",
     "fitsio_preload_hdu",
     "astropy",
     "astropy_s3",
     "greedy_astropy",
+    "ranged",
+    "ranged_s3",
+    "ranged_s3_cached",
 )
 TEST_FILES = (
     "ps1/rings.v3.skycell/1724/066/rings.v3.skycell.1724.066.stk.g.unconv.fits",
@@ -8,7 +8,8 @@ BUCKET = "nishapur"
 AUTHENTICATE_S3 = True
 HDU_IX = 0
 LOADERS = (
-    "astropy", "fitsio",  "astropy_s3_section", "astropy_s3", "greedy_astropy"
+    "astropy", "fitsio",  "astropy_s3_section", "astropy_s3", "greedy_astropy",
+    "ranged", "ranged_s3"
 )
 TEST_FILES = (
     "spitzer/irac/SPITZER_I1_61016064_0000_1_E12340652_maic.fits",
@@ -1,6 +1,7 @@
 """
 top-level handling functions for s3-subsetting benchmarks
 """
+from contextlib import nullcontext
 from copy import deepcopy
 from functools import partial, reduce
 from importlib import import_module
@@ -11,16 +12,15 @@ from typing import Callable, Optional, Sequence, Mapping
 
 import numpy as np
 import pandas as pd
-from killscreen.monitors import (
-    Stopwatch,
-    Netstat,
-    CPUMonitor,
-    print_stats,
-    notary,
-)
+from killscreen.monitors import Stopwatch
 
 from subset.utilz.fits import imsz_from_header, logged_fits_initializer
 from subset.benchmark.random_generators import rectangular_slices
+from subset.utilz.event_log import EventLog, EventMonitor
+from subset.utilz.io_meter import active_meter, metered
+from subset.utilz.layout_index import load_layout_index
+from subset.utilz.object_server import local_s3_kwargs
+from subset.utilz.read_plan import PLAN_FIELDS
 from subset.utilz.generic import (
     load_first_aws_credential,
     make_loaders,
@@ -28,6 +28,11 @@ from subset.utilz.generic import (
     s3_url,
 )
 from subset.utilz.throttle import Throttle
+from subset.utilz.tracing import span
+
+
+def _io_fields(counts: dict) -> dict:
+    return {f"io_{k}": v for k, v in counts.items()}
 
 
 def random_cuts_from_file(
@@ -39,40 +44,93 @@ def random_cuts_from_file(
     rng=None,
     astropy_handle_attribute: str = "data",
     preload_hdu: bool = False,
+    read_plan: Optional[Mapping] = None,
+    layout_index: Optional[Mapping] = None,
+    block_cache=None,
+    log: Optional[EventLog] = None,
 ):
-    """take random slices from a fits file; examine this process closely"""
-    hdu_struct = logged_fits_initializer(
-        path,
-        loader,
-        (hdu_ix,),
-        get_handles=True,
-        astropy_handle_attribute=astropy_handle_attribute,
-        preload_hdus=preload_hdu,
-    )
-    array_handle = hdu_struct["handles"][0]
-    log, header, stat = [hdu_struct[k] for k in ("log", "header", "stat")]
-    note = notary(log)
-    # pick some boxes to slice from the HDU
-    imsz = imsz_from_header(header)
-    if rng is None:
-        rng = np.random.default_rng()
-    indices = rectangular_slices(imsz, rng=rng, count=count, shape=shape)
-    # and then slice them!
-    cuts = {}
-    for cut_ix in range(indices.shape[0]):
-        slices = tuple(
-            np.apply_along_axis(lambda row: slice(*row), 1, indices[cut_ix])
+    """
+    take random slices from a fits file; examine this process closely.
+    read_plan optionally contains cost-model kwargs for
+    subset.utilz.read_plan.plan_reads, used by handles that can coalesce
+    the reads for many cuts (i.e., those produced by ranged loaders).
+    layout_index optionally contains a loaded HDU layout index, which
+    permits ranged loaders to skip reading headers. if block_cache is
+    passed, its hits and misses for this file are logged. if called inside
+    a subset.utilz.io_meter.metered() context, the requests, bytes, and
+    request time of each cut (and of the whole file) are logged. events
+    are appended to log (a new EventLog if it is None), which is returned
+    along with the cuts. inside a subset.utilz.tracing.tracing() context,
+    each stage, cut, and range request is also recorded as a trace span.
+    """
+    monitor = EventMonitor(log)
+    if block_cache is not None:
+        cache_counts = block_cache.counts.copy()
+    # count this file's reads in a meter of its own (nested in the caller's,
+    # which still sees them), so that deltas of it are this file's alone
+    meter_context = nullcontext() if active_meter() is None else metered()
+    with meter_context as meter:
+        hdu_struct = logged_fits_initializer(
+            path,
+            loader,
+            (hdu_ix,),
+            get_handles=True,
+            astropy_handle_attribute=astropy_handle_attribute,
+            preload_hdus=preload_hdu,
+            layout_index=layout_index,
+            monitor=monitor,
         )
-        # we perform this unusual-looking copy because astropy does not, in
-        # general, actually copy memmapped data into memory in response to the
-        # __getitem__ call. so if we do not do _something_ with said data,
-        # astropy will in most cases never actually retrieve it (unless we've
-        # forced it to be "greedy" or similar, of course)
-        cuts[cut_ix] = array_handle[slices].copy()
-        note(f"got cut {cut_ix},{path},{stat()}")
-    note(f"file done,{path},{stat(total=True)}")
+        array_handle, header = hdu_struct["handles"][0], hdu_struct["header"]
+        # pick some boxes to slice from the HDU
+        imsz = imsz_from_header(header)
+        if rng is None:
+            rng = np.random.default_rng()
+        indices = rectangular_slices(imsz, rng=rng, count=count, shape=shape)
+        slice_list = [
+            tuple(np.apply_along_axis(lambda row: slice(*row), 1, box))
+            for box in indices
+        ]
+        # and then slice them!
+        cuts = {}
+        if hasattr(array_handle, "cut_many"):
+            # gather the byte ranges for every cut and fetch them all at
+            # once in as few reads as the cost model thinks worthwhile,
+            # rather than performing an independent read sequence for each
+            # cut
+            read_plan = {} if read_plan is None else read_plan
+            cut_io = None if meter is None else meter.snapshot()
+            with span("cut many", path=str(path), cuts=len(slice_list)):
+                arrays, plan = array_handle.cut_many(slice_list, **read_plan)
+            monitor.note(
+                "planned reads", path, **{k: plan[k] for k in PLAN_FIELDS}
+            )
+            cuts |= dict(enumerate(arrays))
+            io = {} if meter is None else _io_fields(meter.since(cut_io))
+            monitor.note("got cuts", path, cuts=len(arrays), **io)
+        else:
+            for cut_ix, slices in enumerate(slice_list):
+                # we perform this unusual-looking copy because astropy does
+                # not, in general, actually copy memmapped data into memory
+                # in response to the __getitem__ call. so if we do not do
+                # _something_ with said data, astropy will in most cases
+                # never actually retrieve it (unless we've forced it to be
+                # "greedy" or similar, of course)
+                cut_io = None if meter is None else meter.snapshot()
+                with span("cut", path=str(path), index=cut_ix):
+                    cuts[cut_ix] = array_handle[slices].copy()
+                io = {} if meter is None else _io_fields(meter.since(cut_io))
+                monitor.note("got cut", path, cut=cut_ix, **io)
+        if block_cache is not None:
+            counts = {
+                f"cache_{k}": v - cache_counts[k]
+                for k, v in block_cache.counts.items()
+            }
+            monitor.note("cache", path, **counts)
+        if meter is not None:
+            monitor.note("file io", path, **_io_fields(meter.snapshot()))
+        monitor.note("file done", path, total=True)
     cuts["indices"] = indices
-    return cuts, log
+    return cuts, monitor.log
 
 
 def benchmark_cuts(
@@ -88,25 +146,32 @@ def benchmark_cuts(
     aws_credentials_path: Optional[str] = None,
     authenticate_s3: bool = False,
     preload_hdu: bool = False,
+    read_plan: Optional[Mapping] = None,
+    layout_index: Optional[str] = None,
+    endpoint_url: Optional[str] = None,
+    meter_io: bool = True,
     **_,
 ):
     """
     pointy-end handler function for executing a specific benchmark test case.
     written with the expectation that it will be called by execute_test_case(),
     but there is no reason it cannot be called on its own with arguments
-    assembled some other way.
+    assembled some other way. if endpoint_url is passed, s3:// paths are
+    read from the S3-compatible server there (e.g. a LocalObjectServer from
+    subset.utilz.object_server) rather than from AWS. pass meter_io=False
+    for loaders whose reads an IOMeter cannot see (see throttle_reaches()),
+    so that no io counts are logged for them rather than zeros.
     """
     paths = paths[:n_files] if n_files is not None else paths
-    # set up monitors: timer, net traffic gauge, cpu timer, dict to put logs in
-    watch = Stopwatch(silent=True, digits=None)
-    netstat = Netstat(round_to=None)
-    cpumon = CPUMonitor(round_to=None)
-    log = {}
-    # stat is a formatting/printing function for monitor results;
-    # note simultaneously prints messages and puts them timestamped in 'log'
-    stat, note = print_stats(watch, netstat, cpumon), notary(log)
+    # set up a monitor (timer, net traffic gauge, cpu timer) and a log for
+    # every file's events; stat is a formatting function for its results
+    log = EventLog()
+    monitor = EventMonitor(log)
+    stat = monitor.stat
     rng = np.random.default_rng(seed)
     cuts = []
+    # loaders from make_loaders that read through a block cache
+    block_cache = getattr(loader, "keywords", {}).get("block_cache")
     # although fsspec uses boto3, it doesn't appear to use boto3's default
     # session initialization, so doesn't automatically load default aws
     # credentials. so, if we're looking at s3:// URIs, we manually load
@@ -119,29 +184,41 @@ def benchmark_cuts(
     # messing with the client/resource objects passed around by fsspec.
     # conversely, if the bucket has been marked as supporting anonymous
     # access, we pass anon=True to fsspec.
-    if paths[0].startswith("s3://") and authenticate_s3 is True:
+    if paths[0].startswith("s3://") and endpoint_url is not None:
+        loader = partial(loader, fsspec_kwargs=local_s3_kwargs(endpoint_url))
+    elif paths[0].startswith("s3://") and authenticate_s3 is True:
         creds = load_first_aws_credential(aws_credentials_path)
         loader = partial(loader, fsspec_kwargs=creds)
     elif paths[0].startswith("s3://"):
         loader = partial(loader, fsspec_kwargs={'anon': True})
-    watch.start()
+    if layout_index is not None:
+        # load the sidecar before starting the clock: in a real service, it
+        # would be loaded once and held in memory across many requests
+        layout_index = load_layout_index(layout_index)
+    monitor.restart()
     print_inline(f"0/{len(paths)} complete")
     for i, path in enumerate(paths):
-        path_cuts, path_log = random_cuts_from_file(
-            path,
-            loader,
-            hdu_ix,
-            count,
-            shape,
-            rng,
-            astropy_handle_attribute,
-            preload_hdu,
-        )
+        # count only the I/O made on behalf of this file
+        meter_context = metered() if meter_io is True else nullcontext()
+        with meter_context, span("file", path=str(path)):
+            path_cuts, _ = random_cuts_from_file(
+                path,
+                loader,
+                hdu_ix,
+                count,
+                shape,
+                rng,
+                astropy_handle_attribute,
+                preload_hdu,
+                read_plan,
+                layout_index,
+                block_cache,
+                log,
+            )
         if return_cuts is True:
             cuts.append(path_cuts)
         else:
             del path_cuts
-        log |= path_log
         print_inline(f"{i + 1}/{len(paths)} complete")
     return cuts, stat, log
 
@@ -151,7 +228,13 @@ def interpret_benchmark_instructions(
 ) -> list:
     """
     produce a set of arguments to random_cuts_from_files() using literals
-    defined in a submodule of benchmark_settings
+    defined in a submodule of benchmark_settings. general_settings are
+    added to every case; to benchmark against a LocalObjectServer (see
+    subset.utilz.object_server), include its "endpoint_url" (used by s3
+    loaders), and set "mountpoint" to the subdirectory it serves as the
+    benchmark's bucket (used by the others), e.g. {root}/{BUCKET}.
+    throttled cases are only made for loaders Throttle can reach (see
+    throttle_reaches()).
     """
     instructions = import_module(
         f"subset.benchmark.benchmark_settings.{benchmark_name}"
@@ -173,6 +256,9 @@ def interpret_benchmark_instructions(
         instructions.LOADERS,
     ):
         shape, count, throttle, loader = element
+        if throttle is not None and not throttle_reaches(loader):
+            # a "throttled" run of these would just repeat the uncapped one
+            continue
         title_parts = (
             benchmark_name,
             loader,
@@ -186,6 +272,7 @@ def interpret_benchmark_instructions(
             "count": count,
             "throttle": throttle,
             "loader": make_loaders(loader)[loader],
+            "meter_io": throttle_reaches(loader),
         } | deepcopy(settings)
         if "s3" in loader:
             case["bucket"] = None
@@ -208,93 +295,136 @@ def interpret_benchmark_instructions(
         if "preload_hdu" in loader:
             # 'semigreedy'. load the full extension before beginning slicing.
             case["preload_hdu"] = True
+        if "indexed" in loader:
+            # take HDU layouts from a sidecar written by
+            # regenerate_benchmark_fileinfo.py rather than reading headers
+            case["layout_index"] = Path(
+                Path(__file__).parent,
+                f"benchmark_settings/{benchmark_name}_layout.parquet",
+            )
         cases.append(case)
     return cases
 
 
-def process_bench_stats(log, test_case, benchmark_name):
-    """do lots of nasty formatting to make nice aggregate statistics"""
-    log_df = pd.DataFrame.from_dict(log, orient="index")
-    log_df["time"] = log_df.index
-    fields = log_df[0].str.split(",", expand=True)
-    cpu_times = fields[4].str.replace("cpu", "").str.split(";", expand=True)
-    cpu_times.columns = "cpu_" + cpu_times.iloc[0].str.extract(r"(\w+)")[0]
-    for c in cpu_times.columns:
-        cpu_times[c] = cpu_times[c].str.extract(r"([\d\.]+)").astype(float)
-    fields = fields.drop(columns=4)
-    fields.columns = ["event", "path", "duration_str", "volume_str"]
-    log_df = pd.concat([log_df, fields], axis=1)
-    log_df["duration"] = (
-        log_df["duration_str"].str.extract(r"([\d\.]+)").astype(float)
-    )
-    log_df["volume"] = (
-        log_df["volume_str"].str.extract(r"([\d\.]+)").astype(float)
-    )
-    log_df["path"] = log_df["path"].map(lambda p: Path(p).name)
-    log_df = (
-        pd.concat([log_df.drop(columns=0), cpu_times], axis=1)
-        .sort_values(by="time")
-        .reset_index(drop=True)
+# per-file sums of counts recorded with benchmark events
+COUNT_COLUMNS = (
+    "requested_bytes",
+    "used_bytes",
+    "cache_hits",
+    "cache_disk_hits",
+    "cache_misses",
+)
+IO_COLUMNS = ("io_requests", "io_bytes", "io_first_byte", "io_transfer")
+
+
+def process_bench_stats(log: EventLog, test_case, benchmark_name):
+    """make per-file aggregate statistics from a benchmark's EventLog"""
+    log_df = log.to_frame()
+    log_df["path"] = log_df["path"].cat.rename_categories(
+        lambda p: Path(p).name
     )
-    file_totals = (
-        log_df.loc[
-            log_df["event"].str.contains("file")
-            & log_df["duration_str"].str.contains("total")
-        ]
-        .copy()
-        .reset_index(drop=True)
+    cpu_columns = [c for c in log_df.columns if c.startswith("cpu_")]
+    file_totals = log_df.loc[
+        (log_df["event"] == "file done") & (log_df["total"] == 1),
+        ["path", "duration", "volume", *cpu_columns],
+    ].set_index("path")
+    # file-level io events only, so that per-cut io is not counted twice
+    count_columns = [c for c in COUNT_COLUMNS if c in log_df.columns]
+    io_columns = [c for c in IO_COLUMNS if c in log_df.columns]
+    counts = pd.concat(
+        [
+            log_df.groupby("path", observed=True)[count_columns].sum(
+                min_count=1
+            ),
+            log_df.loc[log_df["event"] == "file io"]
+            .groupby("path", observed=True)[io_columns]
+            .sum(min_count=1),
+        ],
+        axis=1,
     )
-    file_totals = file_totals.drop(columns=["duration_str", "volume_str"])
     file_info = pd.read_csv(
         f"{Path(__file__).parent}/benchmark_settings/{benchmark_name}_fileinfo.csv",
         index_col=0,
     )
-    path_series = file_info["filename"].map(lambda p: Path(p).name)
-    file_total_records = []
-    for _, total in file_totals.iterrows():
-        record = total[["path", "duration", "volume"]].to_dict()
-        # load pregenerated information about this file for derived stats
-        match_info = file_info.loc[path_series == total["path"]]
-        # which HDU/extension did we slice from?
-        extension = match_info[str(test_case["hdu_ix"])]
-        # total file size (counting all HDUs, headers, etc.) in MB
-        record["file_size"] = int(match_info["filesize"].iloc[0]) / 1000 ** 2
-        # # transfer volume as a proportion of the size of the entire file
-        record["file_size_ratio"] = record["volume"] / record["file_size"]
-        # datasize of the sliced HDU in MB
-        record["hdu_size"] = int(extension["datasize"]) / 1000 ** 2
-        # transfer volume as a proportion of the sliced HDU
-        record["hdu_size_ratio"] = record["volume"] / record["hdu_size"]
-        # number of cutouts retrieved per file in this test case
-        record["n_cuts"] = test_case["count"]
-        # in-memory volume of resultant cutout in MB (_not_ transfer volume)
-        record["size_per_cut"] = (
-            int(extension["itemsize"])
-            / 8  # BITPIX is in bits; we want this value in bytes
-            / 1000 ** 2  # ... actually megabytes
-            * reduce(mul, test_case["shape"])  # number of elements in cutout
+    # load pregenerated information about each file for derived stats
+    file_info["field"] = file_info.index
+    file_info["path"] = file_info["filename"].map(lambda p: Path(p).name)
+    # which HDU/extension did we slice from?
+    extension = file_info.pivot(
+        index="path", columns="field", values=str(test_case["hdu_ix"])
+    ).reindex(file_totals.index)
+    file_size = file_info.groupby("path")["filesize"].first()
+    records = file_totals[["duration", "volume"]].copy()
+    # total file size (counting all HDUs, headers, etc.) in MB
+    records["file_size"] = (
+        file_size.reindex(records.index).astype(int) / 1000 ** 2
+    )
+    # transfer volume as a proportion of the size of the entire file
+    records["file_size_ratio"] = records["volume"] / records["file_size"]
+    # datasize of the sliced HDU in MB
+    records["hdu_size"] = extension["datasize"].astype(int) / 1000 ** 2
+    # transfer volume as a proportion of the sliced HDU
+    records["hdu_size_ratio"] = records["volume"] / records["hdu_size"]
+    # number of cutouts retrieved per file in this test case
+    records["n_cuts"] = test_case["count"]
+    # in-memory volume of resultant cutout in MB (_not_ transfer volume)
+    records["size_per_cut"] = (
+        extension["itemsize"].astype(int)
+        / 8  # BITPIX is in bits; we want this value in bytes
+        / 1000 ** 2  # ... actually megabytes
+        * reduce(mul, test_case["shape"])  # number of elements in cutout
+    )
+    # total in-memory volume of all cutouts in MB (_not_ transfer volume)
+    records["cut_size"] = records["size_per_cut"] * records["n_cuts"]
+    # transfer volume as a proportion of total in-memory volume of cutouts
+    records["cut_size_ratio"] = records["volume"] / records["cut_size"]
+    records = records.join(counts.dropna(axis=1, how="all"))
+    # io counts are left NaN for loaders an IOMeter cannot see, rather
+    # than claiming they read nothing
+    records = records.reindex(
+        columns=[
+            *records.columns,
+            *(c for c in IO_COLUMNS if c not in records.columns),
+        ]
+    )
+    if "requested_bytes" in records.columns:
+        # bytes requested by coalesced reads, bytes actually needed for
+        # cuts, and the ratio between them
+        records["over_read_ratio"] = (
+            records["requested_bytes"] / records["used_bytes"]
         )
-        # total in-memory volume of all cutouts in MB (_not_ transfer volume)
-        record["cut_size"] = record["size_per_cut"] * record["n_cuts"]
-        # transfer volume as a proportion of total in-memory volume of cutouts
-        record["cut_size_ratio"] = record["volume"] / record["cut_size"]
-        # MB transferred per second
-        record["mb_rate"] = record["volume"] / record["duration"]
-        # number of cutouts retrieved per second
-        record["cut_rate"] = record["n_cuts"] / record["duration"]
-        # 'effective' MB (bytes retained in a cutout) transferred per second
-        record["retained_mb_rate"] = record["cut_size"] / record["duration"]
-        # seconds of cpu "busy" time (see notes elsewhere)
-        record["cpu_busy"] = total.loc[
-            total.index.str.startswith("cpu")
-            & ~total.index.str.contains("idle")
-        ].sum()
-        # seconds of cpu "idle" time (see notes elsewhere)
-        record["cpu_idle"] = total["cpu_idle"]
-        # CPU busy-to-idle ratio (see notes elsewhere)
-        record["cpu_busy_ratio"] = record["cpu_busy"] / record["cpu_idle"]
-        file_total_records.append(record)
-    return pd.DataFrame(file_total_records)
+    # bytes read on behalf of each file alone, unlike volume, which counts
+    # all traffic on the host
+    records["io_volume"] = records["io_bytes"] / 1000 ** 2
+    # read amplification: MB read per MB of cutouts
+    records["io_cut_size_ratio"] = records["io_volume"] / records["cut_size"]
+    records["io_mb_rate"] = records["io_volume"] / records["duration"]
+    # MB transferred per second
+    records["mb_rate"] = records["volume"] / records["duration"]
+    # number of cutouts retrieved per second
+    records["cut_rate"] = records["n_cuts"] / records["duration"]
+    # 'effective' MB (bytes retained in a cutout) transferred per second
+    records["retained_mb_rate"] = records["cut_size"] / records["duration"]
+    # seconds of cpu "busy" time (see notes elsewhere)
+    busy = [c for c in cpu_columns if c != "cpu_idle"]
+    records["cpu_busy"] = file_totals[busy].sum(axis=1)
+    # seconds of cpu "idle" time (see notes elsewhere)
+    records["cpu_idle"] = file_totals["cpu_idle"]
+    # CPU busy-to-idle ratio (see notes elsewhere)
+    records["cpu_busy_ratio"] = records["cpu_busy"] / records["cpu_idle"]
+    return records.reset_index()
+
+
+def throttle_reaches(loader_name: str) -> bool:
+    """
+    can Throttle shape (and an IOMeter count) the reads of the named
+    loader? they reach byte-range sources (ranged and block-cached loaders)
+    and fsspec files (astropy s3 loaders), but not cfitsio or astropy's
+    reads of local / mounted files.
+    """
+    if "ranged" in loader_name or "cached" in loader_name:
+        return True
+    return "astropy" in loader_name and "s3" in loader_name
 
 
 def execute_test_case(
@@ -308,6 +438,11 @@ def execute_test_case(
     """
     case_parts = test_case["title"].split("-")
     name, loader, count, shape = case_parts[0:4]
+    if test_case["throttle"] is not None and not throttle_reaches(loader):
+        raise ValueError(
+            f"Throttle cannot cap reads made by {loader} loaders; run "
+            f"{test_case['title']} without a bandwidth setting"
+        )
     if ("n_files" in test_case) and (test_case["n_files"] is not None):
         filecount = min(test_case["n_files"], len(test_case["paths"]))
     else:
@@ -0,0 +1,101 @@
+"""
+microbenchmark for header handling: astropy.io.fits.Header vs. the
+vectorized block parsers in subset.utilz.header_blocks. each parser is
+timed on getting from raw header bytes to image dimensions and WCS keywords
+(i.e., what agnostic_fits_skim() and imsz_from_header() need).
+
+usage: python header_parse_benchmark.py [FITS file] [HDU index]
+with no arguments, uses a synthetic header of SYNTHETIC_CARDS cards
+(about the length of a PS1 stack image header).
+"""
+from pathlib import Path
+import sys
+from timeit import repeat
+
+# hacky; can remove if we decide to add an install script or put this in the
+# repo root
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+SYNTHETIC_CARDS = 400
+REPEATS, NUMBER = 5, 200
+
+
+def synthetic_header_bytes(n_cards: int = SYNTHETIC_CARDS) -> bytes:
+    import astropy.io.fits
+
+    header = astropy.io.fits.ImageHDU(
+        data=None, header=astropy.io.fits.Header()
+    ).header
+    header["NAXIS"] = 2
+    header["NAXIS1"], header["NAXIS2"] = 6250, 6250
+    wcs = {
+        "CTYPE1": "RA---TAN",
+        "CTYPE2": "DEC--TAN",
+        "CRVAL1": 150.0,
+        "CRVAL2": 2.2,
+        "CRPIX1": 3125.5,
+        "CRPIX2": 3125.5,
+        "CDELT1": -6.9e-5,
+        "CDELT2": 6.9e-5,
+        "PC001001": 1.0,
+        "PC002002": 1.0,
+        "EXPTIME": 1234.5,
+    }
+    header.update(wcs)
+    for ix in range(n_cards - len(header) - 10):
+        header[f"KEY{ix}"] = (ix * 1.5, "filler keyword")
+    header.add_history("processed by a pipeline with a long history")
+    return header.tostring().encode("ascii")
+
+
+def header_bytes_from_file(path: str, hdu_ix: int) -> bytes:
+    from subset.utilz.header_blocks import CARD_LENGTH, find_end_card
+    from subset.utilz.ranged_fits import RangedFITS
+
+    with RangedFITS(path) as hdul:
+        layout = hdul[hdu_ix].layout
+        end = layout["data_loc"]
+        buffer = hdul.source.read_range(layout["header_loc"], end)
+    # trim to the END card so that all parsers see the same bytes
+    return buffer[:find_end_card(buffer) + CARD_LENGTH]
+
+
+if __name__ == "__main__":
+    import astropy.io.fits
+
+    from subset.utilz.fits import extract_wcs_keywords, imsz_from_header
+    from subset.utilz.header_blocks import (
+        parse_header_blocks,
+        skim_header_blocks,
+    )
+
+    if len(sys.argv) > 1:
+        hdu = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+        raw = header_bytes_from_file(sys.argv[1], hdu)
+    else:
+        raw = synthetic_header_bytes()
+    text = raw.decode("ascii")
+
+    def with_astropy():
+        header = astropy.io.fits.Header.fromstring(text)
+        return imsz_from_header(header), extract_wcs_keywords(header)
+
+    def with_parse():
+        header, _ = parse_header_blocks(raw)
+        return imsz_from_header(header), extract_wcs_keywords(header)
+
+    def with_skim():
+        header, _ = skim_header_blocks(raw)
+        return imsz_from_header(header), extract_wcs_keywords(header)
+
+    reference = with_astropy()
+    print(f"{len(raw) // 80} cards")
+    for name, func in (
+        ("astropy Header", with_astropy),
+        ("parse_header_blocks", with_parse),
+        ("skim_header_blocks", with_skim),
+    ):
+        if func() != reference:
+            print(f"WARNING: {name} disagrees with astropy")
+        best = min(repeat(func, repeat=REPEATS, number=NUMBER)) / NUMBER
+        print(f"{name}: {best * 1e6:.1f} us per header")
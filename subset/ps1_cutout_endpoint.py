@@ -5,11 +5,9 @@ in the scaling example.
 import os
 from multiprocessing import cpu_count
 from pathlib import Path
-import pickle
 import sys
 
 import fire
-import pandas as pd
 from killscreen.utilities import filestamp
 
 # hacky; can remove if we decide to add an install script or put this in the
@@ -19,7 +17,9 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from subset.science.ps1_utils import PS1_CUT_CONSTANTS
 from subset.utilz.mount_s3 import mount_bucket
 from subset.science.handlers import bulk_skycut, get_corresponding_images
+from subset.utilz.cut_store import write_cuts
 from subset.utilz.generic import make_loaders, parse_topline
+from subset.utilz.header_prefetch import DEFAULT_HEADER_GUESS
 
 # default settings'
 
@@ -51,11 +51,22 @@ LOADER = tuple(
 # how many threads shall we cut with in parallel? (None to disable.) note
 # that S3 handles parallel requests very well; on a smaller instance,
 # you will run out of CPU or bandwidth before you exhaust its willingness to
-# serve parallel requests.
+# serve parallel requests. header_guess: if not None, read all headers in a
+# chunk in one concurrent wave of reads of this many bytes from the start of
+# each file, rather than opening each file (see header_prefetch).
+# lookahead: how many chunks' headers shall we read in the background while
+# cutting the current chunk? (0 to disable. not for greedy loaders, which
+# clean up their scratch files after every chunk.) workers: if "thread",
+# "process", or "hybrid", make worker pools once and reuse them for every
+# chunk, rather than starting a new process pool per chunk (see
+# subset.utilz.workers).
 TUNING = {
     "fitsio": {
         "chunksize": 250,
         "threads": {"image": cpu_count() * 5, "cut": cpu_count() * 5},
+        "header_guess": DEFAULT_HEADER_GUESS,
+        "lookahead": 1,
+        "workers": "process",
     },
     "greedy_fitsio": {
         "chunksize": 10,
@@ -87,12 +98,9 @@ def make_ps1_slices(targets: list[dict]):
     )
     rate, weight = parse_topline(log)
     print(f"{rate} cutouts/s, {weight} MB / cutout")
-    logframe = pd.DataFrame(
-        [line.split(",") for line in log.values()], index=log.keys()
-    )
-    logframe.to_csv(Path(DUMP_PATH, f"{filestamp()}_log.csv"))
-    with open(Path(DUMP_PATH, f"{filestamp()}_cuts.pkl"), "wb") as stream:
-        pickle.dump(cuts, stream)
+    log.to_frame().to_csv(Path(DUMP_PATH, f"{filestamp()}_log.csv"))
+    # see subset.utilz.cut_store.read_cuts() for reading these back
+    write_cuts(cuts, Path(DUMP_PATH, f"{filestamp()}_cuts.arrow"))
 
 
 # tell fire to handle command line call
@@ -1,6 +1,7 @@
 """
 simple script for regenerating file size / format information as input
-to derived benchmark statistics.
+to derived benchmark statistics, along with the HDU layout indices used by
+'indexed' ranged loaders.
 """
 BENCHMARKS_FOR_WHICH_TO_REGENERATE_FILEINFO = (
     "hst",
@@ -26,6 +27,7 @@ if __name__ == "__main__":
     # the repo root
     os.chdir("../")
     from subset.utilz.fits import fitsstat
+    from subset.utilz.layout_index import build_layout_index
     from subset.benchmark.handlers import interpret_benchmark_instructions
     from subset.utilz.mount_s3 import mount_bucket
 
@@ -52,3 +54,13 @@ if __name__ == "__main__":
                 f"benchmark/benchmark_settings/{benchmark_name}_fileinfo.csv",
             )
         )
+        # keyed by bucket-relative path, so usable for both s3:// URLs and
+        # paths under a FUSE mount
+        build_layout_index(
+            [Path(S3_MOUNTPOINT, path) for path in paths],
+            Path(
+                Path(__file__).parent,
+                f"benchmark/benchmark_settings/{benchmark_name}_layout.parquet",
+            ),
+            keys=paths,
+        )
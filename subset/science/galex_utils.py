@@ -13,6 +13,8 @@ from gPhoton.reference import eclipse_to_paths
 from more_itertools import chunked
 from pyarrow import parquet
 
+from subset.utilz.tan_wcs import tan_system, world_to_pixel
+
 
 def get_galex_version_path(eclipse, band, depth, obj, version, data_root):
     """
@@ -101,6 +103,119 @@ def counts2mag(cps, band):
     return mag
 
 
+def start_coadd(cut):
+    """
+    start a running exposure-weighted coadd from a GALEX cut record (as
+    produced by bulk_skycut() with hdu_indices (1, 2, 3): count, flag, and
+    edge images). later cuts of the same object and band are added with
+    fold_into_coadd(), and finish_coadd() turns the sums into an image.
+    the coadd is on the pixel grid of this first cut.
+
+    this approximates gPhoton's coadd_image_slices() (which
+    subset.science.handlers.coadd_galex_cutouts() uses) rather than
+    reproducing it: each pixel is weighted by its own unflagged exposure
+    time, and the output grid is the first cut's. magnitudes from the two
+    can differ slightly, most near flagged pixels and cut edges.
+    """
+    shape = cut["arrays"][0].shape
+    coadd = {
+        "counts": np.zeros(shape),
+        "exposure": np.zeros(shape),
+        "exptime": 0.0,
+        "n_cuts": 0,
+        "system": cut["system"],
+        "tan": tan_system(cut["system"]),
+        "origin": _cut_origin(cut),
+        "obj_id": cut["obj_id"],
+        "band": cut["band"],
+    }
+    return fold_into_coadd(coadd, cut)
+
+
+def _cut_origin(cut) -> tuple[int, int]:
+    """image pixel (x, y) of a cut's first pixel (see skycut._box_slices)"""
+    x0, _, y0, _ = cut["coords"]
+    return max(x0, 0), max(y0, 0)
+
+
+def register_cut(coadd, cut, shape) -> tuple[np.ndarray, ...]:
+    """
+    find where each pixel of a cut lands on a coadd's pixel grid: project
+    the cut's pixel centers to the sky through its own WCS, and back
+    through the coadd's, to the nearest pixel. returns the cut's (row,
+    column) indices of pixels that land on the grid and their coadd (row,
+    column) indices.
+    """
+    x_origin, y_origin = _cut_origin(cut)
+    rows, columns = np.indices(shape)
+    ra, dec = cut["system"].pixel_to_world_values(
+        columns + x_origin, rows + y_origin
+    )
+    x, y = world_to_pixel(coadd["system"], ra, dec, coadd["tan"])
+    with np.errstate(invalid="ignore"):
+        to_rows = np.rint(y - coadd["origin"][1])
+        to_columns = np.rint(x - coadd["origin"][0])
+        grid_rows, grid_columns = coadd["counts"].shape
+        inside = (
+            (to_rows >= 0)
+            & (to_rows < grid_rows)
+            & (to_columns >= 0)
+            & (to_columns < grid_columns)
+        )
+    return (
+        rows[inside],
+        columns[inside],
+        to_rows[inside].astype(np.int64),
+        to_columns[inside].astype(np.int64),
+    )
+
+
+def fold_into_coadd(coadd, cut):
+    """
+    add a cut's counts, and its exposure time at each pixel, to a running
+    coadd. pixels marked in the cut's flag or edge images are excluded.
+    each cut is registered to the coadd's grid through the WCSs of the two
+    (see register_cut()), so eclipses with different pointings line up on
+    the sky; pixels that fall off the grid are dropped.
+    """
+    counts = np.nan_to_num(cut["arrays"][0].astype(np.float64))
+    valid = np.ones(counts.shape, dtype=bool)
+    for mask in cut["arrays"][1:]:
+        valid &= mask == 0
+    rows, columns, to_rows, to_columns = register_cut(
+        coadd, cut, counts.shape
+    )
+    keep = valid[rows, columns]
+    # nearest-pixel projection can land two pixels on one grid pixel; they
+    # add to both its counts and its exposure, so its rate is unbiased
+    destination = to_rows[keep], to_columns[keep]
+    np.add.at(coadd["counts"], destination, counts[rows, columns][keep])
+    np.add.at(coadd["exposure"], destination, float(cut["exptime"]))
+    coadd["exptime"] += float(cut["exptime"])
+    coadd["n_cuts"] += 1
+    return coadd
+
+
+def finish_coadd(coadd):
+    """
+    turn a running coadd into a record like those made by
+    subset.science.handlers.coadd_galex_cutouts(), in counts per second
+    (0 where no cut had valid exposure, so that aperture sums over those
+    pixels are not NaN)
+    """
+    with np.errstate(invalid="ignore", divide="ignore"):
+        array = np.where(
+            coadd["exposure"] > 0, coadd["counts"] / coadd["exposure"], 0
+        )
+    return {
+        "array": array,
+        "system": coadd["system"],
+        "exptime": coadd["exptime"],
+        "obj_id": coadd["obj_id"],
+        "band": coadd["band"],
+    }
+
+
 GALEX_CUT_CONSTANTS = MappingProxyType(
     {
         'chunker': galex_chunker,
@@ -1,67 +1,94 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import os
 from itertools import product, chain
 from multiprocessing import Pool
 from pathlib import Path
-import pickle
 from types import MappingProxyType
 from typing import Optional, Literal
+import warnings
 
 from cytoolz import groupby, first
 from cytoolz.curried import get
 from dustgoggles.func import zero
-from gPhoton.coadd import coadd_image_slices, cut_skyboxes
-from killscreen.monitors import make_monitors
+from gPhoton.coadd import coadd_image_slices
 from killscreen.utilities import filestamp, roundstring
 import numpy as np
 import pandas as pd
-from photutils import aperture_photometry
 import pyarrow as pa
-from skimage.transform import resize
 
-from subset.science.galex_utils import counts2mag
-from subset.science.ps1_utils import ps1_flux2mag
+from subset.science.galex_utils import (
+    counts2mag,
+    finish_coadd,
+    fold_into_coadd,
+    start_coadd,
+)
+from subset.science.ps1_utils import ps1_flux2mag, ps1_stack2flux
 from subset.science.science_utils import (
     agnostic_fits_skim,
-    centered_aperture,
+    batched_aperture_sums,
     centile_clip,
     normalize_range,
     pd_combinations,
 )
+from subset.science.skycut import cut_skyboxes
+from subset.utilz.cut_store import write_cuts
+from subset.utilz.event_log import EventLog, EventMonitor
 from subset.utilz.generic import cleanup_greedy_shm, summarize_stat
+from subset.utilz.header_prefetch import prefetch_headers
+from subset.utilz.tracing import span
+from subset.utilz.workers import (
+    make_worker_pools,
+    apply_in_context,
+    shutdown_worker_pools,
+    submit_in_context,
+)
+
+
+# fields of cut records carried into photometry results
+PHOTOMETRY_FIELDS = (
+    "ra", "dec", "obj_id", "proj_cell", "sky_cell", "galex", "coords"
+)
 
 
 # TODO, maybe: this can be generalized to work with more than just the g and
 #  z bands, and with more than just these datasets, although none of that is
 #  necessary for the demo.
 def extract_cutout_photometry(
-    cut_records,
-    aperture_radius_arcsec=12.8,
-    fields=("ra", "dec", "obj_id", "proj_cell", "sky_cell", "galex", "coords"),
+    cut_records, aperture_radius_arcsec=12.8, fields=PHOTOMETRY_FIELDS
 ):
     """
     compute multiband aperture photometry on a collection of PS1 and GALEX
     cutouts produced by functions like bulk_skycut()
     """
+    cut_records = list(cut_records)
+    # aperture sums for every record at once, rather than one photutils
+    # call per record
+    all_counts = batched_aperture_sums(cut_records, aperture_radius_arcsec)
+    counts_by_record = {
+        id(record): counts for record, counts in zip(cut_records, all_counts)
+    }
     cubes = groupby(get("obj_id"), cut_records)
     results = []
     # noinspection PyArgumentList
     for cube in cubes.values():
         result = {k: v for k, v in cube[0].items() if k in fields}
         for record in cube:
-            band = record["band"]
-            counts = aperture_photometry(
-                record["array"],
-                centered_aperture(record, aperture_radius_arcsec),
-            )["aperture_sum"][0]
-            if band not in ("NUV", "FUV"):
-                result[f"{band}_mag"] = ps1_flux2mag(counts, record["exptime"])
-            else:
-                # note that GALEX coadds were converted to cps during coadding
-                result[f"{band}_mag"] = counts2mag(counts, band)
+            result[f"{record['band']}_mag"] = band_magnitude(
+                record, counts_by_record[id(record)]
+            )
         results.append(result)
     return compute_uv_mag_offset(pd.DataFrame(results))
 
 
+def band_magnitude(record, counts):
+    """magnitude from a PS1 or GALEX cutout record's aperture sum"""
+    if record["band"] not in ("NUV", "FUV"):
+        return ps1_flux2mag(counts, record["exptime"])
+    # note that GALEX coadds were converted to cps during coadding
+    return counts2mag(counts, record["band"])
+
+
 def compute_uv_mag_offset(results):
     results["ex"] = (
         results["NUV_mag"] - (results["g_mag"] + results["z_mag"]) / 2
@@ -99,23 +126,67 @@ def coadd_galex_cutouts(cutouts, scale=None, band="NUV"):
 
 
 def initialize_fits_chunk(
-    chunk, bands, data_root, kwarg_assembler, loader, threads
+    chunk,
+    bands,
+    data_root,
+    kwarg_assembler,
+    loader,
+    threads,
+    header_guess=None,
+    executor=None,
 ):
-    pool = Pool(threads) if threads is not None else None
-    metadata = {}
-    for band, identifier in product(bands, chunk):
-        kwargs = kwarg_assembler(identifier, band, data_root, loader, bands)
-        if pool is None:
-            metadata[(identifier, band)] = agnostic_fits_skim(**kwargs)
-        else:
-            metadata[(identifier, band)] = pool.apply_async(
-                agnostic_fits_skim, kwds=kwargs
+    """
+    read headers (and WCS) for every file in a chunk. if header_guess is
+    not None, first fetch all the headers in one or two concurrent waves
+    of range requests, starting with header_guess bytes from each file
+    (see subset.utilz.header_prefetch); otherwise, open each file with
+    loader. if an executor is passed (see subset.utilz.workers), files are
+    opened in it rather than in a new Pool of size threads.
+    """
+    with span("initialize chunk", files=len(chunk) * len(bands)):
+        assembled = {
+            (identifier, band): kwarg_assembler(
+                identifier, band, data_root, loader, bands
             )
-    if pool is not None:
-        pool.close()
-        pool.join()
-        metadata |= {k: v.get() for k, v in metadata.items()}
-    return metadata
+            for band, identifier in product(bands, chunk)
+        }
+        if header_guess is not None:
+            prefetched = prefetch_headers(
+                [kwargs["path"] for kwargs in assembled.values()],
+                max(kwargs["hdu_indices"][0] for kwargs in assembled.values()),
+                header_guess,
+            )
+            metadata = {}
+            for key, kwargs in assembled.items():
+                layouts = prefetched[str(kwargs["path"])]
+                # bytes through the end of the last header read, for sizing
+                # later guesses
+                metadata[key] = agnostic_fits_skim(
+                    **kwargs,
+                    layouts=layouts,
+                    header_bytes=layouts[-1]["data_loc"],
+                )
+            return metadata
+        if executor is not None:
+            futures = {
+                key: submit_in_context(executor, agnostic_fits_skim, **kwargs)
+                for key, kwargs in assembled.items()
+            }
+            return {key: future.result() for key, future in futures.items()}
+        pool = Pool(threads) if threads is not None else None
+        metadata = {}
+        for (identifier, band), kwargs in assembled.items():
+            if pool is None:
+                metadata[(identifier, band)] = agnostic_fits_skim(**kwargs)
+            else:
+                metadata[(identifier, band)] = apply_in_context(
+                    pool, agnostic_fits_skim, kwds=kwargs
+                )
+        if pool is not None:
+            pool.close()
+            pool.join()
+            metadata |= {k: v.get() for k, v in metadata.items()}
+        return metadata
 
 
 def merge_chunk_metadata(
@@ -143,27 +214,29 @@ def merge_chunk_metadata(
 def cut_and_dump(
     plans,
     cut_kwargs,
-    stat=zero,
-    note=zero,
+    monitor: Optional[EventMonitor] = None,
     return_cuts=False,
     verbose=1,
     outpath=None,
 ):
-    chunk_cuts = cut_skyboxes(plans, **cut_kwargs)
+    note = zero if monitor is None else monitor.note
+    with span("cut skyboxes", cuts=len(plans)):
+        chunk_cuts = cut_skyboxes(plans, **cut_kwargs)
     chunk_cuts = [plan | cut for plan, cut in zip(plans, chunk_cuts)]
     cleanup_greedy_shm(cut_kwargs["loader"])
-    note(f"made {len(plans)} cutouts,{stat()}", verbose > 1)
+    note("made cutouts", loud=verbose > 1, cuts=len(plans))
     if outpath is not None:
-        with outpath.with_extension(".pkl").open("wb+") as stream:
-            pickle.dump(chunk_cuts, stream)
-        note(f"dumped {len(plans)} cutouts to disk,{stat()}", verbose > 1)
+        # see subset.utilz.cut_store.read_cuts() for reading these back
+        with span("dump cutouts", path=str(outpath)):
+            write_cuts(chunk_cuts, Path(f"{outpath}.arrow"))
+        note("dumped cutouts", loud=verbose > 1, cuts=len(plans))
     if return_cuts is False:
         for cut in chunk_cuts:
             del cut["arrays"]
     return chunk_cuts
 
 
-def bulk_skycut(
+def stream_skycut(
     ids,
     targets,
     bands,
@@ -180,44 +253,274 @@ def bulk_skycut(
     name="chunk",
     share_wcs=False,
     exptime_field="EXPTIME",
+    header_guess=None,
+    lookahead=0,
+    workers=None,
+    log_capacity=None,
 ):
+    """
+    make cutouts around targets from chunks of images, yielding the cut
+    records for each chunk as soon as it is done, so that callers can
+    process and discard them as they go. the generator's return value (the
+    value of the StopIteration it raises at the end) is its log. if
+    lookahead > 0, headers (and WCS) for up to that many upcoming chunks
+    are read in the background while the current chunk is cut, so that
+    header fetches overlap with cutting rather than alternating with it;
+    they are then always read in threads, never in forked processes. if
+    workers is "thread", "process", or "hybrid", worker pools sized by
+    threads are made once and shared by all chunks (see
+    subset.utilz.workers); otherwise, each chunk makes its own. the log is
+    an EventLog (see subset.utilz.event_log); if log_capacity is not None,
+    it keeps only that many of the most recent events. inside a
+    subset.utilz.tracing.tracing() context, each chunk's stages are also
+    recorded as trace spans, including the file opens, cuts, and range
+    requests of worker processes (under their own pids).
+    """
     file_chunks, target_groups = chunker(ids, targets, bands, chunksize)
-    results, tag = [], filestamp()
-    stat, note = make_monitors(silent=True)
-    for ix, chunk in enumerate(file_chunks):
-        metadata = initialize_fits_chunk(
-            chunk=chunk,
-            bands=bands,
-            data_root=data_root,
-            kwarg_assembler=kwarg_assembler,
-            loader=loader,
-            threads=threads["image"],
+    file_chunks = list(file_chunks)
+    n_cuts, tag = 0, filestamp()
+    monitor = EventMonitor(EventLog(log_capacity))
+    if workers is not None:
+        pools = make_worker_pools(workers, threads)
+    else:
+        pools = {"image": None, "cut": None}
+    init_pool = pools["image"]
+    if (
+        lookahead > 0
+        and threads["image"] is not None
+        and not isinstance(init_pool, ThreadPoolExecutor)
+    ):
+        # lookahead initializes chunks from a background thread. forking
+        # worker processes from there while the main thread may be forking
+        # its own can deadlock, so skim headers (mostly I/O) in threads
+        init_pool = ThreadPoolExecutor(threads["image"])
+    init_kwargs = {
+        "bands": bands,
+        "data_root": data_root,
+        "kwarg_assembler": kwarg_assembler,
+        "loader": loader,
+        "threads": threads["image"],
+        "executor": init_pool,
+    }
+    executor = ThreadPoolExecutor(1) if lookahead > 0 else None
+    ahead = deque()
+    try:
+        for ix, chunk in enumerate(file_chunks):
+            with span("chunk", index=ix, images=len(chunk) * len(bands)):
+                if executor is None:
+                    metadata = initialize_fits_chunk(
+                        chunk=chunk, header_guess=header_guess, **init_kwargs
+                    )
+                else:
+                    # keep this chunk and up to lookahead later chunks
+                    # queued or in flight
+                    while len(ahead) <= lookahead and ix + len(ahead) < len(
+                        file_chunks
+                    ):
+                        ahead.append(
+                            submit_in_context(
+                                executor,
+                                initialize_fits_chunk,
+                                chunk=file_chunks[ix + len(ahead)],
+                                header_guess=header_guess,
+                                **init_kwargs,
+                            )
+                        )
+                    metadata = ahead.popleft().result()
+                if header_guess is not None:
+                    # size later chunks' first waves from the headers just read
+                    header_guess = max(
+                        m["header_bytes"] for m in metadata.values()
+                    )
+                plans = merge_chunk_metadata(
+                    target_groups, metadata, share_wcs, exptime_field
+                )
+                monitor.note(
+                    "initialized images",
+                    loud=verbose > 1,
+                    images=len(chunk) * len(bands),
+                )
+                if dump_to is None:
+                    outpath = None
+                else:
+                    outpath = Path(dump_to, f"{name}_{ix}_{tag}")
+                cut_kwargs = {
+                    "loader": loader,
+                    "hdu_indices": hdu_indices,
+                    "threads": threads["cut"],
+                    "executor": pools["cut"],
+                }
+                chunk_cuts = cut_and_dump(
+                    plans, cut_kwargs, monitor, return_cuts, verbose, outpath
+                )
+            n_cuts += len(chunk_cuts)
+            yield chunk_cuts
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        shutdown_worker_pools(pools | {"init": init_pool})
+    monitor.note(
+        "made cuts", total=True, cuts=n_cuts, images=len(ids) * len(bands)
+    )
+    if verbose > 0:
+        print(
+            f"made {n_cuts} cuts from {len(ids) * len(bands)} images, "
+            f"{roundstring(summarize_stat(monitor.stat))}"
         )
-        plans = merge_chunk_metadata(
-            target_groups, metadata, share_wcs, exptime_field
+    return monitor.log
+
+
+def bulk_skycut(
+    ids,
+    targets,
+    bands,
+    chunker,
+    kwarg_assembler,
+    hdu_indices=(1,),
+    data_root=os.getcwd(),
+    dump_to=None,
+    loader=None,
+    return_cuts=False,
+    threads=MappingProxyType({"image": None, "cut": None}),
+    verbose=1,
+    chunksize=40,
+    name="chunk",
+    share_wcs=False,
+    exptime_field="EXPTIME",
+    header_guess=None,
+    lookahead=0,
+    workers=None,
+    log_capacity=None,
+):
+    """
+    make cutouts around targets from chunks of images, returning all of
+    them at once, along with a log. see stream_skycut() for the meanings
+    of the arguments.
+    """
+    results, stream = [], stream_skycut(
+        ids,
+        targets,
+        bands,
+        chunker,
+        kwarg_assembler,
+        hdu_indices=hdu_indices,
+        data_root=data_root,
+        dump_to=dump_to,
+        loader=loader,
+        return_cuts=return_cuts,
+        threads=threads,
+        verbose=verbose,
+        chunksize=chunksize,
+        name=name,
+        share_wcs=share_wcs,
+        exptime_field=exptime_field,
+        header_guess=header_guess,
+        lookahead=lookahead,
+        workers=workers,
+        log_capacity=log_capacity,
+    )
+    while True:
+        try:
+            results += next(stream)
+        except StopIteration as stop:
+            return results, stop.value
+
+
+def skycut_photometry(
+    ids,
+    targets,
+    bands,
+    aperture_radius_arcsec=12.8,
+    fields=PHOTOMETRY_FIELDS,
+    **skycut_kwargs,
+):
+    """
+    fused cut-and-measure version of bulk_skycut() followed by
+    extract_cutout_photometry(): measure each chunk's cutouts as soon as
+    they are made, keep only per-object magnitudes, and drop the pixels.
+    PS1 cutouts are converted to flux and measured right away. GALEX cutouts
+    are folded into a running exposure-weighted coadd for their object as
+    they arrive (see subset.science.galex_utils.start_coadd()), which is
+    measured once the object's last eclipse has been cut. objects that
+    never get all their expected GALEX cuts (a cut failed, or an eclipse
+    lacks that band) are measured from the cuts they did get, with a
+    warning, once the stream ends. remaining arguments are passed to
+    stream_skycut().
+    returns {obj_id: {fields..., "<band>_mag": ...}} and the log; pass the
+    results for each survey to merge_photometry().
+    """
+    results, coadds = {}, {}
+    # number of cutouts to expect for each GALEX object and band
+    id_set = set(ids)
+    expected = {
+        (target["obj_id"], band): len(id_set.intersection(target["galex"]))
+        for target in targets
+        for band in bands
+        if band in ("NUV", "FUV")
+    }
+    stream = stream_skycut(
+        ids, targets, bands, **(skycut_kwargs | {"return_cuts": True})
+    )
+    while True:
+        try:
+            chunk_cuts = next(stream)
+        except StopIteration as stop:
+            log = stop.value
+            break
+        measurable = []
+        for cut in chunk_cuts:
+            results.setdefault(
+                cut["obj_id"], {k: v for k, v in cut.items() if k in fields}
+            )
+            if cut["band"] not in ("NUV", "FUV"):
+                cut["array"] = ps1_stack2flux(
+                    cut.pop("arrays")[0], cut["header"]
+                )
+                measurable.append(cut)
+                continue
+            key = (cut["obj_id"], cut["band"])
+            if key not in coadds:
+                coadds[key] = start_coadd(cut)
+            else:
+                fold_into_coadd(coadds[key], cut)
+            if coadds[key]["n_cuts"] == expected[key]:
+                measurable.append(finish_coadd(coadds.pop(key)))
+        _measure_records(measurable, results, aperture_radius_arcsec)
+        # nothing but the magnitudes outlives this chunk
+        del chunk_cuts, measurable
+    if len(coadds) > 0:
+        warnings.warn(
+            f"{len(coadds)} GALEX object/band coadds got fewer cuts than "
+            f"expected; measuring them from the cuts they got: "
+            f"{sorted(coadds, key=str)}"
         )
-        note(
-            f"initialized {len(chunk) * len(bands)} images,{stat()}",
-            verbose > 1,
+        _measure_records(
+            [finish_coadd(coadd) for coadd in coadds.values()],
+            results,
+            aperture_radius_arcsec,
         )
-        if dump_to is None:
-            outpath = None
-        else:
-            outpath = Path(dump_to, f"{name}_{ix}_{tag}")
-        cut_kwargs = {
-            "loader": loader,
-            "hdu_indices": hdu_indices,
-            "threads": threads["cut"],
-        }
-        results += cut_and_dump(
-            plans, cut_kwargs, stat, note, return_cuts, verbose, outpath
+    return results, log
+
+
+def _measure_records(records, results, aperture_radius_arcsec):
+    """add magnitudes of PS1 cut records and GALEX coadds to results"""
+    counts = batched_aperture_sums(records, aperture_radius_arcsec)
+    for record, record_counts in zip(records, counts):
+        results[record["obj_id"]][f"{record['band']}_mag"] = band_magnitude(
+            record, record_counts
         )
-    note(
-        f"made {len(results)} cuts from {len(ids) * len(bands)} "
-        f"images,{roundstring(summarize_stat(stat))}",
-        verbose > 0,
-    )
-    return results, note(eject=True)
+
+
+def merge_photometry(*survey_results):
+    """
+    combine per-object results from skycut_photometry() runs (e.g. one for
+    PS1 and one for GALEX) into the table extract_cutout_photometry() makes
+    """
+    merged = {}
+    for results in survey_results:
+        for obj_id, result in results.items():
+            merged[obj_id] = merged.get(obj_id, {}) | result
+    return compute_uv_mag_offset(pd.DataFrame(list(merged.values())))
 
 
 def ps_stack_norm(array, low=25, high=99.9):
@@ -298,6 +601,27 @@ def get_corresponding_images(targets, available_eclipses=None):
     return ps1_stacks, galex_visits
 
 
+def _nearest_indices(in_size: int, out_size: int) -> np.ndarray:
+    """
+    source indices for nearest-neighbor resampling of an axis from in_size
+    to out_size pixels, matching skimage.transform.resize(order=0)
+    (pixel centers map to pixel centers; ties round up)
+    """
+    scale = in_size / out_size
+    centers = (np.arange(out_size) + 0.5) * scale - 0.5
+    return np.clip(np.floor(centers + 0.5), 0, in_size - 1).astype(np.intp)
+
+
+def upsample_nearest(stack: np.ndarray, shape: tuple[int, int]) -> np.ndarray:
+    """
+    nearest-neighbor resample a stack of same-shape 2D images (axis 0
+    indexes images) to shape, with one gather per axis for the whole stack
+    """
+    rows = _nearest_indices(stack.shape[1], shape[0])
+    columns = _nearest_indices(stack.shape[2], shape[1])
+    return stack.take(rows, axis=1).take(columns, axis=2)
+
+
 # TODO, maybe: generalize to work with other GALEX & PAN-STARRS bands
 def cutouts_to_channels(cutouts):
     """
@@ -306,31 +630,37 @@ def cutouts_to_channels(cutouts):
     upsample GALEX cutouts to fit PAN-STARRS cutouts, and return them in a
     data structure suitable for scaling and stacking into RGB images.
     """
-    channel_dict = {}
-    for obj_id in set(map(get("obj_id"), cutouts)):
-        matches = [c for c in cutouts if c["obj_id"] == obj_id]
-        nuv_band = [c for c in matches if c["band"] == "NUV"]
-        if len(nuv_band) == 0:
+    # one pass to index cutouts by object and band
+    index = {}
+    for cut in cutouts:
+        index.setdefault(cut["obj_id"], {}).setdefault(cut["band"], [])
+        index[cut["obj_id"]][cut["band"]].append(cut)
+    # objects whose NUV and g cutouts have the same shapes are upsampled
+    # together
+    groups, channel_dict = {}, {}
+    for obj_id, bands in index.items():
+        if len(bands.get("NUV", [])) == 0:
             print(f"no valid GALEX coadd for {obj_id}")
             continue
-        z_band = [c for c in matches if c["band"] == "z"]
-        g_band = [c for c in matches if c["band"] == "g"]
-        assert all([len(b) == 1 for b in (nuv_band, z_band, g_band)])
-        nuv_cut = nuv_band[0]["array"]
-        z_cut = z_band[0]["array"]
-        g_cut = g_band[0]["array"]
+        assert all(len(bands.get(b, [])) == 1 for b in ("NUV", "z", "g"))
+        nuv_cut = bands["NUV"][0]["array"]
+        z_cut, g_cut = bands["z"][0]["array"], bands["g"][0]["array"]
         assert z_cut.shape == g_cut.shape
-        # fortunately, ps1 and galex both use gnomonic projections,
-        # so little spatial distortion is added by stretching them to fit
-        # one another. we don't care about meticulous pixel positioning,
-        # because the pixels of these images don't actually represent
-        # physical resolving elements, so it's fine to just use a generic
-        # upsampling function (the images are just for visualization anyway).
-        # TODO: does the anti_aliasing kwarg do anything here?
-        nuv_upsample = resize(
-            nuv_cut, g_cut.shape, order=0, anti_aliasing=False
-        )
-        channel_dict[obj_id] = {"z": z_cut, "g": g_cut, "nuv": nuv_upsample}
+        channel_dict[obj_id] = {"z": z_cut, "g": g_cut, "nuv": None}
+        groups.setdefault((nuv_cut.shape, g_cut.shape), []).append(obj_id)
+    # fortunately, ps1 and galex both use gnomonic projections,
+    # so little spatial distortion is added by stretching them to fit
+    # one another. we don't care about meticulous pixel positioning,
+    # because the pixels of these images don't actually represent
+    # physical resolving elements, so it's fine to just use a generic
+    # upsampling function (the images are just for visualization anyway).
+    for (nuv_shape, g_shape), obj_ids in groups.items():
+        stack = np.empty((len(obj_ids), *nuv_shape), dtype=np.float64)
+        for ix, obj_id in enumerate(obj_ids):
+            stack[ix] = index[obj_id]["NUV"][0]["array"]
+        upsampled = upsample_nearest(stack, g_shape)
+        for obj_id, nuv_upsample in zip(obj_ids, upsampled):
+            channel_dict[obj_id]["nuv"] = nuv_upsample
     return channel_dict
 
 
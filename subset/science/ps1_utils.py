@@ -134,6 +134,13 @@ def ps1_chunker(stacks, targets, bands, chunksize=40):
     return stack_chunks, target_groups
 
 
+# header keywords needed downstream of bulk_skycut() for PS1 stacks (in
+# addition to WCS keywords): exposure time and asinh scaling parameters.
+# only ranged loaders skim them; others read whole headers (see
+# science_utils.agnostic_fits_skim)
+PS1_SKIM_KEYWORDS = ("EXPTIME", "BOFFSET", "BSOFTEN")
+
+
 def ps1_chunk_kwargs(stack, band, data_root, loader, bands):
     # all ps1 stack images associated with a sky cell / proj cell should
     # have the same wcs no matter their bands, so don't waste time
@@ -145,6 +152,7 @@ def ps1_chunk_kwargs(stack, band, data_root, loader, bands):
         "loader": loader,
         "hdu_indices": (1,),
         "band": band,
+        "skim_keywords": PS1_SKIM_KEYWORDS,
     }
     return stack_init_params
 
@@ -1,21 +1,59 @@
+from functools import cache, partial
 from typing import Sequence, Union
 
-from astropy.wcs import WCS
 import numpy as np
 from gPhoton.io.fits_utils import AgnosticHDUL
 from photutils import CircularAperture
 
-from subset.utilz.fits import extract_wcs_keywords
+from subset.utilz.header_blocks import skim_fits_header
+from subset.utilz.ranged_fits import RangedFITS
+from subset.utilz.wcs_cache import cached_wcs
 
 
-def agnostic_fits_skim(path, loader, get_wcs=True, hdu_indices=(0,), **kwargs):
-    metadata = {
-        "header": AgnosticHDUL(loader(path))[hdu_indices[0]].header,
-        "path": path,
-        **kwargs,
-    }
+def _unwrap_loader(loader):
+    """a (possibly partially evaluated) loader's function and keywords"""
+    keywords = {}
+    while isinstance(loader, partial):
+        keywords = loader.keywords | keywords
+        loader = loader.func
+    return loader, keywords
+
+
+def agnostic_fits_skim(
+    path,
+    loader,
+    get_wcs=True,
+    hdu_indices=(0,),
+    layouts=None,
+    skim_keywords=None,
+    **kwargs,
+):
+    """
+    get the header (and optionally WCS) of the first of hdu_indices. if
+    RangedFITS-style layouts for the file have already been read (e.g. by
+    subset.utilz.header_prefetch), take the header from them rather than
+    opening the file. otherwise, if skim_keywords is not None and loader
+    is a ranged loader (RangedFITS), read only those keywords (plus WCS and
+    structural keywords) straight from the header blocks, with the
+    loader's fsspec_kwargs, without building a header object. other
+    loaders always read the header themselves.
+    """
+    loader_func, loader_kwargs = _unwrap_loader(loader)
+    if layouts is not None:
+        header = layouts[hdu_indices[0]]["header"]
+    elif skim_keywords is not None and loader_func is RangedFITS:
+        header = skim_fits_header(
+            path,
+            hdu_indices[0],
+            skim_keywords,
+            fsspec_kwargs=loader_kwargs.get("fsspec_kwargs"),
+        )
+    else:
+        header = AgnosticHDUL(loader(path))[hdu_indices[0]].header
+    metadata = {"header": header, "path": path, **kwargs}
     if get_wcs is True:
-        metadata["system"] = WCS(extract_wcs_keywords(metadata["header"]))
+        # files sharing a projection share a (read-only) WCS object
+        metadata["system"] = cached_wcs(metadata["header"])
     return metadata
 
 
@@ -35,6 +73,96 @@ def centered_aperture(cut_record, radius_arcsec):
     )
 
 
+def _segment_integral(x, h, r):
+    """
+    antiderivative in x of the height of a circle of radius r (centered on
+    the origin) above the line y = h
+    """
+    return 0.5 * (
+        np.sqrt(np.clip(r ** 2 - x ** 2, 0, None)) * x
+        + r ** 2 * np.arcsin(np.clip(x / r, -1, 1))
+        - 2 * h * x
+    )
+
+
+def _upper_overlap(x0, x1, h, r):
+    """area of the circle between x0 and x1 and above y = h (h >= 0)"""
+    half_chord = np.sqrt(np.clip(r ** 2 - h ** 2, 0, None))
+    return _segment_integral(
+        np.clip(x1, -half_chord, half_chord), h, r
+    ) - _segment_integral(np.clip(x0, -half_chord, half_chord), h, r)
+
+
+def circle_box_overlap(x0, x1, y0, y1, r):
+    """
+    exact area of overlap between a circle of radius r centered on the
+    origin and the boxes [x0, x1] x [y0, y1] (vectorized)
+    """
+    overlap = np.zeros(np.broadcast(x0, x1, y0, y1).shape)
+    # the parts of each box above and (mirrored) below the x axis
+    for low, high in ((y0, y1), (-y1, -y0)):
+        low, high = np.clip(low, 0, None), np.clip(high, 0, None)
+        overlap += _upper_overlap(x0, x1, low, r) - _upper_overlap(
+            x0, x1, high, r
+        )
+    return overlap
+
+
+@cache
+def aperture_weights(
+    shape: tuple[int, int], degrees_per_pixel: float, radius_arcsec: float
+) -> tuple[np.ndarray, tuple[slice, slice]]:
+    """
+    fractional-overlap weights of the circular aperture centered_aperture()
+    would make for a cutout of this shape and pixel scale -- equivalent to
+    its 'exact' photutils aperture mask -- trimmed to the aperture's
+    bounding box, along with the slices of the cutout that box covers
+    """
+    radius = radius_arcsec / 3600 / degrees_per_pixel
+    # photutils puts pixel centers at integer coordinates
+    y, x = np.ogrid[: shape[0], : shape[1]]
+    x, y = x - shape[1] / 2, y - shape[0] / 2
+    weights = circle_box_overlap(x - 0.5, x + 0.5, y - 0.5, y + 0.5, radius)
+    rows, columns = np.nonzero(weights)
+    if len(rows) == 0:
+        box = (slice(0, 0), slice(0, 0))
+    else:
+        box = (
+            slice(int(rows.min()), int(rows.max()) + 1),
+            slice(int(columns.min()), int(columns.max()) + 1),
+        )
+    weights = weights[box].copy()
+    weights.flags.writeable = False
+    return weights, box
+
+
+def batched_aperture_sums(
+    cut_records: Sequence[dict], radius_arcsec: float, batch_size: int = 256
+) -> np.ndarray:
+    """
+    sums of the values of each cut record's "array" in a circular aperture
+    centered on it, as computed by photutils.aperture_photometry() with
+    centered_aperture(). same-shape, same-scale cutouts are stacked (up to
+    batch_size at a time) and summed in one reduction against a cached
+    weight mask.
+    """
+    sums = np.empty(len(cut_records))
+    groups = {}
+    for ix, record in enumerate(cut_records):
+        # the CDELTs astropy would write in system.to_header()
+        scale = float(np.abs(record["system"].wcs.cdelt).mean())
+        groups.setdefault((record["array"].shape, scale), []).append(ix)
+    for (shape, scale), indices in groups.items():
+        weights, box = aperture_weights(shape, scale, radius_arcsec)
+        for start in range(0, len(indices), batch_size):
+            batch = indices[start:start + batch_size]
+            stack = np.stack([cut_records[ix]["array"][box] for ix in batch])
+            sums[batch] = np.tensordot(
+                stack.astype(np.float64, copy=False), weights, axes=2
+            )
+    return sums
+
+
 # NOTE: The following visualization-support functions are vendored from
 # marslab (https://github.com/MillionConcepts/marslab); its license is
 # included by reference.
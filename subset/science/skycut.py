@@ -0,0 +1,183 @@
+"""
+cut sky-aligned boxes out of images. this does the same job as
+gPhoton.coadd.cut_skyboxes, but projects the corners of every target in a
+chunk to pixel space up front, in one vectorized pass per WCS (using the
+TAN fast path in subset.utilz.tan_wcs where possible), rather than target
+by target through astropy.wcs. workers then only need to slice.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from itertools import chain
+from multiprocessing import Pool
+from typing import Callable, Optional, Sequence
+
+from cytoolz import groupby
+import numpy as np
+
+from subset.utilz.generic import crudely_find_library
+from subset.utilz.shm_arena import ALIGNMENT, SharedArena, write_to_span
+from subset.utilz import tracing
+from subset.utilz.tan_wcs import tan_system, world_to_pixel
+from subset.utilz.workers import apply_in_context, submit_in_context
+
+
+def skybox_bounds(plans: Sequence[dict]) -> list[tuple[int, ...]]:
+    """
+    pixel bounds (x0, x1, y0, y1) of the sky box described by each plan's
+    "ra", "dec", "ra_x", and "dec_x" (degrees) in its "system". like
+    gPhoton.coords.wcs.sky_box_to_image_box, bounds are inclusive, and the
+    box's width in RA is not scaled by cos(dec).
+    """
+    bounds = [None for _ in plans]
+    # plans that share a WCS object (see subset.utilz.wcs_cache) are
+    # projected together
+    by_system = groupby(lambda ix: id(plans[ix]["system"]), range(len(plans)))
+    for indices in by_system.values():
+        system = plans[indices[0]]["system"]
+        ra, dec, ra_x, dec_x = (
+            np.array([plans[ix][k] for ix in indices], dtype=np.float64)
+            for k in ("ra", "dec", "ra_x", "dec_x")
+        )
+        ra_offsets = np.stack([-ra_x, ra_x, -ra_x, ra_x], axis=1) / 2
+        dec_offsets = np.stack([-dec_x, -dec_x, dec_x, dec_x], axis=1) / 2
+        x, y = world_to_pixel(
+            system,
+            (ra[:, None] + ra_offsets).ravel(),
+            (dec[:, None] + dec_offsets).ravel(),
+            tan_system(system),
+        )
+        x, y = np.reshape(x, (-1, 4)), np.reshape(y, (-1, 4))
+        corners = np.stack(
+            [
+                np.trunc(x.min(axis=1)),
+                np.trunc(x.max(axis=1)) + 1,
+                np.trunc(y.min(axis=1)),
+                np.trunc(y.max(axis=1)) + 1,
+            ],
+            axis=1,
+        )
+        for ix, box in zip(indices, corners.astype(np.int64)):
+            bounds[ix] = tuple(int(c) for c in box)
+    return bounds
+
+
+def _box_slices(box: tuple[int, ...]) -> tuple[slice, slice]:
+    x0, x1, y0, y1 = box
+    return slice(max(y0, 0), y1 + 1), slice(max(x0, 0), x1 + 1)
+
+
+def _box_bytes(box: tuple[int, ...], n_hdus: int) -> int:
+    """upper bound on the size of a box's cuts (8-byte pixels)"""
+    x0, x1, y0, y1 = box
+    rows = max(y1 + 1 - max(y0, 0), 0)
+    columns = max(x1 + 1 - max(x0, 0), 0)
+    return (rows * columns * 8 + ALIGNMENT) * n_hdus
+
+
+def cuts_from_file(
+    path: str,
+    boxes: Sequence[tuple[int, ...]],
+    loader: Callable,
+    hdu_indices: Sequence[int] = (1,),
+    span: Optional[tuple[str, int, int]] = None,
+) -> list[list]:
+    """
+    cut pixel boxes (as returned by skybox_bounds) from HDUs of one file.
+    returns a list of arrays (one per HDU) for each box. if span (a
+    reserved span of a SharedArena) is passed, the arrays are written into
+    it, and descriptors of them are returned instead.
+    """
+    with tracing.span("open file", path=str(path)):
+        hdul = loader(path)
+    library = crudely_find_library(loader)
+    slices = [_box_slices(box) for box in boxes]
+    arrays = [[] for _ in boxes]
+    for hdu_ix in hdu_indices:
+        with tracing.span("cut hdu", path=str(path), hdu=hdu_ix):
+            handle = hdul[hdu_ix]
+            if library == "astropy":
+                handle = handle.section
+            if hasattr(handle, "cut_many"):
+                # one coalesced read plan for every box in this HDU
+                hdu_cuts, _ = handle.cut_many(slices)
+            else:
+                hdu_cuts = [np.array(handle[s]) for s in slices]
+        for box_arrays, cut in zip(arrays, hdu_cuts):
+            box_arrays.append(cut)
+    if hasattr(hdul, "close"):
+        hdul.close()
+    if span is not None:
+        packed = iter(write_to_span(span, list(chain(*arrays))))
+        arrays = [[next(packed) for _ in box] for box in arrays]
+    return arrays
+
+
+def cut_skyboxes(
+    plans: Sequence[dict],
+    loader: Callable,
+    hdu_indices: Sequence[int] = (1,),
+    threads: Optional[int] = None,
+    executor: Optional[Executor] = None,
+    shared_memory: bool = True,
+) -> list[dict]:
+    """
+    cut the sky box described by each plan (see skybox_bounds) from the
+    file at its "path". returns a dict of "arrays" and "coords" for each
+    plan, in order. files are cut in executor if one is passed (see
+    subset.utilz.workers); otherwise, if threads is not None, in a new
+    process pool. if shared_memory is True, worker processes return cuts
+    through a SharedArena (see subset.utilz.shm_arena) rather than by
+    pickling them; the returned arrays are then (writable) views of it. if
+    there is not enough shared memory for the arena, cuts are pickled.
+    """
+    bounds = skybox_bounds(plans)
+    by_path = groupby(lambda ix: plans[ix]["path"], range(len(plans)))
+    pool = Pool(threads) if threads is not None and executor is None else None
+    arena = None
+    if shared_memory is True and (
+        pool is not None or isinstance(executor, ProcessPoolExecutor)
+    ):
+        try:
+            arena = SharedArena(
+                sum(
+                    _box_bytes(box, len(hdu_indices)) + ALIGNMENT
+                    for box in bounds
+                )
+            )
+        except OSError:
+            # e.g. /dev/shm is too small for this chunk's cuts
+            arena = None
+    results = {}
+    try:
+        for path, indices in by_path.items():
+            boxes = [bounds[ix] for ix in indices]
+            span = None
+            if arena is not None:
+                span = arena.reserve(
+                    sum(_box_bytes(box, len(hdu_indices)) for box in boxes)
+                )
+            args = (path, boxes, loader, hdu_indices, span)
+            if executor is not None:
+                results[path] = submit_in_context(
+                    executor, cuts_from_file, *args
+                )
+            elif pool is not None:
+                results[path] = apply_in_context(pool, cuts_from_file, args)
+            else:
+                results[path] = cuts_from_file(*args)
+        if executor is not None:
+            results = {k: v.result() for k, v in results.items()}
+        elif pool is not None:
+            pool.close()
+            pool.join()
+            results = {k: v.get() for k, v in results.items()}
+    finally:
+        if arena is not None:
+            # views made below stay valid after this
+            arena.release()
+    cuts = [None for _ in plans]
+    for path, indices in by_path.items():
+        for ix, arrays in zip(indices, results[path]):
+            if arena is not None:
+                arrays = [arena.unpack(a) for a in arrays]
+            cuts[ix] = {"arrays": arrays, "coords": bounds[ix]}
+    return cuts
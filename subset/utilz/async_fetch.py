@@ -0,0 +1,253 @@
+"""
+asynchronous byte-range fetching for bulk cutouts. runs thousands of
+(object, byte range) requests from a single event loop over a bounded pool
+of keep-alive connections, rather than spending a process or thread on each
+request in flight -- fetching cutouts is mostly waiting on the network.
+
+HTTP(S) URLs are fetched with aiohttp. s3:// URLs are fetched with s3fs's
+native async interface, so requests are signed if credentials are given.
+both are optional dependencies, imported only when needed. inside a
+tracing() context (see subset.utilz.tracing), every request is recorded
+as its own span.
+
+the blocking wrapper, fetch_ranges(), runs every call on one long-lived
+event loop per process, in a background thread, and reuses one
+RangeFetcher per set of fetcher settings across calls. connection pools
+and per-host limits therefore persist from one call to the next and are
+shared by every thread in the process.
+"""
+import asyncio
+import atexit
+import os
+import threading
+from typing import Optional, Sequence
+from urllib.parse import urlparse
+
+from subset.utilz.read_plan import plan_reads, slice_reads
+from subset.utilz.tracing import request_span
+
+# total connections open at once, across all hosts
+DEFAULT_MAX_CONNECTIONS = 128
+# requests in flight at once to any single host (or S3 bucket)
+DEFAULT_PER_HOST = 32
+DEFAULT_RETRIES = 3
+DEFAULT_TIMEOUT = 60  # seconds
+
+
+def _host(url: str) -> str:
+    """host (or S3 bucket) a URL points to, for concurrency limiting"""
+    return urlparse(url).netloc
+
+
+class RangeFetcher:
+    """
+    fetches byte ranges from many objects concurrently. use as an async
+    context manager: the connection pool lives as long as the context.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        per_host: int = DEFAULT_PER_HOST,
+        fsspec_kwargs: Optional[dict] = None,
+        retries: int = DEFAULT_RETRIES,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.fsspec_kwargs = {} if fsspec_kwargs is None else fsspec_kwargs
+        self.retries = retries
+        self.timeout = timeout
+        self.session, self.s3 = None, None
+        self._semaphores = {}
+
+    async def __aenter__(self):
+        import aiohttp
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections, limit_per_host=self.per_host
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *_):
+        await self.session.close()
+        # note that s3fs closes its own client when garbage-collected
+
+    async def _s3(self):
+        if self.s3 is None:
+            import fsspec
+
+            self.s3 = fsspec.filesystem(
+                "s3",
+                asynchronous=True,
+                skip_instance_cache=True,
+                **self.fsspec_kwargs,
+            )
+            await self.s3.set_session()
+        return self.s3
+
+    async def _get_http(self, url: str, start: int, stop: int) -> bytes:
+        headers = {"Range": f"bytes={start}-{stop - 1}"}
+        async with self.session.get(url, headers=headers) as response:
+            # 416: requested range lies entirely past the end of the object
+            if response.status == 416:
+                return b""
+            response.raise_for_status()
+            body = await response.read()
+            if response.status == 200:
+                # server ignored the Range header and sent the whole object
+                return body[start:stop]
+            return body
+
+    async def fetch_range(self, url: str, start: int, stop: int) -> bytes:
+        """fetch bytes [start, stop) of a single object"""
+        import aiohttp
+
+        if stop <= start:
+            return b""
+        host = _host(url)
+        if host not in self._semaphores:
+            self._semaphores[host] = asyncio.Semaphore(self.per_host)
+        async with self._semaphores[host]:
+            if url.startswith("s3://"):
+                # s3fs performs its own retries
+                s3 = await self._s3()
+                with request_span("GET", url=url, start=start, stop=stop):
+                    return await s3._cat_file(url, start=start, end=stop)
+            for attempt in range(self.retries + 1):
+                try:
+                    with request_span(
+                        "GET", url=url, start=start, stop=stop, attempt=attempt
+                    ):
+                        return await self._get_http(url, start, stop)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as ex:
+                    client_error = (
+                        isinstance(ex, aiohttp.ClientResponseError)
+                        and ex.status < 500
+                    )
+                    if client_error or attempt == self.retries:
+                        raise
+                    await asyncio.sleep(0.1 * 2 ** attempt)
+
+    async def fetch(
+        self,
+        requests: Sequence[Sequence],
+        latency: Optional[float] = None,
+        bandwidth: Optional[float] = None,
+        max_gap: Optional[int] = None,
+    ) -> list[memoryview]:
+        """
+        fetch a sequence of (url, start, stop) requests, returning a buffer
+        for each, in order. requests for each object are coalesced according
+        to the cost model in subset.utilz.read_plan (pass latency, bandwidth,
+        and/or max_gap to adjust it), and all resulting reads run
+        concurrently.
+        """
+        plan_kwargs = {
+            k: v
+            for k, v in zip(
+                ("latency", "bandwidth", "max_gap"),
+                (latency, bandwidth, max_gap),
+            )
+            if v is not None
+        }
+        by_url = {}
+        for ix, (url, start, stop) in enumerate(requests):
+            by_url.setdefault(url, []).append((ix, start, stop))
+        plans = {
+            url: plan_reads([r[1:] for r in reqs], **plan_kwargs)
+            for url, reqs in by_url.items()
+        }
+        tasks = {
+            url: [
+                asyncio.create_task(self.fetch_range(url, start, stop))
+                for start, stop in plan["reads"].tolist()
+            ]
+            for url, plan in plans.items()
+        }
+        buffers = [None for _ in requests]
+        for url, url_tasks in tasks.items():
+            views = slice_reads(plans[url], await asyncio.gather(*url_tasks))
+            for (ix, _, _), view in zip(by_url[url], views):
+                buffers[ix] = view
+        return buffers
+
+
+# the process's background event loop and its shared fetchers. remade in
+# forked children, which inherit neither the loop's thread nor its sockets
+_SHARED = {"pid": None, "loop": None, "fetchers": {}}
+_SHARED_LOCK = threading.Lock()
+
+
+def _shared_loop() -> asyncio.AbstractEventLoop:
+    with _SHARED_LOCK:
+        if _SHARED["pid"] != os.getpid():
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="range-fetcher", daemon=True
+            ).start()
+            _SHARED.update(pid=os.getpid(), loop=loop, fetchers={})
+        return _SHARED["loop"]
+
+
+async def _shared_fetcher(fetcher_kwargs: dict) -> RangeFetcher:
+    # only ever called on the shared loop, so needs no lock
+    key = repr(sorted(fetcher_kwargs.items()))
+    if key not in _SHARED["fetchers"]:
+        fetcher = RangeFetcher(**fetcher_kwargs)
+        _SHARED["fetchers"][key] = await fetcher.__aenter__()
+    return _SHARED["fetchers"][key]
+
+
+async def _fetch_ranges(requests, fetcher_kwargs, plan_kwargs):
+    fetcher = await _shared_fetcher(fetcher_kwargs)
+    return await fetcher.fetch(requests, **plan_kwargs)
+
+
+async def _close_fetchers():
+    fetchers = list(_SHARED["fetchers"].values())
+    _SHARED["fetchers"].clear()
+    for fetcher in fetchers:
+        await fetcher.__aexit__()
+
+
+@atexit.register
+def close_shared_fetchers():
+    """close the connection pools of the process's shared fetchers"""
+    with _SHARED_LOCK:
+        if _SHARED["pid"] != os.getpid() or not _SHARED["fetchers"]:
+            return
+        loop = _SHARED["loop"]
+    asyncio.run_coroutine_threadsafe(_close_fetchers(), loop).result()
+
+
+def fetch_ranges(
+    requests: Sequence[Sequence],
+    max_connections: int = DEFAULT_MAX_CONNECTIONS,
+    per_host: int = DEFAULT_PER_HOST,
+    fsspec_kwargs: Optional[dict] = None,
+    **plan_kwargs,
+) -> list[memoryview]:
+    """
+    blocking wrapper for RangeFetcher.fetch(), using the process's shared
+    fetcher for these settings (see the module docstring). works whether
+    or not an event loop is already running in the calling thread (e.g.,
+    in Jupyter). the returned buffers can be wrapped directly as arrays
+    with np.frombuffer.
+    """
+    coroutine = _fetch_ranges(
+        requests,
+        {
+            "max_connections": max_connections,
+            "per_host": per_host,
+            "fsspec_kwargs": fsspec_kwargs,
+        },
+        plan_kwargs,
+    )
+    return asyncio.run_coroutine_threadsafe(
+        coroutine, _shared_loop()
+    ).result()
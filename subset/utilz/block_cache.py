@@ -0,0 +1,227 @@
+"""
+two-tier block cache for remote reads. files are divided into fixed-size
+blocks, keyed by object identity (path plus size and ETag / mtime), which
+are kept in a bounded in-memory LRU and optionally in a size-capped
+directory on disk. repeated reads of the same headers and data blocks --
+e.g., from repeated benchmark cases or repeated science runs over the same
+PS1 skycells -- are then served without touching the network.
+"""
+from collections import OrderedDict
+import hashlib
+import io
+import os
+from pathlib import Path
+import threading
+from typing import Optional, Sequence, Union
+
+DEFAULT_BLOCK_SIZE = 256 * 1024
+DEFAULT_MEMORY_BYTES = 512 * 1024 ** 2
+DEFAULT_DISK_BYTES = 16 * 1024 ** 3
+
+
+class BlockCache:
+    """
+    LRU cache of file blocks. the memory tier holds up to memory_bytes;
+    if disk_path is given, blocks evicted from memory remain available on
+    disk until the directory exceeds disk_bytes, at which point the least
+    recently used blocks are deleted. counts of hits and misses are kept in
+    self.counts.
+    """
+
+    def __init__(
+        self,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        memory_bytes: int = DEFAULT_MEMORY_BYTES,
+        disk_path: Optional[Union[str, Path]] = None,
+        disk_bytes: int = DEFAULT_DISK_BYTES,
+    ):
+        self.block_size = block_size
+        self.memory_bytes, self.disk_bytes = memory_bytes, disk_bytes
+        self._memory, self._memory_used = OrderedDict(), 0
+        self._disk, self._disk_used = OrderedDict(), 0
+        self.disk_path = None if disk_path is None else Path(disk_path)
+        if self.disk_path is not None:
+            self.disk_path.mkdir(parents=True, exist_ok=True)
+            # pick up blocks left by previous processes, oldest first
+            files = sorted(
+                (f for f in os.scandir(self.disk_path) if f.is_file()),
+                key=lambda f: f.stat().st_mtime,
+            )
+            for file in files:
+                self._disk[file.name] = file.stat().st_size
+                self._disk_used += file.stat().st_size
+        self.counts = {"hits": 0, "disk_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def _block_name(self, key: str, block_ix: int) -> str:
+        return hashlib.sha1(
+            f"{key}:{self.block_size}:{block_ix}".encode()
+        ).hexdigest()
+
+    def _remember(self, name: str, block: bytes):
+        if name in self._memory:
+            self._memory.move_to_end(name)
+            return
+        self._memory[name] = block
+        self._memory_used += len(block)
+        while self._memory_used > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def _write_disk(self, name: str, block: bytes):
+        if name in self._disk:
+            return
+        # write-then-rename, so concurrent readers never see partial blocks
+        temp_path = Path(self.disk_path, f".{name}.{os.getpid()}")
+        temp_path.write_bytes(block)
+        os.replace(temp_path, Path(self.disk_path, name))
+        self._disk[name] = len(block)
+        self._disk_used += len(block)
+        while self._disk_used > self.disk_bytes:
+            evicted, size = self._disk.popitem(last=False)
+            Path(self.disk_path, evicted).unlink(missing_ok=True)
+            self._disk_used -= size
+
+    def get(self, key: str, block_ix: int) -> Optional[bytes]:
+        """get a cached block, or None if it isn't in either tier"""
+        name = self._block_name(key, block_ix)
+        with self._lock:
+            if name in self._memory:
+                self._memory.move_to_end(name)
+                self.counts["hits"] += 1
+                return self._memory[name]
+            if name in self._disk:
+                try:
+                    block = Path(self.disk_path, name).read_bytes()
+                except FileNotFoundError:
+                    # evicted by another process sharing the directory
+                    self._disk_used -= self._disk.pop(name)
+                else:
+                    self._disk.move_to_end(name)
+                    self._remember(name, block)
+                    self.counts["disk_hits"] += 1
+                    return block
+            self.counts["misses"] += 1
+            return None
+
+    def put(self, key: str, block_ix: int, block: bytes):
+        """add a block to both tiers"""
+        name = self._block_name(key, block_ix)
+        with self._lock:
+            self._remember(name, block)
+            if self.disk_path is not None:
+                self._write_disk(name, block)
+
+    def clear(self):
+        """empty the memory tier (the disk tier is left alone)"""
+        with self._lock:
+            self._memory, self._memory_used = OrderedDict(), 0
+
+
+class CachedSource:
+    """
+    wraps a byte-range source (see subset.utilz.byte_range) so that all
+    reads are made in whole blocks through a BlockCache. runs of
+    consecutive missing blocks are fetched with one request each.
+    """
+
+    def __init__(self, source, cache: BlockCache):
+        self.source, self.cache = source, cache
+        self.path = source.path
+        self._key = None
+
+    @property
+    def key(self) -> str:
+        if self._key is None:
+            self._key = self.source.identity
+        return self._key
+
+    @property
+    def size(self) -> int:
+        return self.source.size
+
+    @property
+    def identity(self) -> str:
+        return self.key
+
+    def _blocks(self, block_ixs: set[int]) -> dict[int, bytes]:
+        blocks = {ix: self.cache.get(self.key, ix) for ix in block_ixs}
+        missing = sorted(ix for ix, block in blocks.items() if block is None)
+        runs = []
+        for ix in missing:
+            if len(runs) > 0 and runs[-1][-1] == ix - 1:
+                runs[-1].append(ix)
+            else:
+                runs.append([ix])
+        size = self.cache.block_size
+        buffers = self.source.read_ranges(
+            [(run[0] * size, (run[-1] + 1) * size) for run in runs]
+        )
+        for run, buffer in zip(runs, buffers):
+            for offset, ix in enumerate(run):
+                block = bytes(buffer[offset * size:(offset + 1) * size])
+                self.cache.put(self.key, ix, block)
+                blocks[ix] = block
+        return blocks
+
+    def read_ranges(self, ranges: Sequence[Sequence[int]]) -> list[bytes]:
+        size = self.cache.block_size
+        spans = [
+            (start // size, -(-stop // size)) for start, stop in ranges
+        ]
+        blocks = self._blocks(
+            {ix for first, last in spans for ix in range(first, last)}
+        )
+        buffers = []
+        for (start, stop), (first, last) in zip(ranges, spans):
+            if stop <= start:
+                buffers.append(b"")
+                continue
+            joined = b"".join(blocks[ix] for ix in range(first, last))
+            buffers.append(
+                joined[start - first * size:stop - first * size]
+            )
+        return buffers
+
+    def read_range(self, start: int, stop: int) -> bytes:
+        return self.read_ranges([(start, stop)])[0]
+
+    def close(self):
+        self.source.close()
+
+
+_SHARED_CACHE = None
+
+
+def shared_block_cache() -> BlockCache:
+    """process-wide BlockCache used by the 'cached' loaders of make_loaders"""
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = BlockCache()
+    return _SHARED_CACHE
+
+
+def cached_astropy_open(
+    path: Union[str, Path],
+    block_cache: Optional[BlockCache] = None,
+    fsspec_kwargs: Optional[dict] = None,
+    **open_kwargs,
+):
+    """
+    astropy.io.fits.open, but reading the file through a BlockCache rather
+    than through fsspec or the local filesystem
+    """
+    import astropy.io.fits
+
+    from subset.utilz.byte_range import RangedFile, open_raw_source
+
+    block_cache = shared_block_cache() if block_cache is None else block_cache
+    source = CachedSource(open_raw_source(path, fsspec_kwargs), block_cache)
+    stream = io.BufferedReader(
+        RangedFile(source), buffer_size=block_cache.block_size
+    )
+    return astropy.io.fits.open(stream, **open_kwargs)
+
+
+# it returns astropy HDULists (see generic.crudely_find_library)
+cached_astropy_open.library = "astropy"
@@ -0,0 +1,236 @@
+"""
+columnar storage for cut records (as produced by bulk_skycut() and
+friends). records are written as Arrow IPC files: one row per record, with
+scalar fields and WCS keywords as ordinary columns, and cutout arrays as
+raw bytes plus dtype and shape. because IPC files can be memory-mapped,
+read_cuts() opens even very large outputs without deserializing them, and
+cut_arrays() views cutout data in place rather than copying it.
+"""
+import json
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+import numpy as np
+
+# fields of cut records that are not written as columns of their own
+SKIPPED_FIELDS = ("arrays", "array", "header", "system", "coords", "stat")
+COORD_COLUMNS = ("x0", "x1", "y0", "y1")
+ARRAY_COLUMNS = ("data", "dtype", "shape")
+SCALAR_TYPES = (str, int, float, bool, np.generic)
+# scalars taken from FITS headers, which parse as int or float depending on
+# how the card happens to be written; always stored as float64, so that
+# batches agree on their types
+FLOAT_FIELDS = ("exptime",)
+
+
+def _wcs_json(record: dict) -> Optional[str]:
+    if "header" not in record:
+        return None
+    from subset.utilz.fits import extract_wcs_keywords
+
+    return json.dumps(
+        {
+            k: v.item() if isinstance(v, np.generic) else v
+            for k, v in extract_wcs_keywords(record["header"]).items()
+        }
+    )
+
+
+def _record_arrays(record: dict) -> list[np.ndarray]:
+    arrays = record.get("arrays", [])
+    if "array" in record and len(arrays) == 0:
+        arrays = [record["array"]]
+    return [np.ascontiguousarray(a) for a in arrays]
+
+
+def cut_rows(records: Sequence[dict]) -> list[dict]:
+    """
+    flatten cut records into rows of scalar fields for cut_table(). fields
+    that are not scalars (lists, dicts, ...) are dropped, except for
+    "coords", which becomes the columns x0, x1, y0, and y1, and "header",
+    from which the WCS keywords are taken.
+    """
+    rows = []
+    for record in records:
+        row = {
+            k: v.item() if isinstance(v, np.generic) else v
+            for k, v in record.items()
+            if k not in SKIPPED_FIELDS and isinstance(v, SCALAR_TYPES)
+        }
+        row |= {k: float(row[k]) for k in FLOAT_FIELDS if k in row}
+        if "coords" in record:
+            row |= dict(zip(COORD_COLUMNS, map(int, record["coords"])))
+        row["wcs"] = _wcs_json(record)
+        rows.append(row)
+    return rows
+
+
+def _array_columns(records: Sequence[dict]) -> dict:
+    """
+    cutout arrays of records as list<large_binary> / list<string> /
+    list<list<int64>> columns. array bytes are packed into a single buffer
+    with one copy, rather than going through Python bytes objects.
+    """
+    import pyarrow as pa
+
+    per_record = [_record_arrays(record) for record in records]
+    flat = [a for arrays in per_record for a in arrays]
+    counts = np.array([len(arrays) for arrays in per_record])
+    list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int32)
+    sizes = np.array([a.nbytes for a in flat], dtype=np.int64)
+    byte_offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    values = np.empty(int(byte_offsets[-1]), dtype=np.uint8)
+    for array, start, size in zip(flat, byte_offsets, sizes):
+        values[start:start + size] = array.reshape(-1).view(np.uint8)
+    data = pa.LargeBinaryArray.from_buffers(
+        pa.large_binary(),
+        len(flat),
+        [None, pa.py_buffer(byte_offsets), pa.py_buffer(values)],
+    )
+    offsets = pa.array(list_offsets)
+    return {
+        "data": pa.ListArray.from_arrays(offsets, data),
+        "dtype": pa.ListArray.from_arrays(
+            offsets, pa.array([a.dtype.str for a in flat], pa.string())
+        ),
+        "shape": pa.ListArray.from_arrays(
+            offsets,
+            pa.array([list(a.shape) for a in flat], pa.list_(pa.int64())),
+        ),
+    }
+
+
+def _fixed_fields():
+    import pyarrow as pa
+
+    return [
+        pa.field("wcs", pa.string()),
+        pa.field("data", pa.list_(pa.large_binary())),
+        pa.field("dtype", pa.list_(pa.string())),
+        pa.field("shape", pa.list_(pa.list_(pa.int64()))),
+    ]
+
+
+def cut_table(records: Sequence[dict], schema=None):
+    """
+    make an Arrow table from cut records. if schema is None, the types of
+    scalar fields are inferred from the records. otherwise, scalar fields
+    are cast to the schema's types, and fields the records lack are null.
+    raises a ValueError, rather than dropping or truncating data, if the
+    records have fields the schema does not, or values that the cast would
+    change (e.g. 3.5 in an int64 column).
+    """
+    import pyarrow as pa
+
+    scalars = pa.Table.from_pylist(cut_rows(records))
+    if schema is None:
+        schema = pa.schema(
+            [*(f for f in scalars.schema if f.name != "wcs"), *_fixed_fields()]
+        )
+    extra = set(scalars.column_names).difference(schema.names)
+    if len(extra) > 0:
+        raise ValueError(
+            f"cut records have fields not in the schema: {sorted(extra)}"
+        )
+    scalar_schema = pa.schema(
+        [f for f in schema if f.name not in ARRAY_COLUMNS]
+    )
+    columns = []
+    for field in scalar_schema:
+        if field.name not in scalars.column_names:
+            columns.append(pa.nulls(len(records), field.type))
+            continue
+        column = scalars[field.name]
+        try:
+            columns.append(column.cast(field.type, safe=True))
+        except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as ex:
+            raise ValueError(
+                f"can't store {column.type} field {field.name} as "
+                f"{field.type}: {ex}"
+            ) from ex
+    table = pa.Table.from_arrays(columns, schema=scalar_schema)
+    for name, column in _array_columns(records).items():
+        table = table.append_column(schema.field(name), column)
+    return table
+
+
+class CutWriter:
+    """
+    incrementally write batches of cut records to an Arrow IPC file (e.g.
+    one batch per chunk from stream_skycut()). an IPC file has one schema,
+    so unless one is passed, it is inferred from the first batch, and
+    later batches must fit it (see cut_table()): write() raises a
+    ValueError on a field the first batch lacked (or had only as None)
+    rather than dropping it. pass a schema if batches may differ so.
+    """
+
+    def __init__(self, path: Union[str, Path], schema=None):
+        self.path = Path(path)
+        self._sink, self._writer, self.schema = None, None, schema
+
+    def write(self, records: Sequence[dict]):
+        import pyarrow as pa
+
+        if len(records) == 0:
+            return
+        table = cut_table(records, self.schema)
+        if self._writer is None:
+            self.schema = table.schema
+            self._sink = pa.OSFile(str(self.path), "wb")
+            self._writer = pa.ipc.new_file(self._sink, self.schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._sink.close()
+            self._writer, self._sink = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+def write_cuts(records: Sequence[dict], path: Union[str, Path]) -> Path:
+    """write cut records to an Arrow IPC file at path"""
+    with CutWriter(path) as writer:
+        writer.write(records)
+    return writer.path
+
+
+def read_cuts(path: Union[str, Path]):
+    """
+    memory-map an Arrow IPC file written by CutWriter / write_cuts(). no
+    data is read until it is used.
+    """
+    import pyarrow as pa
+
+    return pa.ipc.open_file(pa.memory_map(str(path), "r")).read_all()
+
+
+def cut_arrays(table, row: int) -> list[np.ndarray]:
+    """
+    the cutout arrays of one row of a table from read_cuts(), as read-only
+    numpy views of the (memory-mapped) file
+    """
+    data = table["data"][row].values
+    dtypes = table["dtype"][row].as_py()
+    shapes = table["shape"][row].as_py()
+    arrays = []
+    for ix, (dtype, shape) in enumerate(zip(dtypes, shapes)):
+        array = np.frombuffer(data[ix].as_buffer(), dtype=dtype)
+        array.flags.writeable = False
+        arrays.append(array.reshape(shape))
+    return arrays
+
+
+def cut_wcs(table, row: int):
+    """
+    astropy.wcs.WCS of the image one row of a table from read_cuts() was
+    cut from (its x0 / y0 columns give the cutout's offset in that image)
+    """
+    from subset.utilz.wcs_cache import cached_wcs
+
+    return cached_wcs(json.loads(table["wcs"][row].as_py()))
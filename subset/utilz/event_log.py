@@ -0,0 +1,228 @@
+"""
+structured, columnar event logs. EventMonitor is a stand-in for
+killscreen's Stopwatch / Netstat / CPUMonitor / notary combination that
+records each event as a row of numbers -- time, duration, network volume,
+CPU times, and any counts passed along with the event -- in an EventLog,
+rather than as a comma-joined string in a dict. event names and paths are
+interned as integer codes. an EventLog can either grow without limit or
+keep only its most recent rows (a ring buffer), and turns into a pandas
+DataFrame for vectorized post-processing.
+
+CPU times and network volume are read from /proc/stat and /proc/net/dev,
+so they are host-wide, like killscreen's; on systems without /proc, CPU
+times are this process's own and volume is NaN.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+CPU_FIELDS = (
+    "user",
+    "nice",
+    "system",
+    "idle",
+    "iowait",
+    "irq",
+    "softirq",
+    "steal",
+    "guest",
+    "guest_nice",
+)
+# rows are allocated this many at a time in unbounded logs
+BLOCK_SIZE = 1024
+
+
+def cpu_times() -> dict[str, float]:
+    """host-wide cumulative CPU times in seconds, keyed by cpu_<name>"""
+    try:
+        with open("/proc/stat") as stream:
+            ticks = stream.readline().split()[1:]
+    except OSError:
+        times = os.times()
+        return {"cpu_user": times.user, "cpu_system": times.system}
+    per_second = os.sysconf("SC_CLK_TCK")
+    return {
+        f"cpu_{name}": int(count) / per_second
+        for name, count in zip(CPU_FIELDS, ticks)
+    }
+
+
+def received_bytes(interface: Optional[str] = None) -> float:
+    """
+    cumulative bytes received on interface (or on all interfaces, including
+    loopback, if interface is None)
+    """
+    try:
+        with open("/proc/net/dev") as stream:
+            lines = stream.readlines()[2:]
+    except OSError:
+        return np.nan
+    total = 0
+    for line in lines:
+        name, counts = line.split(":", 1)
+        if interface is None or name.strip() == interface:
+            total += int(counts.split()[0])
+    return total
+
+
+class EventLog:
+    """
+    append-only columnar log of events. each row has an event name, a path
+    (either may be ""), and float columns; columns first seen in a later
+    row are NaN in earlier rows. if capacity is not None, only the most
+    recent capacity rows are kept. thread-safe.
+    """
+
+    def __init__(self, capacity: Optional[int] = None):
+        self.capacity = capacity
+        self._allocated = BLOCK_SIZE if capacity is None else capacity
+        # rows appended in total, including any overwritten since
+        self.appended = 0
+        self._codes = {
+            "event": np.zeros(self._allocated, dtype=np.int32),
+            "path": np.zeros(self._allocated, dtype=np.int32),
+        }
+        self._values = {name: [] for name in self._codes}
+        self._lookup = {name: {} for name in self._codes}
+        self._columns = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        if self.capacity is None:
+            return self.appended
+        return min(self.appended, self.capacity)
+
+    def _intern(self, kind: str, value: str) -> int:
+        lookup = self._lookup[kind]
+        if value not in lookup:
+            lookup[value] = len(self._values[kind])
+            self._values[kind].append(value)
+        return lookup[value]
+
+    def _grow(self):
+        extra = self._allocated
+        for name, codes in self._codes.items():
+            self._codes[name] = np.concatenate(
+                [codes, np.zeros(extra, dtype=codes.dtype)]
+            )
+        for name, column in self._columns.items():
+            self._columns[name] = np.concatenate(
+                [column, np.full(extra, np.nan)]
+            )
+        self._allocated += extra
+
+    def append(self, event: str, path: str = "", **fields: float):
+        with self._lock:
+            if self.capacity is None and self.appended == self._allocated:
+                self._grow()
+            row = self.appended % self._allocated
+            self._codes["event"][row] = self._intern("event", event)
+            self._codes["path"][row] = self._intern("path", str(path))
+            for name in fields:
+                if name not in self._columns:
+                    self._columns[name] = np.full(self._allocated, np.nan)
+            for name, column in self._columns.items():
+                column[row] = fields.get(name, np.nan)
+            self.appended += 1
+
+    def _order(self) -> np.ndarray:
+        """row indices, oldest first"""
+        if self.capacity is None or self.appended <= self.capacity:
+            return np.arange(len(self))
+        return np.roll(np.arange(self.capacity), -self.appended)
+
+    def to_frame(self):
+        """the log as a DataFrame, with event and path as categoricals"""
+        import pandas as pd
+
+        with self._lock:
+            order = self._order()
+            frame = {
+                name: pd.Categorical.from_codes(
+                    codes[order], categories=pd.Index(self._values[name])
+                )
+                for name, codes in self._codes.items()
+            }
+            frame |= {k: v[order] for k, v in self._columns.items()}
+        return pd.DataFrame(frame)
+
+
+class EventMonitor:
+    """
+    records events in an EventLog (a new one if log is None) along with
+    the time, network volume (MB), and CPU times since the last event, or,
+    for total=True events, since the monitor was made (or restart()ed).
+    """
+
+    def __init__(
+        self, log: Optional[EventLog] = None, interface: Optional[str] = None
+    ):
+        self.log = EventLog() if log is None else log
+        self.interface = interface
+        self.restart()
+
+    def _sample(self) -> dict[str, float]:
+        return {
+            "clock": time.perf_counter(),
+            "volume": received_bytes(self.interface) / 1e6,
+        } | cpu_times()
+
+    def restart(self):
+        self._start = self._last = self._sample()
+
+    def measure(self, total: bool = False) -> dict[str, float]:
+        """
+        duration, volume, and cpu_* times since the last measurement (or,
+        if total is True, since the start). only interval measurements
+        begin a new interval.
+        """
+        sample = self._sample()
+        since = self._start if total is True else self._last
+        if total is False:
+            self._last = sample
+        measured = {k: v - since[k] for k, v in sample.items()}
+        measured["duration"] = measured.pop("clock")
+        return measured
+
+    def note(
+        self,
+        event: str,
+        path: str = "",
+        loud: bool = False,
+        total: bool = False,
+        **fields: float,
+    ) -> dict[str, float]:
+        """record an event, with any extra numeric fields"""
+        measured = self.measure(total) | {"total": float(total)}
+        self.log.append(event, path, time=time.time(), **measured, **fields)
+        if loud is True:
+            parts = (event, str(path), self._format(measured, total))
+            print(" ".join(p for p in parts if p != ""))
+        return measured
+
+    @staticmethod
+    def _format(measured: dict, total: bool, simple_cpu=False) -> str:
+        prefix = "total " if total is True else ""
+        cpu = {
+            k.removeprefix("cpu_"): v
+            for k, v in measured.items()
+            if k.startswith("cpu_")
+        }
+        if simple_cpu is True:
+            idle = cpu.get("idle", 0)
+            cpu = {"idle": idle, "busy": sum(cpu.values()) - idle}
+        cpu_text = ";".join(f"{k} {v:.2f}" for k, v in cpu.items())
+        return (
+            f"{measured['duration']:.3f} {prefix}s,"
+            f"{measured['volume']:.3f} {prefix}MB,cpu {cpu_text}"
+        )
+
+    def stat(self, total: bool = False, simple_cpu: bool = False) -> str:
+        """
+        killscreen-style "duration,volume,cpu" string (see
+        subset.utilz.generic.summarize_stat), for printing
+        """
+        return self._format(self.measure(total), total, simple_cpu)
@@ -1,14 +1,13 @@
 """utility functions for occasional FITS manipulation"""
-from functools import reduce
+from functools import partial, reduce
 from operator import mul
 import os
-import re
 from pathlib import Path
-from typing import Sequence, Literal, Union, Callable
+from typing import Sequence, Literal, Union, Callable, Mapping, Optional
 
-from cytoolz import keyfilter
 from killscreen.monitors import make_monitors
 from subset.utilz.generic import crudely_find_library
+from subset.utilz.tracing import span
 
 
 def make_tiled_galex_object(
@@ -61,11 +60,11 @@ def imsz_from_header(header) -> tuple[int]:
     returns in 'reversed' order for numpy array indexing.
     """
     key_type = "ZNAXIS" if "ZNAXIS" in header.keys() else "NAXIS"
-    axis_entries: dict[str, int] = keyfilter(
-        lambda k: False if k is None else re.match(rf"{key_type}\d", k),
-        dict(header),
+    # look the axis keywords up directly rather than regex-filtering a copy
+    # of the whole header
+    return tuple(
+        header[f"{key_type}{n}"] for n in range(header[key_type], 0, -1)
     )
-    return tuple(reversed(axis_entries.values()))
 
 
 def fitsstat(path: Union[str, Path]) -> dict:
@@ -83,6 +82,9 @@ def fitsstat(path: Union[str, Path]) -> dict:
         hduinfo = hdu.fileinfo()
         hdu_info = {
             "size": hduinfo["datLoc"] - hduinfo["hdrLoc"] + hduinfo["datSpan"],
+            "header_loc": hduinfo["hdrLoc"],
+            "data_loc": hduinfo["datLoc"],
+            "data_span": hduinfo["datSpan"],
             "name": hdulinfo[hdu_ix][1],
             "hdutype": hdulinfo[hdu_ix][3],
             "dim": imsz_from_header(hdu.header),
@@ -109,6 +111,8 @@ def logged_fits_initializer(
     logged: bool = True,
     astropy_handle_attribute: str = "data",
     preload_hdus: bool = False,
+    layout_index: Optional[Mapping[str, list]] = None,
+    monitor=None,
 ):
     """
     initialize a FITS object using a passed 'loader' -- probably
@@ -116,14 +120,40 @@ def logged_fits_initializer(
     version of one of those. optionally also meticulously record time and
     network transfer involved at all stages of its initialization. At
     present, this function is primarily used for benchmarking.
+
+    if a layout index (see subset.utilz.layout_index) is passed, it is
+    handed to the loader, which must be a ranged loader. if the file is in
+    the index, no headers will be read from the file itself.
+
+    if an EventMonitor (see subset.utilz.event_log) is passed, events are
+    recorded with it, and the returned "log" and "stat" are its EventLog
+    and stat(); otherwise they come from killscreen monitors. the
+    "initialized wcs" event's wcs_cache_hit field is 1 if the WCS came from
+    the shared WCSCache and 0 if it was built.
     """
+    if layout_index is not None:
+        loader = partial(loader, layout_index=layout_index)
+    if monitor is None:
+        stat, note = make_monitors(fake=not logged)
+
+        # killscreen logs are strings; extra numeric fields are dropped
+        def record(event, loud, **_):
+            note(f"{event},{path},{stat()}", loud)
+
+    else:
+        stat = monitor.stat
+
+        def record(event, loud, **fields):
+            monitor.note(event, str(path), loud, **fields)
+
     # initialize fits HDU list object and read selected HDU's header
-    stat, note = make_monitors(fake=not logged)
-    hdul = loader(path)
-    note(f"init fits object,{path},{stat()}", verbose > 0)
+    with span("init fits object", path=str(path)):
+        hdul = loader(path)
+    record("init fits object", verbose > 0)
     library = crudely_find_library(loader)
-    header = get_header(hdul, hdu_indices[0], library)
-    note(f"got header,{path},{stat()}", verbose > 1)
+    with span("read header", path=str(path), hdu=hdu_indices[0]):
+        header = get_header(hdul, hdu_indices[0], library)
+    record("got header", verbose > 1)
     # TODO: this is a slightly weird hack to revert astropy's automatic
     #  translation of some FITS header values to astropy types. There might
     #  be a cleaner way to do this.
@@ -142,30 +172,37 @@ def logged_fits_initializer(
         output["path"] = output["path"]()
     if get_handles is True:
         # initialize selected HDU object and get its data 'handles'
-        output["handles"] = [hdul[hdu_ix] for hdu_ix in hdu_indices]
-        # fitsio exposes slices on HDU data by assigning a __getitem__ method
-        # directly to its HDU objects. astropy instead assigns __getitem__
-        # methods to attributes of HDU objects, so here we return an attribute
-        # rather than the HDU itself as the "handle". by default this is
-        # "data", but there are other attributes, notably "section", that also
-        # offer data access
-        if library == "astropy":
-            output["handles"] = [
-                getattr(h, astropy_handle_attribute) for h in output["handles"]
-            ]
-        note(f"got data handles,{path},{stat()}", loud=verbose > 1)
-        if preload_hdus is True:
+        with span("get data handles", path=str(path)):
+            handles = [hdul[hdu_ix] for hdu_ix in hdu_indices]
+            # fitsio exposes slices on HDU data by assigning a __getitem__
+            # method directly to its HDU objects. astropy instead assigns
+            # __getitem__ methods to attributes of HDU objects, so here we
+            # return an attribute rather than the HDU itself as the
+            # "handle". by default this is "data", but there are other
+            # attributes, notably "section", that also offer data access
             if library == "astropy":
-                [h[:].copy() for h in output["handles"]]
-            else:
-                [h.read() for h in output["handles"]]
-            note(f"preloaded hdus,{path},{stat()}", loud=verbose > 1)
+                handles = [
+                    getattr(h, astropy_handle_attribute) for h in handles
+                ]
+        output["handles"] = handles
+        record("got data handles", verbose > 1)
+        if preload_hdus is True:
+            with span("preload hdus", path=str(path)):
+                if library == "astropy":
+                    [h[:].copy() for h in output["handles"]]
+                else:
+                    [h.read() for h in output["handles"]]
+            record("preloaded hdus", verbose > 1)
     if get_wcs is True:
-        import astropy.wcs
+        from subset.utilz.wcs_cache import shared_wcs_cache
 
-        output["wcs"] = astropy.wcs.WCS(extract_wcs_keywords(header))
-        note(f"initialized wcs,{path},{stat()}", loud=verbose > 1)
-    output["log"] = note(None, eject=True)
+        with span("build wcs", path=str(path)):
+            output["wcs"], hit = shared_wcs_cache().lookup(header)
+        record("initialized wcs", verbose > 1, wcs_cache_hit=float(hit))
+    if monitor is None:
+        output["log"] = note(None, eject=True)
+    else:
+        output["log"] = monitor.log
     return output
 
 
@@ -174,9 +211,10 @@ def logged_fits_initializer(
 
 def get_header(hdul: Sequence, hdu_ix: int, library: str):
     """
-    fetch header from either an astropy or fitsio HDU list object
+    fetch header from either an astropy or fitsio HDU list object (or a
+    subset.utilz.ranged_fits.RangedFITS object, which mimics fitsio)
     """
-    if library == "fitsio":
+    if library in ("fitsio", "subset"):
         return hdul[hdu_ix].read_header()
     elif library == "astropy":
         return hdul[hdu_ix].header
@@ -206,7 +244,7 @@ def extract_wcs_keywords(header):
     wcs_words = ('CTYPE', 'CRVAL', 'CRPIX', 'CDELT', 'ZNAXIS', 'NAXIS', 'PC')
     keywords = {
         translate_pc_keyword(k): header[k] for k in header.keys()
-        if any([k.startswith(w) for w in wcs_words])
+        if k is not None and k.startswith(wcs_words)
     }
     # we don't care about the dimensions of compressed HDUs; we always want
     # the dimensions of the underlying image, and astropy.wcs does not
@@ -96,6 +96,31 @@ def make_loaders(*loader_names: str) -> dict[str, Callable]:
                 # this will probably fail on non-Linux systems and may fail
                 # in some Linux environments, depending on settings.
                 loaders[name] = partial(preload_from_shm, loaders[name])
+        elif "ranged" in name:
+            # computes byte offsets of requested slices from the HDU's
+            # layout and fetches only those ranges (or, for tile-compressed
+            # HDUs, only the tiles that intersect them); no astropy or fitsio
+            # file handling.
+            from subset.utilz.ranged_fits import RangedFITS
+
+            loaders[name] = RangedFITS
+        if "cached" in name:
+            # read through a process-wide, in-memory block cache, so that
+            # blocks fetched by one case are reused by the next.
+            # cfitsio does all its own I/O, so fitsio loaders can't be
+            # cached this way.
+            from subset.utilz.block_cache import (
+                cached_astropy_open,
+                shared_block_cache,
+            )
+
+            cache = shared_block_cache()
+            if "ranged" in name:
+                loaders[name] = partial(loaders[name], block_cache=cache)
+            elif "astropy" in name and "greedy" not in name:
+                loaders[name] = partial(cached_astropy_open, block_cache=cache)
+            else:
+                raise ValueError(f"{name} loaders cannot use a block cache")
     return loaders
 
 
@@ -116,7 +141,15 @@ def cleanup_greedy_shm(loader: Callable) -> bool:
 
 
 def parse_topline(log):
-    """parse top line of output log from skybox-slicing examples."""
+    """
+    parse top line of output log from skybox-slicing examples: an EventLog
+    (see subset.utilz.event_log), or a dict of killscreen log strings.
+    """
+    if not isinstance(log, dict):
+        total = log.to_frame().iloc[-1]
+        rate = total["cuts"] / total["duration"]
+        weight = total["volume"] / total["cuts"]
+        return round(rate, 2), round(weight, 2)
     total = next(reversed(log.values()))
     summary, duration, volume, _ = total.split(",")
     cut_count = int(re.search(r"\d+", summary).group())
@@ -180,8 +213,12 @@ def print_inline(text, blanks=60):
 def crudely_find_library(obj: Any) -> str:
     """
     attempt to determine the original library of an object, even if it is a
-    function that has been partially evaluated.
+    function that has been partially evaluated. functions that wrap another
+    library's loader (e.g. block_cache.cached_astropy_open) name that
+    library in a "library" attribute.
     """
+    if hasattr(obj, "library"):
+        return obj.library
     if isinstance(obj, partial):
         if len(obj.args) > 0:
             if isinstance(obj.args[0], Callable):
@@ -0,0 +1,142 @@
+"""
+random access into gzipped FITS files. a gzip stream can ordinarily only be
+read from the beginning, so taking a cut from the end of a .fits.gz file
+means decompressing everything before it. these utilities build (zran-style)
+checkpoint indices -- snapshots of decompressor state and the preceding
+32 KB window taken every `spacing` bytes of uncompressed output -- and
+store them in sidecar files. a reader can then resume decompression at the
+nearest checkpoint before any offset.
+
+the heavy lifting is done by indexed_gzip. compressed bytes are fetched
+through the byte-range sources in subset.utilz.byte_range, so this works for
+S3 objects and HTTP(S) URLs as well as local files.
+"""
+import io
+from pathlib import Path
+from typing import Optional, Sequence, Union
+
+from subset.utilz.byte_range import RangedFile, open_raw_source
+from subset.utilz.read_plan import plan_reads, slice_reads
+
+# one checkpoint per 4 MB of uncompressed data. each checkpoint costs
+# ~32 KB in the index, so this is ~1% overhead.
+DEFAULT_SPACING = 4 * 1024 ** 2
+# size of each read of compressed bytes from the underlying source
+DEFAULT_READBUF_SIZE = 1024 ** 2
+# read-ahead of uncompressed bytes. indexed_gzip's default is 4 * spacing,
+# which would mean decompressing 16 MB to get a single row of a cut.
+DEFAULT_BUFFER_SIZE = 64 * 1024
+GZIP_INDEX_SUFFIX = ".gzidx"
+
+
+def gzip_index_path(path: Union[str, Path]) -> str:
+    """default location of the checkpoint-index sidecar for a gzipped file"""
+    return f"{path}{GZIP_INDEX_SUFFIX}"
+
+
+def _open_sidecar(
+    index_path: Union[str, Path], mode: str, fsspec_kwargs: Optional[dict]
+):
+    index_path = str(index_path)
+    if index_path.startswith(("s3://", "http://", "https://")):
+        import fsspec
+
+        fsspec_kwargs = {} if fsspec_kwargs is None else fsspec_kwargs
+        return fsspec.open(index_path, mode, **fsspec_kwargs).open()
+    return open(index_path, mode)
+
+
+def build_gzip_index(
+    path: Union[str, Path],
+    index_path: Optional[Union[str, Path]] = None,
+    spacing: int = DEFAULT_SPACING,
+    fsspec_kwargs: Optional[dict] = None,
+) -> str:
+    """
+    decompress a gzipped file once, from start to finish, taking a
+    checkpoint every `spacing` bytes of uncompressed output, and write the
+    checkpoints to a sidecar at index_path (default: path + '.gzidx').
+    returns the path to the sidecar.
+    """
+    import indexed_gzip
+
+    index_path = gzip_index_path(path) if index_path is None else index_path
+    raw = RangedFile(open_raw_source(path, fsspec_kwargs))
+    gzfile = indexed_gzip.IndexedGzipFile(
+        fileobj=raw, spacing=spacing, readbuf_size=DEFAULT_READBUF_SIZE
+    )
+    try:
+        gzfile.build_full_index()
+        with _open_sidecar(index_path, "wb", fsspec_kwargs) as stream:
+            gzfile.export_index(fileobj=stream)
+    finally:
+        gzfile.close()
+        raw.close()
+    return str(index_path)
+
+
+class GzipIndexedSource:
+    """
+    byte-range reads from the _uncompressed_ contents of a gzipped file.
+    if a checkpoint index exists at index_path (default: path + '.gzidx'),
+    each read decompresses only from the nearest checkpoint before the
+    requested range; otherwise, checkpoints are built on the fly, so the
+    file is decompressed at most once, front to back, per source.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        index_path: Optional[Union[str, Path]] = None,
+        fsspec_kwargs: Optional[dict] = None,
+        spacing: int = DEFAULT_SPACING,
+    ):
+        import indexed_gzip
+
+        self.path, self.spacing = str(path), spacing
+        self._raw = RangedFile(open_raw_source(path, fsspec_kwargs))
+        self.gzfile = indexed_gzip.IndexedGzipFile(
+            fileobj=self._raw,
+            spacing=spacing,
+            readbuf_size=DEFAULT_READBUF_SIZE,
+            buffer_size=DEFAULT_BUFFER_SIZE,
+        )
+        if index_path is None:
+            index_path = gzip_index_path(path)
+        try:
+            with _open_sidecar(index_path, "rb", fsspec_kwargs) as stream:
+                self.gzfile.import_index(fileobj=stream)
+            self.indexed = True
+        except FileNotFoundError:
+            self.indexed = False
+        self._size = None
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.gzfile.seek(0, io.SEEK_END)
+        return self._size
+
+    @property
+    def identity(self) -> str:
+        return f"{self._raw.source.identity}:gunzip"
+
+    def read_range(self, start: int, stop: int) -> bytes:
+        if stop <= start:
+            return b""
+        self.gzfile.seek(start)
+        return self.gzfile.read(stop - start)
+
+    def read_ranges(self, ranges: Sequence[Sequence[int]]) -> list[bytes]:
+        # every seek restarts decompression from a checkpoint, which costs
+        # up to `spacing` bytes of decompression. so it is always cheaper to
+        # decompress straight through any shorter gap than to seek past it.
+        plan = plan_reads(ranges, max_gap=self.spacing)
+        buffers = [
+            self.read_range(start, stop) for start, stop in plan["reads"]
+        ]
+        return slice_reads(plan, buffers)
+
+    def close(self):
+        self.gzfile.close()
+        self._raw.close()
@@ -0,0 +1,248 @@
+"""
+fast parsing of raw FITS header blocks. header buffers are viewed as
+fixed-width arrays of 80-byte cards, so finding the END card, picking out
+cards that have values, and selecting cards by keyword are all vectorized;
+only the values of the cards actually wanted are interpreted in Python.
+nothing here builds an astropy Header or fitsio FITSHDR: headers are plain
+dicts of keyword: value.
+"""
+from functools import cache, reduce
+from operator import mul
+from pathlib import Path
+from typing import Collection, Optional, Union
+
+import numpy as np
+
+FITS_BLOCK = 2880
+CARD_LENGTH = 80
+# how many 2880-byte blocks to request at once while looking for the end
+# of a header. most headers in our test sets fit in 4 blocks; larger ones
+# just take an extra request or two.
+HEADER_READ_BLOCKS = 4
+END_KEYWORD = b"END     "
+CONTINUE_KEYWORD = b"CONTINUE"
+# keywords always retained by skim_header_blocks(), because they are needed
+# to find the data (and the next HDU), or to interpret it
+STRUCTURAL_KEYWORDS = (
+    "SIMPLE",
+    "XTENSION",
+    "BITPIX",
+    "NAXIS",
+    "PCOUNT",
+    "GCOUNT",
+    "BSCALE",
+    "BZERO",
+    "BLANK",
+    "EXTNAME",
+    "ZIMAGE",
+    "ZBITPIX",
+    "ZNAXIS",
+)
+STRUCTURAL_PREFIXES = ("NAXIS", "ZNAXIS")
+# default selection for skimming: WCS and exposure time
+SKIM_PREFIXES = (
+    "CTYPE",
+    "CRVAL",
+    "CRPIX",
+    "CDELT",
+    "CUNIT",
+    "CROTA",
+    "PC",
+    "CD",
+)
+SKIM_KEYWORDS = ("EXPTIME", "RADESYS", "EQUINOX", "LONPOLE", "LATPOLE")
+
+
+def _parse_card_value(raw: str):
+    """interpret the value field of a single FITS header card"""
+    raw = raw.strip()
+    if raw.startswith("'"):
+        # string value; '' is an escaped quote
+        chars, ix = [], 1
+        while ix < len(raw):
+            if raw[ix] == "'":
+                if raw[ix + 1:ix + 2] == "'":
+                    chars.append("'")
+                    ix += 2
+                    continue
+                break
+            chars.append(raw[ix])
+            ix += 1
+        return "".join(chars).rstrip()
+    token = raw.split("/")[0].strip()
+    if token == "T":
+        return True
+    if token == "F":
+        return False
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token.replace("D", "E"))
+    except ValueError:
+        return token
+
+
+def card_array(buffer: bytes) -> np.ndarray:
+    """view a buffer of header blocks as an n x 80 array of bytes"""
+    n_cards = len(buffer) // CARD_LENGTH
+    return np.frombuffer(
+        buffer, dtype=np.uint8, count=n_cards * CARD_LENGTH
+    ).reshape(n_cards, CARD_LENGTH)
+
+
+def _keywords(cards: np.ndarray) -> np.ndarray:
+    """8-byte keyword field of each card, as a fixed-width string array"""
+    return np.ascontiguousarray(cards[:, :8]).view("S8").ravel()
+
+
+def find_end_card(buffer: bytes) -> Optional[int]:
+    """
+    position (in bytes) of the END card in a buffer of header blocks, or
+    None if the buffer does not reach it
+    """
+    ends = np.flatnonzero(_keywords(card_array(buffer)) == END_KEYWORD)
+    return None if len(ends) == 0 else int(ends[0]) * CARD_LENGTH
+
+
+def _valued(cards: np.ndarray) -> np.ndarray:
+    """mask of cards with a value indicator ('= ' in columns 9-10)"""
+    return (cards[:, 8] == ord("=")) & (cards[:, 9] == ord(" "))
+
+
+@cache
+def _selector(keywords: tuple[str], prefixes: tuple[str]):
+    """
+    padded keywords for exact matching, and prefixes grouped by length so
+    that each group can be matched with a single isin()
+    """
+    exact = np.array(
+        [k.encode().ljust(8) for k in (*STRUCTURAL_KEYWORDS, *keywords)],
+        dtype="S8",
+    )
+    by_length = {}
+    for prefix in (*STRUCTURAL_PREFIXES, *prefixes):
+        by_length.setdefault(len(prefix), []).append(prefix.encode())
+    return exact, {
+        length: np.array(group, dtype=f"S{length}")
+        for length, group in by_length.items()
+    }
+
+
+def _select(cards: np.ndarray, names: np.ndarray, keywords, prefixes):
+    exact, by_length = _selector(tuple(keywords), tuple(prefixes))
+    selected = np.isin(names, exact)
+    for length, group in by_length.items():
+        stubs = np.ascontiguousarray(cards[:, :length]).view(f"S{length}")
+        selected |= np.isin(stubs.ravel(), group)
+    return selected
+
+
+def parse_header_blocks(buffer: bytes) -> tuple[dict, Optional[int]]:
+    """
+    parse FITS header cards from a buffer of one or more 2880-byte blocks.
+    returns the keywords found and the position of the END card in the
+    buffer (None if the buffer does not reach it). commentary cards
+    (COMMENT, HISTORY, blank) are skipped.
+    """
+    cards = card_array(buffer)
+    keywords = _keywords(cards)
+    ends = np.flatnonzero(keywords == END_KEYWORD)
+    end_ix = None if len(ends) == 0 else int(ends[0]) * CARD_LENGTH
+    if end_ix is not None:
+        cards, keywords = cards[:ends[0]], keywords[:ends[0]]
+    continued = keywords == CONTINUE_KEYWORD
+    wanted = np.flatnonzero(_valued(cards) | continued)
+    header, last_key = {}, None
+    for ix in wanted:
+        card = cards[ix].tobytes().decode("ascii", errors="replace")
+        if continued[ix]:
+            if isinstance(header.get(last_key), str):
+                value = _parse_card_value(card[8:])
+                if header[last_key].endswith("&"):
+                    header[last_key] = header[last_key][:-1] + str(value)
+            continue
+        keyword = card[:8].rstrip()
+        header[keyword] = _parse_card_value(card[10:])
+        last_key = keyword
+    return header, end_ix
+
+
+def skim_header_blocks(
+    buffer: bytes,
+    keywords: Collection[str] = SKIM_KEYWORDS,
+    prefixes: Collection[str] = SKIM_PREFIXES,
+) -> tuple[dict, Optional[int]]:
+    """
+    like parse_header_blocks(), but interpret only cards whose keywords are
+    in `keywords` or begin with one of `prefixes` (plus the structural
+    keywords needed to locate and interpret data).
+    (long-string CONTINUE cards are not followed.)
+    """
+    cards = card_array(buffer)
+    names = _keywords(cards)
+    ends = np.flatnonzero(names == END_KEYWORD)
+    end_ix = None if len(ends) == 0 else int(ends[0]) * CARD_LENGTH
+    if end_ix is not None:
+        cards, names = cards[:ends[0]], names[:ends[0]]
+    selected = _select(cards, names, keywords, prefixes)
+    header = {}
+    for ix in np.flatnonzero(selected & _valued(cards)):
+        card = cards[ix].tobytes().decode("ascii", errors="replace")
+        header[card[:8].rstrip()] = _parse_card_value(card[10:])
+    return header, end_ix
+
+
+def data_size(header: dict) -> int:
+    """unpadded size in bytes of the data unit described by a header"""
+    naxis = header.get("NAXIS", 0)
+    if naxis == 0:
+        return 0
+    elements = reduce(mul, [header[f"NAXIS{n}"] for n in range(1, naxis + 1)])
+    return (
+        abs(header["BITPIX"]) // 8
+        * header.get("GCOUNT", 1)
+        * (header.get("PCOUNT", 0) + elements)
+    )
+
+
+def _pad(size: int) -> int:
+    return -(-size // FITS_BLOCK) * FITS_BLOCK
+
+
+def skim_fits_header(
+    path: Union[str, Path],
+    hdu_ix: int = 0,
+    keywords: Collection[str] = SKIM_KEYWORDS,
+    prefixes: Collection[str] = SKIM_PREFIXES,
+    fsspec_kwargs: Optional[dict] = None,
+) -> dict:
+    """
+    skim selected keywords from the header of one HDU of a FITS file,
+    reading it (and any preceding headers) in whole blocks through a
+    byte-range source (see subset.utilz.byte_range)
+    """
+    from subset.utilz.byte_range import open_source
+
+    source = open_source(path, fsspec_kwargs)
+    try:
+        offset = 0
+        for ix in range(hdu_ix + 1):
+            buffer, end_ix = b"", None
+            while end_ix is None:
+                chunk = source.read_range(
+                    offset + len(buffer),
+                    offset + len(buffer) + FITS_BLOCK * HEADER_READ_BLOCKS,
+                )
+                if len(chunk) < FITS_BLOCK:
+                    raise IndexError(f"{path} has no HDU {hdu_ix}")
+                buffer += chunk[:len(chunk) - len(chunk) % FITS_BLOCK]
+                end_ix = find_end_card(buffer)
+            buffer = buffer[:end_ix]
+            if ix == hdu_ix:
+                return skim_header_blocks(buffer, keywords, prefixes)[0]
+            header, _ = skim_header_blocks(buffer, (), ())
+            offset += _pad(end_ix + CARD_LENGTH) + _pad(data_size(header))
+    finally:
+        source.close()
@@ -0,0 +1,171 @@
+"""
+speculative header prefetch for batches of FITS files. rather than opening
+each file in turn just to read a header, issue one concurrent wave of range
+requests for the leading bytes of every file, sized from a guess at how
+long their headers are, and parse the headers out of the returned buffers.
+files whose headers turn out to be longer than the guess (or whose wanted
+HDU lies past the end of the first read) get follow-up reads in a second,
+usually much smaller, wave.
+
+the results are RangedFITS-style HDU layouts, so they can be used as a
+layout index (see subset.utilz.layout_index) as well as for their headers.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Mapping, Optional, Sequence, Union
+
+from subset.utilz.byte_range import open_source
+from subset.utilz.header_blocks import (
+    CARD_LENGTH,
+    FITS_BLOCK,
+    _pad,
+    data_size,
+    parse_header_blocks,
+)
+from subset.utilz.workers import submit_in_context
+
+# a primary header and a modest extension header
+DEFAULT_HEADER_GUESS = 8 * FITS_BLOCK
+# concurrent reads of local (or FUSE-mounted) and gzipped files
+DEFAULT_THREADS = 32
+REMOTE_PREFIXES = ("s3://", "http://", "https://")
+
+
+def _read_one(path: str, start: int, stop: int, fsspec_kwargs) -> bytes:
+    source = open_source(path, fsspec_kwargs)
+    try:
+        return source.read_range(start, stop)
+    finally:
+        source.close()
+
+
+def read_wave(
+    requests: Sequence[tuple[str, int, int]],
+    fsspec_kwargs: Optional[dict] = None,
+    threads: int = DEFAULT_THREADS,
+) -> list[bytes]:
+    """
+    perform a batch of (path, start, stop) reads concurrently. remote
+    objects are read with the async fetcher; local and gzipped files are
+    read from a thread pool.
+    """
+    remote = [
+        ix
+        for ix, (path, _, _) in enumerate(requests)
+        if path.startswith(REMOTE_PREFIXES) and not path.endswith(".gz")
+    ]
+    remote_set = set(remote)
+    others = [ix for ix in range(len(requests)) if ix not in remote_set]
+    buffers = [None for _ in requests]
+    if len(remote) > 0:
+        from subset.utilz.async_fetch import fetch_ranges
+
+        fetched = fetch_ranges(
+            [requests[ix] for ix in remote],
+            fsspec_kwargs=fsspec_kwargs,
+            max_gap=0,
+        )
+        for ix, buffer in zip(remote, fetched):
+            buffers[ix] = buffer
+    if len(others) > 0:
+        with ThreadPoolExecutor(threads) as executor:
+            futures = {
+                ix: submit_in_context(
+                    executor, _read_one, *requests[ix], fsspec_kwargs
+                )
+                for ix in others
+            }
+        for ix, future in futures.items():
+            buffers[ix] = future.result()
+    return buffers
+
+
+def _guess_for(guess: Union[int, Mapping[str, int]], path: str) -> int:
+    if isinstance(guess, int):
+        return guess
+    # per-file guesses may be keyed by full path or by filename
+    return guess.get(
+        path, guess.get(Path(path).name, DEFAULT_HEADER_GUESS)
+    )
+
+
+def _advance(state: dict, hdu_ix: int, guess: int) -> Optional[tuple]:
+    """
+    parse as many headers as possible from a file's buffered bytes. returns
+    None if HDU hdu_ix has been reached (or the file has ended), otherwise
+    the (start, stop) of the next read needed.
+    """
+    buffer, buffer_start = state["buffer"], state["buffer_start"]
+    while len(state["layouts"]) <= hdu_ix:
+        if len(state["layouts"]) == 0:
+            offset = 0
+        else:
+            last = state["layouts"][-1]
+            offset = last["data_loc"] + _pad(last["data_span"])
+        buffer_stop = buffer_start + len(buffer)
+        if not buffer_start <= offset < buffer_stop:
+            if state["eof"] is True and offset >= buffer_stop:
+                return None
+            return offset, offset + guess
+        usable = buffer[offset - buffer_start:]
+        usable = usable[:len(usable) - len(usable) % FITS_BLOCK]
+        header, end_ix = parse_header_blocks(bytes(usable))
+        if end_ix is None:
+            if state["eof"] is True:
+                raise ValueError(
+                    f"truncated FITS header in {state['path']} at {offset}"
+                )
+            # header is longer than the guess; at least double the read
+            return buffer_stop, buffer_stop + max(guess, len(usable))
+        state["layouts"].append(
+            {
+                "header": header,
+                "header_loc": offset,
+                "data_loc": offset + _pad(end_ix + CARD_LENGTH),
+                "data_span": data_size(header),
+            }
+        )
+    return None
+
+
+def prefetch_headers(
+    paths: Sequence[Union[str, Path]],
+    hdu_ix: int = 0,
+    guess: Union[int, Mapping[str, int]] = DEFAULT_HEADER_GUESS,
+    fsspec_kwargs: Optional[dict] = None,
+    threads: int = DEFAULT_THREADS,
+) -> dict[str, list[dict]]:
+    """
+    read the headers of HDUs 0 through hdu_ix of every file in paths, in as
+    few concurrent waves of reads as possible. `guess` is the number of
+    bytes to request from the start of each file -- either a single value
+    or a mapping from paths or filenames to values.
+    returns a mapping from paths to lists of RangedFITS-style layouts.
+    """
+    states, pending = {}, {}
+    for path in map(str, paths):
+        states[path] = {
+            "path": path,
+            "buffer": b"",
+            "buffer_start": 0,
+            "eof": False,
+            "layouts": [],
+        }
+        pending[path] = (0, _guess_for(guess, path))
+    while len(pending) > 0:
+        requests = [(path, *span) for path, span in pending.items()]
+        buffers = read_wave(requests, fsspec_kwargs, threads)
+        next_pending = {}
+        for (path, start, stop), buffer in zip(requests, buffers):
+            state = states[path]
+            if start == state["buffer_start"] + len(state["buffer"]):
+                state["buffer"] = bytes(state["buffer"]) + bytes(buffer)
+            else:
+                state["buffer"], state["buffer_start"] = buffer, start
+            state["eof"] = len(buffer) < stop - start
+            span = _advance(state, hdu_ix, _guess_for(guess, path))
+            if span is not None:
+                next_pending[path] = span
+        pending = next_pending
+    return {path: state["layouts"] for path, state in states.items()}
+
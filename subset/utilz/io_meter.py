@@ -0,0 +1,157 @@
+"""
+per-request I/O accounting. an IOMeter counts the requests, bytes, and
+time spent by reads made inside a metered() context: reads by byte-range
+sources (subset.utilz.byte_range) opened in the context, and range fetches
+by fsspec files opened in it (e.g. those astropy opens for s3:// URLs).
+unlike a host-wide network counter, this attributes traffic to the code
+that caused it, even when other work runs at the same time. the active
+meter is held in a context variable, so metered() contexts in different
+threads each count only their own reads. work handed to a thread pool
+with subset.utilz.workers.submit_in_context() runs in a copy of the
+caller's context and is counted in the caller's meter. nested metered()
+contexts also count their reads in the meters around them.
+
+it does not see reads made by cfitsio (fitsio loaders), reads through
+astropy's memory maps of local files, or reads made by other processes.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+import threading
+import time
+from typing import Callable, Optional
+
+IO_FIELDS = ("requests", "bytes", "first_byte", "transfer")
+_METER = ContextVar("io_meter", default=None)
+
+
+class IOMeter:
+    """
+    thread-safe I/O counts. first_byte is the total time spent waiting for
+    the first byte of responses (where the source can tell; see
+    MeteredSource), and transfer is all other time spent in requests.
+    everything recorded is also recorded in parent, if it has one.
+    """
+
+    def __init__(self, parent: Optional["IOMeter"] = None):
+        self.counts = dict.fromkeys(IO_FIELDS, 0)
+        self.parent = parent
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        requests: int,
+        nbytes: int,
+        elapsed: float,
+        first_byte: Optional[float] = None,
+    ):
+        first_byte = 0 if first_byte is None else min(first_byte, elapsed)
+        with self._lock:
+            self.counts["requests"] += requests
+            self.counts["bytes"] += nbytes
+            self.counts["first_byte"] += first_byte
+            self.counts["transfer"] += elapsed - first_byte
+        if self.parent is not None:
+            self.parent.record(requests, nbytes, elapsed, first_byte)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return self.counts.copy()
+
+    def since(self, snapshot: dict) -> dict:
+        """counts accumulated since snapshot was taken"""
+        return {k: v - snapshot[k] for k, v in self.snapshot().items()}
+
+
+def active_meter() -> Optional[IOMeter]:
+    """the IOMeter of the innermost metered() context, if any"""
+    return _METER.get()
+
+
+@contextmanager
+def metered(meter: Optional[IOMeter] = None):
+    """
+    count I/O made inside this context in meter (or a new IOMeter, whose
+    parent is the enclosing context's meter, if any)
+    """
+    from subset.utilz.byte_range import instrument_fsspec_files
+
+    meter = IOMeter(active_meter()) if meter is None else meter
+    instrument_fsspec_files()
+    token = _METER.set(meter)
+    try:
+        yield meter
+    finally:
+        _METER.reset(token)
+
+
+class MeteredSource:
+    """
+    byte-range source whose reads are counted in an IOMeter. if the
+    wrapped source reports a first_byte time for its last request (as
+    HTTPSource does), it is counted as first_byte; otherwise the whole
+    request counts as transfer. read_ranges() counts one request per
+    range but, since sources issue them concurrently, its wall time once.
+    """
+
+    def __init__(self, source, meter: IOMeter):
+        self.source, self.meter = source, meter
+        self.path = source.path
+
+    @property
+    def size(self) -> int:
+        return self.source.size
+
+    @property
+    def identity(self) -> str:
+        return self.source.identity
+
+    @property
+    def first_byte(self) -> Optional[float]:
+        return getattr(self.source, "first_byte", None)
+
+    def read_range(self, start: int, stop: int) -> bytes:
+        began = time.perf_counter()
+        data = self.source.read_range(start, stop)
+        self.meter.record(
+            1, len(data), time.perf_counter() - began, self.first_byte
+        )
+        return data
+
+    def read_ranges(self, ranges) -> list[bytes]:
+        began = time.perf_counter()
+        buffers = self.source.read_ranges(ranges)
+        self.meter.record(
+            len(buffers),
+            sum(map(len, buffers)),
+            time.perf_counter() - began,
+        )
+        return buffers
+
+    def close(self):
+        self.source.close()
+
+
+def meter_source(source):
+    """wrap a byte-range source in the active meter, if any"""
+    meter = active_meter()
+    return source if meter is None else MeteredSource(source, meter)
+
+
+def meter_fetcher(fetch: Callable) -> Callable:
+    """
+    count calls to a function that fetches one byte range per call in the
+    active meter, if any
+    """
+    meter = active_meter()
+    if meter is None:
+        return fetch
+
+    @wraps(fetch)
+    def metered_fetch(*args, **kwargs):
+        began = time.perf_counter()
+        data = fetch(*args, **kwargs)
+        meter.record(1, len(data), time.perf_counter() - began)
+        return data
+
+    return metered_fetch
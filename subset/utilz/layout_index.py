@@ -0,0 +1,169 @@
+"""
+persistent HDU layout indices. for each file in a set (a benchmark set, a
+bucket prefix, etc.), record where every HDU's header and data live, its
+BITPIX and axis sizes, the location of its compressed-tile table if it has
+one, and just enough of its header to cut from it and build its WCS. these
+records are stored together in a single Parquet sidecar.
+
+given such an index, RangedFITS (and so logged_fits_initializer with a
+ranged loader) can take cuts from a file without reading any headers.
+"""
+import json
+from pathlib import Path
+import re
+from typing import Collection, Mapping, Optional, Sequence, Union
+
+# keywords needed to locate and decode data: basic structure, scaling,
+# binary table layout, and tile compression parameters
+STRUCTURAL_KEYWORDS = re.compile(
+    r"(SIMPLE|XTENSION|BITPIX|NAXIS\d*|PCOUNT|GCOUNT|BSCALE|BZERO|BLANK"
+    r"|EXTNAME|TFIELDS|TTYPE\d+|TFORM\d+|THEAP|Z[A-Z]+\d*)$"
+)
+# keywords needed to build a WCS (see also fits.extract_wcs_keywords)
+WCS_PREFIXES = (
+    "CTYPE", "CRVAL", "CRPIX", "CDELT", "CUNIT", "CROTA", "PC", "CD",
+    "PV", "LONPOLE", "LATPOLE", "RADESYS", "EQUINOX",
+)
+
+
+def trim_layout_header(
+    header: Mapping, extra_keywords: Collection[str] = ()
+) -> dict:
+    """
+    retain only the keywords of a header that are needed to read data and
+    build a WCS, plus any extra_keywords
+    """
+    return {
+        k: v
+        for k, v in header.items()
+        if STRUCTURAL_KEYWORDS.match(k)
+        or k.startswith(WCS_PREFIXES)
+        or k in extra_keywords
+    }
+
+
+def layout_records(
+    path: Union[str, Path],
+    key: Optional[str] = None,
+    fsspec_kwargs: Optional[dict] = None,
+    extra_keywords: Collection[str] = (),
+) -> list[dict]:
+    """
+    make one layout record for each HDU of a FITS file. reads the file's
+    headers through RangedFITS, so works for local paths, HTTP(S) URLs, and
+    S3 URLs alike. `key` is the name the file will be looked up by
+    (default: path).
+    """
+    from subset.utilz.ranged_fits import RangedFITS
+
+    with RangedFITS(path, fsspec_kwargs=fsspec_kwargs) as hdul:
+        # len() scans every header in the file
+        len(hdul)
+        layouts = hdul.layouts
+    records = []
+    for hdu_ix, layout in enumerate(layouts):
+        header = layout["header"]
+        compressed = header.get("ZIMAGE") is True
+        prefix = "Z" if compressed else ""
+        naxis = header.get(f"{prefix}NAXIS", 0)
+        records.append(
+            {
+                "path": str(path) if key is None else key,
+                "hdu": hdu_ix,
+                "header_loc": layout["header_loc"],
+                "data_loc": layout["data_loc"],
+                "data_span": layout["data_span"],
+                "bitpix": header.get(f"{prefix}BITPIX"),
+                "naxes": [
+                    header[f"{prefix}NAXIS{n}"] for n in range(1, naxis + 1)
+                ],
+                "compressed": compressed,
+                # tile table: row size, number of tiles, and heap location
+                "tile_row_size": header["NAXIS1"] if compressed else None,
+                "n_tiles": header["NAXIS2"] if compressed else None,
+                "heap_loc": (
+                    layout["data_loc"]
+                    + header.get("THEAP", header["NAXIS1"] * header["NAXIS2"])
+                    if compressed
+                    else None
+                ),
+                "keywords": json.dumps(
+                    trim_layout_header(header, extra_keywords)
+                ),
+            }
+        )
+    return records
+
+
+def build_layout_index(
+    paths: Sequence[Union[str, Path]],
+    index_path: Union[str, Path],
+    keys: Optional[Sequence[str]] = None,
+    fsspec_kwargs: Optional[dict] = None,
+    extra_keywords: Collection[str] = ("EXPTIME",),
+):
+    """
+    index the HDU layouts of all files in `paths` and write the index to a
+    Parquet file at index_path. `keys` optionally gives names to store the
+    files under -- e.g., bucket-relative paths, so that the same index can
+    be used for s3:// URLs and FUSE-mounted paths to the same objects.
+    """
+    import pyarrow as pa
+    from pyarrow import parquet
+
+    keys = [None for _ in paths] if keys is None else keys
+    records = []
+    for path, key in zip(paths, keys):
+        records += layout_records(path, key, fsspec_kwargs, extra_keywords)
+    table = pa.Table.from_pylist(records)
+    parquet.write_table(table, index_path)
+    return table
+
+
+def load_layout_index(index_path: Union[str, Path]) -> dict[str, list[dict]]:
+    """
+    load a layout index written by build_layout_index() into a mapping from
+    file keys to lists of RangedFITS-style layouts, one per HDU
+    """
+    from pyarrow import parquet
+
+    columns = [
+        "path", "hdu", "header_loc", "data_loc", "data_span", "keywords"
+    ]
+    table = parquet.read_table(index_path, columns=columns).to_pydict()
+    index = {}
+    for path, hdu, header_loc, data_loc, data_span, keywords in zip(
+        *[table[c] for c in columns]
+    ):
+        layouts = index.setdefault(path, [])
+        if hdu != len(layouts):
+            raise ValueError(f"layout index is missing HDUs for {path}")
+        layouts.append(
+            {
+                "header": json.loads(keywords),
+                "header_loc": header_loc,
+                "data_loc": data_loc,
+                "data_span": data_span,
+            }
+        )
+    return index
+
+
+def lookup_layouts(
+    layout_index: Mapping[str, list], path: Union[str, Path]
+) -> Optional[list[dict]]:
+    """
+    find the layouts for a path in a layout index. tries the full path and
+    then progressively shorter trailing pieces of it, so a key like
+    'ps1/rings.v3.skycell/1724/066/x.fits' matches both
+    '/mnt/s3/ps1/rings.v3.skycell/1724/066/x.fits' and
+    's3://nishapur/ps1/rings.v3.skycell/1724/066/x.fits'. trailing pieces
+    always keep at least one directory, so a bare filename never matches a
+    same-named file somewhere else (whose layout could be anything).
+    """
+    parts = str(path).split("/")
+    for ix in range(max(len(parts) - 1, 1)):
+        layouts = layout_index.get("/".join(parts[ix:]))
+        if layouts is not None:
+            return layouts
+    return None
@@ -0,0 +1,431 @@
+"""
+local stand-in for S3 (and plain HTTP) object storage, for benchmarking
+loaders reproducibly without a network. LocalObjectServer serves a
+directory tree -- each top-level directory is a bucket -- over keep-alive
+HTTP/1.1 with S3-style GET, HEAD, Range, and ListObjectsV2 semantics, so
+that s3fs can be pointed at it with an endpoint_url (see fsspec_kwargs())
+and HTTPSource can read from it directly (see http_url()).
+
+per-request latency, per-connection bandwidth caps, and error rates can be
+set when the server is made and changed while it runs (see configure()).
+"""
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+import random
+import re
+import threading
+import time
+from typing import Optional, Union
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+# bytes per write when streaming object bodies (and per bandwidth check)
+CHUNK_SIZE = 64 * 1024
+DEFAULT_SETTINGS = {
+    # seconds added before each response
+    "latency": 0.0,
+    # maximum random seconds added to latency
+    "jitter": 0.0,
+    # bytes per second per connection; None for no cap
+    "bandwidth": None,
+    # fraction of GET / HEAD requests answered with 503 SlowDown
+    "error_rate": 0.0,
+}
+
+
+def _etag(stat) -> str:
+    tag = hashlib.md5(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return f'"{tag.hexdigest()}"'
+
+
+def _http_date(timestamp: float) -> str:
+    return format_datetime(
+        datetime.fromtimestamp(timestamp, timezone.utc), usegmt=True
+    )
+
+
+def _iso_date(timestamp: float) -> str:
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_range(header: str, size: int) -> Optional[tuple[int, int]]:
+    """
+    parse a single-range Range header ("bytes=a-b", "bytes=a-", or
+    "bytes=-n") into a (start, stop) pair clipped to an object of size
+    bytes. returns None if the range is not satisfiable, and raises a
+    ValueError if the header is malformed. (like S3, multiple ranges are
+    not supported; only the first is used.)
+    """
+    spec = header.strip().split(",")[0].strip()
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", spec)
+    if match is None or match.groups() == ("", ""):
+        raise ValueError(f"malformed Range header: {header}")
+    first, last = match.groups()
+    if first == "":
+        if int(last) == 0:
+            return None
+        return max(size - int(last), 0), size
+    start = int(first)
+    if last != "" and int(last) < start:
+        raise ValueError(f"malformed Range header: {header}")
+    stop = size if last == "" else min(int(last) + 1, size)
+    if start >= size:
+        return None
+    return start, stop
+
+
+def _error_xml(code: str, message: str, resource: str) -> bytes:
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        f"<Error><Code>{code}</Code><Message>{escape(message)}</Message>"
+        f"<Resource>{escape(resource)}</Resource></Error>"
+    ).encode()
+
+
+def _listing_xml(
+    bucket: str,
+    prefix: str,
+    delimiter: str,
+    entries: list,
+    common_prefixes: list,
+) -> bytes:
+    contents = "".join(
+        f"<Contents><Key>{escape(key)}</Key>"
+        f"<LastModified>{_iso_date(stat.st_mtime)}</LastModified>"
+        f"<ETag>{escape(_etag(stat))}</ETag><Size>{stat.st_size}</Size>"
+        "<StorageClass>STANDARD</StorageClass></Contents>"
+        for key, stat in entries
+    )
+    contents += "".join(
+        f"<CommonPrefixes><Prefix>{escape(common)}</Prefix></CommonPrefixes>"
+        for common in common_prefixes
+    )
+    if delimiter != "":
+        contents = f"<Delimiter>{escape(delimiter)}</Delimiter>{contents}"
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        f"<Name>{escape(bucket)}</Name><Prefix>{escape(prefix)}</Prefix>"
+        f"<KeyCount>{len(entries) + len(common_prefixes)}</KeyCount>"
+        f"<MaxKeys>1000</MaxKeys><IsTruncated>false</IsTruncated>"
+        f"{contents}</ListBucketResult>"
+    ).encode()
+
+
+class _ObjectHandler(BaseHTTPRequestHandler):
+    # keep-alive: one handler instance serves every request on a connection
+    protocol_version = "HTTP/1.1"
+    # headers and bodies go out in separate writes; without this, Nagle's
+    # algorithm holds back each body until the client's delayed ACK
+    disable_nagle_algorithm = True
+    server: "_ObjectHTTPServer"
+
+    def log_message(self, *_):
+        pass
+
+    def setup(self):
+        super().setup()
+        # bytes sent on this connection, and when the pacing window began
+        self._sent, self._window_start = 0, time.perf_counter()
+
+    def _locate(self) -> tuple[str, str, Optional[Path]]:
+        parts = unquote(urlsplit(self.path).path).lstrip("/").split("/", 1)
+        bucket, key = parts[0], parts[1] if len(parts) > 1 else ""
+        root = self.server.root.resolve()
+        target = Path(root, bucket, key).resolve()
+        # refuse to serve anything outside the root
+        if bucket == "" or not target.is_relative_to(root):
+            return bucket, key, None
+        return bucket, key, target
+
+    def _send_error(self, status: int, code: str, message: str):
+        body = _error_xml(code, message, self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self._write(body)
+
+    def _write(self, data: bytes):
+        bandwidth = self.server.settings["bandwidth"]
+        for offset in range(0, len(data), CHUNK_SIZE):
+            chunk = data[offset:offset + CHUNK_SIZE]
+            self._sent += len(chunk)
+            if bandwidth is not None:
+                # hold each chunk until the connection could have sent it
+                ahead = (
+                    self._sent / bandwidth
+                    - (time.perf_counter() - self._window_start)
+                )
+                if ahead > 0:
+                    time.sleep(ahead)
+            self.wfile.write(chunk)
+
+    def _stall(self) -> bool:
+        """
+        apply configured latency, and decide whether to inject an error.
+        returns True if an error response was sent.
+        """
+        settings = self.server.settings
+        delay = settings["latency"] + self.server.uniform(settings["jitter"])
+        if delay > 0:
+            time.sleep(delay)
+        if self.server.uniform(1) < settings["error_rate"]:
+            self.server.count("errors")
+            self._send_error(
+                503, "SlowDown", "Please reduce your request rate."
+            )
+            return True
+        # idle time between requests does not count toward bandwidth
+        self._sent, self._window_start = 0, time.perf_counter()
+        return False
+
+    def _list(self, bucket: str, query: dict):
+        directory = Path(self.server.root, bucket)
+        if not directory.is_dir():
+            return self._send_error(
+                404, "NoSuchBucket", "The specified bucket does not exist"
+            )
+        prefix = query.get("prefix", [""])[0]
+        delimiter = query.get("delimiter", [""])[0]
+        entries = sorted(
+            (p.relative_to(directory).as_posix(), p.stat())
+            for p in directory.rglob("*")
+            if p.is_file()
+        )
+        entries = [e for e in entries if e[0].startswith(prefix)]
+        common_prefixes = set()
+        if delimiter != "":
+            # like S3, roll up keys with the delimiter after the prefix into
+            # the part of them up to and including its first occurrence
+            direct = []
+            for key, stat in entries:
+                rest = key[len(prefix):]
+                if delimiter in rest:
+                    common_prefixes.add(
+                        prefix + rest.split(delimiter, 1)[0] + delimiter
+                    )
+                else:
+                    direct.append((key, stat))
+            entries = direct
+        body = _listing_xml(
+            bucket, prefix, delimiter, entries, sorted(common_prefixes)
+        )
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self._write(body)
+
+    def _serve(self):
+        self.server.count("requests")
+        if self._stall():
+            return
+        bucket, key, target = self._locate()
+        if key == "" and target is not None:
+            return self._list(bucket, parse_qs(urlsplit(self.path).query))
+        if target is None or not target.is_file():
+            return self._send_error(
+                404, "NoSuchKey", "The specified key does not exist."
+            )
+        stat = target.stat()
+        span, status = (0, stat.st_size), 200
+        if "Range" in self.headers:
+            try:
+                span = parse_range(self.headers["Range"], stat.st_size)
+            except ValueError:
+                # like S3, ignore a malformed Range: send the whole object
+                span = (0, stat.st_size)
+            else:
+                if span is None:
+                    self.send_response(416)
+                    self.send_header(
+                        "Content-Range", f"bytes */{stat.st_size}"
+                    )
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                status = 206
+        start, stop = span
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(stop - start))
+        self.send_header("ETag", _etag(stat))
+        self.send_header("Last-Modified", _http_date(stat.st_mtime))
+        if status == 206:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{stop - 1}/{stat.st_size}"
+            )
+        self.end_headers()
+        if self.command == "HEAD":
+            return
+        with open(target, "rb") as stream:
+            stream.seek(start)
+            for offset in range(start, stop, CHUNK_SIZE):
+                self._write(stream.read(min(CHUNK_SIZE, stop - offset)))
+        self.server.count("bytes", stop - start)
+
+    def do_GET(self):
+        self._serve()
+
+    def do_HEAD(self):
+        self._serve()
+
+
+class _ObjectHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, root: Path, settings: dict, counts, seed):
+        super().__init__(address, _ObjectHandler)
+        self.root, self.settings, self.counts = root, settings, counts
+        self._rng, self._lock = random.Random(seed), threading.Lock()
+
+    def uniform(self, scale: float) -> float:
+        with self._lock:
+            return self._rng.uniform(0, scale)
+
+    def count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counts[name] += amount
+
+
+class LocalObjectServer:
+    """
+    serve the directory tree at root as S3-style buckets from a background
+    thread. use as a context manager, or call start() and stop(). port=0
+    picks a free port; the chosen one is in endpoint_url once started.
+    """
+
+    def __init__(
+        self,
+        root: Union[str, Path],
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: Optional[int] = None,
+        **settings,
+    ):
+        self.root, self.host, self.port = Path(root), host, port
+        self.seed = seed
+        self.settings = DEFAULT_SETTINGS.copy()
+        self.configure(**settings)
+        self._counts = {"requests": 0, "errors": 0, "bytes": 0}
+        self._server, self._thread = None, None
+
+    def configure(self, **settings):
+        """change latency, jitter, bandwidth, and/or error_rate"""
+        if unknown := set(settings).difference(DEFAULT_SETTINGS):
+            raise TypeError(f"unknown server settings: {sorted(unknown)}")
+        self.settings.update(settings)
+
+    @property
+    def endpoint_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def counts(self) -> dict:
+        """requests served, errors injected, and object bytes sent"""
+        return self._counts.copy()
+
+    def http_url(self, bucket: str, path: str) -> str:
+        """plain HTTP URL of an object, e.g. for HTTPSource"""
+        return f"{self.endpoint_url}/{quote(bucket)}/{quote(path)}"
+
+    def fsspec_kwargs(self) -> dict:
+        """kwargs that point an fsspec / s3fs filesystem at this server"""
+        return local_s3_kwargs(self.endpoint_url)
+
+    def start(self) -> "LocalObjectServer":
+        if self._server is not None:
+            return self
+        # handlers read this same settings dict, so configure() takes
+        # effect on the next request
+        self._server = _ObjectHTTPServer(
+            (self.host, self.port),
+            self.root,
+            self.settings,
+            self._counts,
+            self.seed,
+        )
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server, self._thread = None, None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
+
+
+def local_s3_kwargs(
+    endpoint_url: str, fsspec_kwargs: Optional[dict] = None
+) -> dict:
+    """
+    add endpoint_url to fsspec s3 kwargs. local servers don't check
+    credentials, so requests are made anonymously (unsigned).
+    """
+    fsspec_kwargs = {} if fsspec_kwargs is None else dict(fsspec_kwargs)
+    client_kwargs = fsspec_kwargs.get("client_kwargs", {})
+    fsspec_kwargs["client_kwargs"] = client_kwargs | {
+        "endpoint_url": endpoint_url
+    }
+    return {
+        k: v
+        for k, v in fsspec_kwargs.items()
+        if k not in ("key", "secret", "token")
+    } | {"anon": True}
+
+
+def serve(
+    root: str,
+    host: str = "127.0.0.1",
+    port: int = 9000,
+    latency: float = 0.0,
+    jitter: float = 0.0,
+    bandwidth: Optional[float] = None,
+    error_rate: float = 0.0,
+    seed: Optional[int] = None,
+):
+    """run a LocalObjectServer in the foreground until interrupted"""
+    server = LocalObjectServer(
+        root,
+        host,
+        port,
+        seed,
+        latency=latency,
+        jitter=jitter,
+        bandwidth=bandwidth,
+        error_rate=error_rate,
+    )
+    with server:
+        print(f"serving {root} at {server.endpoint_url}")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+# tell fire to handle command line call
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(serve)
@@ -0,0 +1,313 @@
+"""
+direct byte-range access to FITS image HDUs. RangedFITS parses headers
+itself and computes the byte offsets of requested array slices from BITPIX,
+NAXISn, and the data start offset, then fetches only those ranges from a
+byte-range source (see subset.utilz.byte_range). it does not use astropy or
+fitsio at all. tile-compressed HDUs are handed off to
+subset.utilz.tiled_fits.RangedCompHDU.
+
+its HDU objects mimic the parts of fitsio's HDU interface that the
+benchmark and science handlers use (__getitem__, read, read_header), so a
+RangedFITS constructor can be used anywhere a fitsio.FITS constructor can.
+"""
+from functools import reduce
+from operator import mul
+from pathlib import Path
+from typing import Mapping, Optional, Sequence, Union
+
+import numpy as np
+
+from subset.utilz.byte_range import open_source
+from subset.utilz.header_blocks import (
+    CARD_LENGTH,
+    FITS_BLOCK,
+    HEADER_READ_BLOCKS,
+    _pad,
+    data_size,
+    parse_header_blocks,
+)
+from subset.utilz.layout_index import lookup_layouts
+from subset.utilz.read_plan import execute_plan, plan_reads, split_by_counts
+
+BITPIX_DTYPES = {
+    8: np.dtype("u1"),
+    16: np.dtype(">i2"),
+    32: np.dtype(">i4"),
+    64: np.dtype(">i8"),
+    -32: np.dtype(">f4"),
+    -64: np.dtype(">f8"),
+}
+
+
+def normalize_index(item, shape: Sequence[int]):
+    """
+    convert a numpy-style basic index into a list of (start, stop) bounds
+    per axis, along with any post-fetch step / squeeze operations needed to
+    reproduce numpy's result.
+    """
+    if not isinstance(item, tuple):
+        item = (item,)
+    if Ellipsis in item:
+        ix = item.index(Ellipsis)
+        fill = (slice(None),) * (len(shape) - len(item) + 1)
+        item = item[:ix] + fill + item[ix + 1:]
+    if len(item) > len(shape):
+        raise IndexError("too many indices for FITS image")
+    item = item + (slice(None),) * (len(shape) - len(item))
+    bounds, steps, squeeze = [], [], []
+    for axis, (index, length) in enumerate(zip(item, shape)):
+        if isinstance(index, (int, np.integer)):
+            if not -length <= index < length:
+                raise IndexError(f"index {index} out of bounds on axis {axis}")
+            index = index % length
+            bounds.append((index, index + 1))
+            steps.append(None)
+            squeeze.append(axis)
+            continue
+        if not isinstance(index, slice):
+            raise TypeError("only integers, slices, and ellipsis supported")
+        positions = range(*index.indices(length))
+        if len(positions) == 0:
+            bounds.append((0, 0))
+            steps.append(None)
+            continue
+        low, high = min(positions), max(positions) + 1
+        bounds.append((low, high))
+        if positions.step == 1:
+            steps.append(None)
+        else:
+            steps.append(
+                np.arange(len(positions)) * positions.step
+                + (positions[0] - low)
+            )
+    return bounds, steps, squeeze
+
+
+def box_byte_ranges(
+    shape: Sequence[int], itemsize: int, bounds: Sequence[Sequence[int]]
+) -> np.ndarray:
+    """
+    compute the [start, stop) byte offsets, relative to the start of a
+    C-ordered array, of the contiguous runs that make up a rectangular box
+    with the given per-axis (start, stop) bounds. trailing axes that the
+    box spans completely are folded into a single run.
+    """
+    ndim = len(shape)
+    run_axis = ndim - 1
+    while run_axis > 0 and tuple(bounds[run_axis]) == (0, shape[run_axis]):
+        run_axis -= 1
+    strides = [reduce(mul, shape[axis + 1:], 1) for axis in range(ndim)]
+    run_start, run_stop = bounds[run_axis]
+    run_length = (run_stop - run_start) * strides[run_axis] * itemsize
+    offsets = np.array([run_start * strides[run_axis]], dtype=np.int64)
+    for axis in reversed(range(run_axis)):
+        axis_offsets = np.arange(*bounds[axis], dtype=np.int64) * strides[axis]
+        offsets = np.add.outer(axis_offsets, offsets).ravel()
+    starts = offsets * itemsize
+    return np.column_stack([starts, starts + run_length])
+
+
+def scale_array(array: np.ndarray, header: dict) -> np.ndarray:
+    """
+    apply BSCALE / BZERO like astropy.io.fits does, including its
+    convention of reading signed-integer data with the standard offset as
+    unsigned integers.
+    """
+    bscale, bzero = header.get("BSCALE", 1), header.get("BZERO", 0)
+    if (bscale, bzero) == (1, 0):
+        return array
+    bitpix = header["BITPIX"]
+    if bscale == 1 and bitpix > 8 and bzero == 2 ** (bitpix - 1):
+        # adding 2 ** (bitpix - 1) to a signed integer is a sign-bit flip
+        unsigned = array.view(array.dtype.str.replace("i", "u"))
+        return unsigned ^ unsigned.dtype.type(bzero)
+    if bscale == 1 and bitpix == 8 and bzero == -128:
+        return (array.astype(np.int16) - 128).astype(np.int8)
+    return array * np.float32(bscale) + np.float32(bzero)
+
+
+class RangedHDU:
+    """
+    a single HDU of a RangedFITS object. slicing it fetches exactly the byte
+    ranges that contain the requested pixels.
+    """
+
+    def __init__(self, source, layout: dict):
+        self.source = source
+        self.layout = layout
+        self.header = layout["header"]
+        naxis = self.header.get("NAXIS", 0)
+        self.shape = tuple(
+            self.header[f"NAXIS{n}"] for n in range(naxis, 0, -1)
+        )
+
+    def read_header(self) -> dict:
+        return self.header
+
+    @property
+    def dtype(self) -> np.dtype:
+        return BITPIX_DTYPES[self.header["BITPIX"]]
+
+    def _check_image(self):
+        xtension = self.header.get("XTENSION", "IMAGE")
+        if xtension.strip() != "IMAGE":
+            raise TypeError(
+                f"ranged reads only support image HDUs, not {xtension} HDUs"
+            )
+
+    def byte_ranges(self, item) -> np.ndarray:
+        """absolute byte ranges in the file needed to satisfy `item`"""
+        self._check_image()
+        bounds, _, _ = normalize_index(item, self.shape)
+        if any(stop <= start for start, stop in bounds):
+            return np.empty((0, 2), dtype=np.int64)
+        ranges = box_byte_ranges(self.shape, self.dtype.itemsize, bounds)
+        return ranges + self.layout["data_loc"]
+
+    def assemble(self, item, buffers: Sequence[bytes]) -> np.ndarray:
+        """
+        build the array for `item` from the contents of the byte ranges
+        returned by byte_ranges(item), in the same order.
+        """
+        bounds, steps, squeeze = normalize_index(item, self.shape)
+        box_shape = tuple(stop - start for start, stop in bounds)
+        array = np.frombuffer(b"".join(buffers), dtype=self.dtype)
+        array = array.reshape(box_shape)
+        for axis, step in enumerate(steps):
+            if step is not None:
+                array = np.take(array, step, axis=axis)
+        if len(squeeze) > 0:
+            array = array.squeeze(axis=tuple(squeeze))
+        array = array.astype(self.dtype.newbyteorder("="))
+        return scale_array(array, self.header)
+
+    def __getitem__(self, item) -> np.ndarray:
+        ranges = self.byte_ranges(item)
+        return self.assemble(item, self.source.read_ranges(ranges.tolist()))
+
+    def read(self) -> np.ndarray:
+        return self[...]
+
+    def cut_many(self, items: Sequence, **plan_kwargs) -> tuple[list, dict]:
+        """
+        fetch many slices at once. gathers the byte ranges for all of them,
+        coalesces them into as few reads as the cost model in
+        subset.utilz.read_plan considers worthwhile (plan_kwargs are passed
+        to plan_reads), and returns the arrays along with the read plan.
+        """
+        per_item = [self.byte_ranges(item) for item in items]
+        plan = plan_reads(
+            np.concatenate([np.empty((0, 2), dtype=np.int64), *per_item]),
+            **plan_kwargs,
+        )
+        buffers = split_by_counts(
+            execute_plan(self.source, plan), [len(r) for r in per_item]
+        )
+        return [
+            self.assemble(item, item_buffers)
+            for item, item_buffers in zip(items, buffers)
+        ], plan
+
+
+class RangedFITS:
+    """
+    minimal FITS reader that accesses a file only through byte-range reads.
+    HDUs are discovered lazily: asking for HDU n reads headers 0 through n
+    (if not already read), one or a few 2880-byte blocks at a time. if the
+    file is present in a layout index (see subset.utilz.layout_index), no
+    headers are read at all. if a BlockCache is passed, all reads go through
+    it (see subset.utilz.block_cache).
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        fsspec_kwargs: Optional[dict] = None,
+        header_blocks: int = HEADER_READ_BLOCKS,
+        source=None,
+        layout_index: Optional[Mapping[str, list]] = None,
+        block_cache=None,
+    ):
+        self.filename = str(path)
+        if source is None:
+            source = open_source(path, fsspec_kwargs)
+        if block_cache is not None:
+            from subset.utilz.block_cache import CachedSource
+
+            source = CachedSource(source, block_cache)
+        self.source = source
+        self.header_blocks = header_blocks
+        self.layouts, self.scanned = [], False
+        if layout_index is not None:
+            indexed = lookup_layouts(layout_index, path)
+            if indexed is not None:
+                self.layouts, self.scanned = list(indexed), True
+
+    def _read_header(self, offset: int) -> Optional[dict]:
+        buffer, header, end_ix = b"", {}, None
+        while end_ix is None:
+            chunk_start = offset + len(buffer)
+            chunk = self.source.read_range(
+                chunk_start, chunk_start + FITS_BLOCK * self.header_blocks
+            )
+            if len(chunk) < FITS_BLOCK:
+                if len(buffer) == 0:
+                    return None
+                raise ValueError(f"truncated FITS header at byte {offset}")
+            # only complete blocks are meaningful
+            buffer += chunk[:len(chunk) - len(chunk) % FITS_BLOCK]
+            header, end_ix = parse_header_blocks(buffer)
+        # location of the END card determines the true header length
+        data_loc = offset + _pad(end_ix + CARD_LENGTH)
+        return {
+            "header": header,
+            "header_loc": offset,
+            "data_loc": data_loc,
+            "data_span": data_size(header),
+        }
+
+    def _scan_to(self, hdu_ix: int):
+        if self.scanned is True and len(self.layouts) <= hdu_ix:
+            raise IndexError(f"{self.filename} has no HDU {hdu_ix}")
+        while len(self.layouts) <= hdu_ix:
+            if len(self.layouts) == 0:
+                offset = 0
+            else:
+                last = self.layouts[-1]
+                offset = last["data_loc"] + _pad(last["data_span"])
+            layout = self._read_header(offset)
+            if layout is None:
+                self.scanned = True
+                raise IndexError(f"{self.filename} has no HDU {hdu_ix}")
+            self.layouts.append(layout)
+
+    def __getitem__(self, hdu_ix: int) -> RangedHDU:
+        if hdu_ix < 0:
+            self._scan_all()
+        else:
+            self._scan_to(hdu_ix)
+        layout = self.layouts[hdu_ix]
+        if layout["header"].get("ZIMAGE") is True:
+            from subset.utilz.tiled_fits import RangedCompHDU
+
+            return RangedCompHDU(self.source, layout)
+        return RangedHDU(self.source, layout)
+
+    def _scan_all(self):
+        try:
+            self._scan_to(float("inf"))
+        except IndexError:
+            pass
+
+    def __len__(self) -> int:
+        self._scan_all()
+        return len(self.layouts)
+
+    def close(self):
+        self.source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,124 @@
+"""
+planning for batches of byte-range reads. gathers the byte ranges needed by
+many cuts from the same file, sorts and merges them, and decides which gaps
+are cheaper to read through than to skip.
+
+the tradeoff is governed by a simple cost model: each request costs
+`latency` seconds before any bytes arrive, and each byte costs
+1 / `bandwidth` seconds. so it is worth reading through a gap between two
+ranges (and saving a request) if the gap is smaller than
+latency * bandwidth bytes. pass max_gap to set that threshold directly.
+"""
+from typing import Optional, Sequence
+
+import numpy as np
+
+# rough figures for a single S3 GET from an EC2 instance in-region
+DEFAULT_LATENCY = 0.02  # seconds
+DEFAULT_BANDWIDTH = 50 * 1000 ** 2  # bytes per second
+# bookkeeping counts in every plan
+PLAN_FIELDS = ("n_ranges", "n_reads", "requested_bytes", "used_bytes")
+
+
+def gap_threshold(
+    latency: float = DEFAULT_LATENCY,
+    bandwidth: float = DEFAULT_BANDWIDTH,
+    max_gap: Optional[int] = None,
+) -> int:
+    """largest gap (in bytes) worth reading through to save a request"""
+    if max_gap is not None:
+        return int(max_gap)
+    return int(latency * bandwidth)
+
+
+def merge_ranges(ranges: np.ndarray, max_gap: int = 0) -> np.ndarray:
+    """
+    merge an n x 2 array of [start, stop) byte ranges into the smallest set
+    of ranges that covers them all without skipping a gap of max_gap bytes
+    or less. overlapping ranges are always merged. returns ranges sorted by
+    offset.
+    """
+    ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    if len(ranges) == 0:
+        return ranges
+    ranges = ranges[np.argsort(ranges[:, 0], kind="stable")]
+    reach = np.maximum.accumulate(ranges[:, 1])
+    breaks = np.flatnonzero(ranges[1:, 0] > reach[:-1] + max_gap) + 1
+    group_starts = np.concatenate([[0], breaks])
+    return np.column_stack(
+        [
+            ranges[group_starts, 0],
+            np.maximum.reduceat(ranges[:, 1], group_starts),
+        ]
+    )
+
+
+def plan_reads(
+    ranges: np.ndarray,
+    latency: float = DEFAULT_LATENCY,
+    bandwidth: float = DEFAULT_BANDWIDTH,
+    max_gap: Optional[int] = None,
+) -> dict:
+    """
+    make a plan for reading an n x 2 array of [start, stop) byte ranges.
+    returns a dict with the coalesced reads to issue, the index of the read
+    that covers each requested range, and bookkeeping about how many bytes
+    will be transferred vs. how many are actually needed.
+    """
+    ranges = np.asarray(ranges, dtype=np.int64).reshape(-1, 2)
+    reads = merge_ranges(ranges, gap_threshold(latency, bandwidth, max_gap))
+    if len(ranges) > 0:
+        owners = np.searchsorted(reads[:, 0], ranges[:, 0], side="right") - 1
+    else:
+        owners = np.empty(0, dtype=np.int64)
+    return {
+        "ranges": ranges,
+        "reads": reads,
+        "owners": owners,
+        "n_ranges": len(ranges),
+        "n_reads": len(reads),
+        "requested_bytes": int((reads[:, 1] - reads[:, 0]).sum()),
+        "used_bytes": int(np.diff(merge_ranges(ranges), axis=1).sum()),
+    }
+
+
+def execute_plan(source, plan: dict) -> list[memoryview]:
+    """
+    issue the reads in a plan against a byte-range source (see
+    subset.utilz.byte_range) and return zero-copy views of the bytes for
+    each originally-requested range, in the original order.
+    """
+    return slice_reads(plan, source.read_ranges(plan["reads"].tolist()))
+
+
+def slice_reads(plan: dict, buffers: Sequence[bytes]) -> list[memoryview]:
+    """
+    cut the buffers returned by the reads in a plan into zero-copy views of
+    each originally-requested range, in the original order
+    """
+    buffers = [memoryview(buffer) for buffer in buffers]
+    views = []
+    for (start, stop), owner in zip(plan["ranges"], plan["owners"]):
+        read_start = plan["reads"][owner, 0]
+        views.append(buffers[owner][start - read_start:stop - read_start])
+    return views
+
+
+def combine_plan_stats(*plans: dict) -> dict:
+    """
+    add up the bookkeeping from several plans made for the same operation
+    (e.g., table-row and heap reads from a tile-compressed HDU)
+    """
+    return {
+        key: sum(plan[key] for plan in plans)
+        for key in PLAN_FIELDS
+    }
+
+
+def split_by_counts(items: Sequence, counts: Sequence[int]) -> list[list]:
+    """split a flat sequence into consecutive groups of the given sizes"""
+    groups, ix = [], 0
+    for count in counts:
+        groups.append(list(items[ix:ix + count]))
+        ix += count
+    return groups
@@ -0,0 +1,84 @@
+"""
+fast path for sky-to-pixel conversion in gnomonic (TAN) projections, which
+both PS1 and GALEX images use. a TANSystem holds just the reference point
+and linear transformation of a celestial WCS, and projects whole arrays of
+RA/Dec to pixel coordinates in a few numpy operations, rather than going
+through astropy.wcs's general machinery. systems that are not plain TAN
+(distortion terms, projection parameters, a nonstandard native pole,
+non-celestial axes) fall back to astropy.wcs.
+"""
+from typing import Optional
+
+import numpy as np
+
+TAN_CTYPES = ("RA---TAN", "DEC--TAN")
+
+
+class TANSystem:
+    """
+    array-backed gnomonic projection. world_to_pixel() returns 0-based
+    pixel coordinates, like astropy's WCS.world_to_pixel_values().
+    """
+
+    def __init__(self, crval, crpix, cd):
+        self.crval = np.radians(np.asarray(crval, dtype=np.float64))
+        self.crpix = np.asarray(crpix, dtype=np.float64)
+        self.inverse_cd = np.linalg.inv(np.asarray(cd, dtype=np.float64))
+
+    def world_to_pixel(self, ra, dec) -> tuple[np.ndarray, np.ndarray]:
+        ra, dec = np.radians(ra), np.radians(dec)
+        ra0, dec0 = self.crval
+        d_ra = ra - ra0
+        cos_dec, sin_dec = np.cos(dec), np.sin(dec)
+        cos_d_ra = np.cos(d_ra)
+        cos_c = np.sin(dec0) * sin_dec + np.cos(dec0) * cos_dec * cos_d_ra
+        # points 90 degrees or more from the reference point do not project
+        cos_c = np.where(cos_c > 0, cos_c, np.nan)
+        # intermediate world coordinates, in degrees
+        x = np.degrees(cos_dec * np.sin(d_ra) / cos_c)
+        y = np.degrees(
+            (np.cos(dec0) * sin_dec - np.sin(dec0) * cos_dec * cos_d_ra)
+            / cos_c
+        )
+        (a, b), (c, d) = self.inverse_cd
+        return (
+            a * x + b * y + self.crpix[0] - 1,
+            c * x + d * y + self.crpix[1] - 1,
+        )
+
+
+def tan_system(system) -> Optional[TANSystem]:
+    """
+    make a TANSystem from an astropy.wcs.WCS if it describes a plain TAN
+    projection in degrees; otherwise return None
+    """
+    if system.naxis != 2 or tuple(system.wcs.ctype) != TAN_CTYPES:
+        return None
+    distortions = (
+        system.sip,
+        system.cpdis1,
+        system.cpdis2,
+        system.det2im1,
+        system.det2im2,
+    )
+    if any(d is not None for d in distortions):
+        return None
+    if len(system.wcs.get_pv()) > 0 or system.wcs.lonpole != 180:
+        return None
+    if any(unit not in ("", "deg") for unit in map(str, system.wcs.cunit)):
+        return None
+    return TANSystem(
+        system.wcs.crval, system.wcs.crpix, system.pixel_scale_matrix
+    )
+
+
+def world_to_pixel(system, ra, dec, tan=None) -> tuple[np.ndarray, ...]:
+    """
+    project arrays of RA/Dec (degrees) to 0-based pixel coordinates with
+    an astropy.wcs.WCS, using the TAN fast path if possible. pass `tan` (the
+    output of tan_system(system)) to skip checking the system.
+    """
+    tan = tan_system(system) if tan is None else tan
+    if tan is not None:
+        return tan.world_to_pixel(ra, dec)
+    return system.world_to_pixel_values(ra, dec)
@@ -1,83 +1,270 @@
 """
-provides support for bandwidth-throttled benchmarks. maybe useful for other
-cases in which you want to bandwidth-throttle an operation.
+in-process bandwidth and latency shaping for benchmarks. maybe useful for
+other cases in which you want to bandwidth-throttle an operation.
+
+rather than capping a whole network interface, Throttle caps reads made by
+code inside its context: byte-range sources (subset.utilz.byte_range --
+and so the ranged loaders, block cache, header prefetcher, and gzip
+reader), fsspec file objects (e.g. those astropy opens for s3:// URLs),
+and anything explicitly wrapped in a ShapedFile. it needs no privileges and
+does not touch other traffic on the machine. it does not reach reads made
+by cfitsio (fitsio loaders), reads through astropy's memory maps of local
+files, or reads made by other processes.
 """
-from functools import partial
+from functools import wraps
+import threading
+import time
+from typing import Callable, Optional
+import warnings
+
+# shapers of the Throttle contexts currently open, innermost last
+_ACTIVE = []
+
+
+class TokenBucket:
+    """
+    thread-safe token bucket. consume() blocks until the bucket could have
+    paid for the requested bytes; concurrent callers share the rate. pass
+    the perf_counter() time a transfer started as `started` to charge it
+    for its own duration, so that it is only held to the cap -- a transfer
+    that is already slower than the rate does not wait at all.
+    """
 
-from dustgoggles.func import zero
-import sh
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = float(rate)
+        self.burst = self.rate / 10 if burst is None else float(burst)
+        self._tokens, self._stamp = self.burst, time.perf_counter()
+        self._lock = threading.Lock()
 
+    def consume(self, nbytes: int, started: Optional[float] = None):
+        with self._lock:
+            now = time.perf_counter()
+            # refill only up to the start of the transfer: the time since
+            # then pays down the debt it runs up below
+            since = now if started is None else max(started, self._stamp)
+            self._tokens = min(
+                self._tokens + (since - self._stamp) * self.rate, self.burst
+            )
+            self._stamp = since
+            # go into debt, and wait out whatever share of it the transfer
+            # has not already paid off
+            self._tokens -= nbytes
+            wait = since - self._tokens / self.rate - now
+        if wait > 0:
+            time.sleep(wait)
 
-def throttle(download=None, upload=None, interface="ens5"):
+
+class Shaper:
     """
-    throttle network speed using wondershaper. requires a wondershaper
-    installation and execution by a user with sudoer privileges and no
-    password (e.g., the default user on most stock EC2 images).
-
-    this permissions hack is sloppy and only suitable on single-user systems
-    that have no password for sudoers _anyway_. I do not particularly
-    recommend editing this to add your password as plain text. it would be
-    better to edit permissions for the parts of the system wondershaper
-    touches if you wanted to extend this to a more general context.
+    token buckets for each direction plus added per-request latency.
+    rates are in bytes per second; None means uncapped.
     """
-    if (download is None) and (upload is None):
-        return
-    arguments = ["-a", interface]
-    if download is not None:
-        arguments += ["-d", download]
-    if upload is not None:
-        arguments += ["-u", upload]
-    with sh.contrib.sudo(password="", _with=True):
-        sh.wondershaper(*arguments)
-
-
-def unthrottle(interface="ens5"):
+
+    def __init__(
+        self,
+        download: Optional[float] = None,
+        upload: Optional[float] = None,
+        latency: float = 0,
+        burst: Optional[float] = None,
+    ):
+        self.download = None if download is None else TokenBucket(
+            download, burst
+        )
+        self.upload = None if upload is None else TokenBucket(upload, burst)
+        self.latency = latency
+
+    def wait_first_byte(self):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def received(self, nbytes: int, started: Optional[float] = None):
+        if self.download is not None:
+            self.download.consume(nbytes, started)
+
+    def sent(self, nbytes: int, started: Optional[float] = None):
+        if self.upload is not None:
+            self.upload.consume(nbytes, started)
+
+    def fetcher(self, fetch: Callable) -> Callable:
+        """shape a function that fetches one byte range per call"""
+
+        @wraps(fetch)
+        def shaped_fetch(*args, **kwargs):
+            self.wait_first_byte()
+            started = time.perf_counter()
+            data = fetch(*args, **kwargs)
+            self.received(len(data), started)
+            return data
+
+        return shaped_fetch
+
+
+def active_shaper() -> Optional[Shaper]:
+    """the Shaper of the innermost open Throttle, if any"""
+    return _ACTIVE[-1] if len(_ACTIVE) > 0 else None
+
+
+class ShapedSource:
     """
-    unthrottle a network interface previously throttled by wondershaper.
-    requires a wondershaper installation and execution by a user with
-    sudoer privileges and no password. that permissions hack is sloppy;
-    see notes on throttle().
+    byte-range source (see subset.utilz.byte_range) whose reads are shaped.
+    read_ranges() is treated as one request, since sources issue its
+    ranges concurrently.
     """
-    with sh.contrib.sudo(password="", _with=True):
-        try:
-            # sloppy! see comments on throttle.
-            with sh.contrib.sudo(password="", _with=True):
-                sh.wondershaper("-c", "-a", interface)
-        # for some reason, wondershaper always throws an error code
-        # on clear operations, even when successful.
-        except sh.ErrorReturnCode:
-            pass
+
+    def __init__(self, source, shaper: Shaper):
+        self.source, self.shaper = source, shaper
+        self.path = source.path
+        # added latency plus the wrapped source's time to first byte, if
+        # it reports one (see subset.utilz.io_meter)
+        self.first_byte = None
+
+    @property
+    def size(self) -> int:
+        return self.source.size
+
+    @property
+    def identity(self) -> str:
+        return self.source.identity
+
+    def read_range(self, start: int, stop: int) -> bytes:
+        data = self.shaper.fetcher(self.source.read_range)(start, stop)
+        self.first_byte = self.shaper.latency + (
+            getattr(self.source, "first_byte", None) or 0
+        )
+        return data
+
+    def read_ranges(self, ranges) -> list[bytes]:
+        if len(ranges) == 0:
+            return []
+        self.shaper.wait_first_byte()
+        started = time.perf_counter()
+        buffers = self.source.read_ranges(ranges)
+        self.shaper.received(sum(map(len, buffers)), started)
+        return buffers
+
+    def close(self):
+        self.source.close()
+
+
+def shape_source(source):
+    """wrap a byte-range source in the active Throttle's shaping, if any"""
+    shaper = active_shaper()
+    return source if shaper is None else ShapedSource(source, shaper)
+
+
+def shape_fetcher(fetch: Callable) -> Callable:
+    """
+    shape a function that fetches one byte range per call with the active
+    Throttle's shaping, if any
+    """
+    shaper = active_shaper()
+    return fetch if shaper is None else shaper.fetcher(fetch)
+
+
+class ShapedFile:
+    """
+    file-like wrapper that shapes reads and writes of another file-like
+    object. each read or write call counts as one request.
+    """
+
+    def __init__(self, stream, shaper: Optional[Shaper] = None):
+        self._stream = stream
+        self._shaper = active_shaper() if shaper is None else shaper
+
+    def read(self, size: int = -1) -> bytes:
+        if self._shaper is None:
+            return self._stream.read(size)
+        return self._shaper.fetcher(self._stream.read)(size)
+
+    def readinto(self, buffer) -> int:
+        if self._shaper is None:
+            return self._stream.readinto(buffer)
+        self._shaper.wait_first_byte()
+        started = time.perf_counter()
+        count = self._stream.readinto(buffer)
+        self._shaper.received(count, started)
+        return count
+
+    def write(self, data) -> int:
+        if self._shaper is None:
+            return self._stream.write(data)
+        self._shaper.wait_first_byte()
+        started = time.perf_counter()
+        count = self._stream.write(data)
+        self._shaper.sent(len(data), started)
+        return count
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __iter__(self):
+        return iter(self._stream)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self._stream.close()
 
 
 class Throttle:
     """
-    apply network transfer caps using wondershaper. basically exists
-    just to provide a context manager around throttle() and unthrottle() in
-    order to permit clean application of caps to particular code sections.
-    all caveats on throttle() and unthrottle() about crudeness and security
-    and so on apply here as well.
+    context manager that caps transfer rates of reads (and writes) made by
+    code inside it; see the module docstring for what it reaches. a
+    drop-in replacement for the old wondershaper-based Throttle: download
+    and upload are in kilobits per second, and its interface argument is
+    accepted but ignored. latency (seconds) is added to every request, and
+    burst (bytes) sets the size of the token buckets.
 
-    does nothing whatsoever if you pass None for both upload and download.
+    does nothing whatsoever if you pass None for download and upload and no
+    latency.
     """
 
     def __init__(
-        self, download=None, upload=None, interface="ens5", verbose=False
+        self,
+        download: Optional[float] = None,
+        upload: Optional[float] = None,
+        interface: Optional[str] = None,
+        verbose: bool = False,
+        *,
+        latency: float = 0,
+        burst: Optional[float] = None,
     ):
-        if (download is not None) or (upload is not None):
-            self.throttle = partial(throttle, download, upload, interface)
-            self.unthrottle = partial(unthrottle, interface)
-            self.verbose = verbose
-        else:
-            self.throttle, self.unthrottle = partial(zero), partial(zero)
-            self.verbose = False
+        if interface is not None:
+            warnings.warn(
+                "Throttle no longer shapes a network interface; "
+                f"ignoring interface={interface!r}",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+        self.download, self.upload, self.latency = download, upload, latency
+        self.verbose = verbose
+        self.shaper = None
+        if (download, upload, latency) != (None, None, 0):
+            self.shaper = Shaper(
+                None if download is None else download * 1000 / 8,
+                None if upload is None else upload * 1000 / 8,
+                latency,
+                burst,
+            )
 
     def __enter__(self):
-        self.throttle()
+        if self.shaper is None:
+            return self
+        from subset.utilz.byte_range import instrument_fsspec_files
+
+        instrument_fsspec_files()
+        _ACTIVE.append(self.shaper)
         if self.verbose is True:
-            print(f"throttled interface: {self.throttle.args}")
+            print(
+                f"throttled: {self.download} Kbps down, {self.upload} Kbps "
+                f"up, {self.latency} s latency"
+            )
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.unthrottle()
+        if self.shaper is None:
+            return
+        _ACTIVE.remove(self.shaper)
         if self.verbose is True:
-            print(f"unthrottled interface: {self.unthrottle.args}")
+            print("unthrottled")
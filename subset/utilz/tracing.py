@@ -0,0 +1,273 @@
+"""
+optional span tracing, exportable as Chrome trace / Perfetto JSON (open
+the output of Tracer.save() in chrome://tracing or ui.perfetto.dev). code
+marks stages with span(); inside a tracing() context, each span is
+recorded with its start, duration, thread, and arguments, so nested and
+concurrent stages show up as a waterfall. byte-range sources and fsspec
+files opened inside the context also record a span per range request (see
+subset.utilz.byte_range.instrument_source()), as does the pooled fetcher
+in subset.utilz.async_fetch, whose requests overlap on one event-loop
+thread and so are recorded with request_span(). outside a tracing()
+context, span() and request_span() do nothing.
+
+the active tracer is process-wide, so spans from every thread are
+recorded. other processes cannot see it: work sent to process pools with
+subset.utilz.workers.submit_in_context() or apply_in_context() is run by
+run_traced() in a tracing() context of the worker's own, and its spans are
+merged back into the parent's tracer under the worker's pid.
+"""
+from contextlib import contextmanager
+from functools import wraps
+import json
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Optional, Union
+
+# tracers of the tracing() contexts currently open, innermost last
+_ACTIVE = []
+
+
+class Tracer:
+    """thread-safe collection of completed spans"""
+
+    def __init__(self):
+        self.events = []
+        self.thread_names = {}
+        self._next_id = 0
+        self._origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    def _now(self) -> float:
+        """microseconds since this tracer was made"""
+        return (time.perf_counter_ns() - self._origin) / 1000
+
+    def _name_thread(self, thread: threading.Thread):
+        self.thread_names[(os.getpid(), thread.ident)] = thread.name
+
+    def add(self, name: str, category: str, start: float, args: dict):
+        """record a span that began at start (see _now()) and ends now"""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": start,
+            "dur": self._now() - start,
+            "pid": os.getpid(),
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self._name_thread(thread)
+
+    def add_async(self, name: str, category: str, start: float, args: dict):
+        """
+        like add(), but as a pair of async events, which trace viewers
+        draw on their own rows, so spans that overlap on one thread (e.g.
+        concurrent requests on an event loop) do not garble its nesting
+        """
+        thread = threading.current_thread()
+        stop = self._now()
+        with self._lock:
+            self._next_id += 1
+            common = {
+                "name": name,
+                "cat": category,
+                "id": self._next_id,
+                "pid": os.getpid(),
+                "tid": thread.ident,
+            }
+            self.events.append(common | {"ph": "b", "ts": start, "args": args})
+            self.events.append(common | {"ph": "e", "ts": stop})
+            self._name_thread(thread)
+
+    def export(self) -> dict:
+        """spans and thread names, picklable, for another Tracer's merge()"""
+        with self._lock:
+            return {
+                "origin": self._origin,
+                "events": list(self.events),
+                "thread_names": self.thread_names.copy(),
+            }
+
+    def merge(self, exported: dict):
+        """
+        add spans exported by another Tracer (e.g. one in a worker process),
+        shifted onto this one's clock. perf_counter is system-wide on Linux,
+        so the shift is exact there.
+        """
+        shift = (exported["origin"] - self._origin) / 1000
+        ids = {}
+        with self._lock:
+            for event in exported["events"]:
+                event = event | {"ts": event["ts"] + shift}
+                if "id" in event:
+                    # renumber async spans so their ids stay unique here
+                    if event["id"] not in ids:
+                        self._next_id += 1
+                        ids[event["id"]] = self._next_id
+                    event["id"] = ids[event["id"]]
+                self.events.append(event)
+            self.thread_names |= exported["thread_names"]
+
+    def chrome_trace(self) -> dict:
+        """spans in Chrome trace event format"""
+        with self._lock:
+            names = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for (pid, tid), name in self.thread_names.items()
+            ]
+            return {
+                "traceEvents": names + list(self.events),
+                "displayTimeUnit": "ms",
+            }
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """write spans to path as Chrome trace JSON"""
+        with open(path, "w") as stream:
+            json.dump(self.chrome_trace(), stream, default=str)
+        return Path(path)
+
+
+def active_tracer() -> Optional[Tracer]:
+    """the Tracer of the innermost tracing() context, if any"""
+    return _ACTIVE[-1] if len(_ACTIVE) > 0 else None
+
+
+@contextmanager
+def tracing(tracer: Optional[Tracer] = None):
+    """record spans made inside this context in tracer (or a new Tracer)"""
+    from subset.utilz.byte_range import instrument_fsspec_files
+
+    tracer = Tracer() if tracer is None else tracer
+    instrument_fsspec_files()
+    _ACTIVE.append(tracer)
+    try:
+        yield tracer
+    finally:
+        _ACTIVE.remove(tracer)
+
+
+def run_traced(func: Callable, *args, **kwargs) -> tuple:
+    """
+    call func in a tracing() context of its own, returning its result and
+    the exported spans (see Tracer.merge()). meant to be run in worker
+    processes, which cannot see the parent's tracer.
+    """
+    with tracing() as tracer:
+        result = func(*args, **kwargs)
+    return result, tracer.export()
+
+
+@contextmanager
+def span(name: str, category: str = "subset", **args):
+    """record the enclosed code as a span, if a tracer is active"""
+    tracer = active_tracer()
+    if tracer is None:
+        yield
+        return
+    start = tracer._now()
+    try:
+        yield
+    finally:
+        tracer.add(name, category, start, args)
+
+
+@contextmanager
+def request_span(name: str, category: str = "io", **args):
+    """
+    record the enclosed code as an async span (see Tracer.add_async()), if
+    a tracer is active
+    """
+    tracer = active_tracer()
+    if tracer is None:
+        yield
+        return
+    start = tracer._now()
+    try:
+        yield
+    finally:
+        tracer.add_async(name, category, start, args)
+
+
+class TracedSource:
+    """byte-range source that records a span for each request"""
+
+    def __init__(self, source, tracer: Tracer):
+        self.source, self.tracer = source, tracer
+        self.path = source.path
+
+    @property
+    def size(self) -> int:
+        return self.source.size
+
+    @property
+    def identity(self) -> str:
+        return self.source.identity
+
+    @property
+    def first_byte(self) -> Optional[float]:
+        return getattr(self.source, "first_byte", None)
+
+    def read_range(self, start: int, stop: int) -> bytes:
+        began = self.tracer._now()
+        data = self.source.read_range(start, stop)
+        self.tracer.add(
+            "read range",
+            "io",
+            began,
+            {"path": self.path, "start": start, "stop": stop},
+        )
+        return data
+
+    def read_ranges(self, ranges) -> list[bytes]:
+        began = self.tracer._now()
+        buffers = self.source.read_ranges(ranges)
+        self.tracer.add(
+            "read ranges",
+            "io",
+            began,
+            {
+                "path": self.path,
+                "n_ranges": len(ranges),
+                "bytes": sum(map(len, buffers)),
+            },
+        )
+        return buffers
+
+    def close(self):
+        self.source.close()
+
+
+def trace_source(source):
+    """wrap a byte-range source in the active tracer, if any"""
+    tracer = active_tracer()
+    return source if tracer is None else TracedSource(source, tracer)
+
+
+def trace_fetcher(fetch: Callable) -> Callable:
+    """
+    record a span for each call to a function that fetches one byte range
+    per call, if a tracer is active
+    """
+    tracer = active_tracer()
+    if tracer is None:
+        return fetch
+
+    @wraps(fetch)
+    def traced_fetch(start, stop, *args, **kwargs):
+        began = tracer._now()
+        data = fetch(start, stop, *args, **kwargs)
+        tracer.add("fetch range", "io", began, {"start": start, "stop": stop})
+        return data
+
+    return traced_fetch
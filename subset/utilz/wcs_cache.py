@@ -0,0 +1,109 @@
+"""
+memoized astropy.wcs.WCS construction. WCS objects are slow to build, and
+many of the files we open share a projection: all bands of a PS1 skycell,
+say, or repeated opens of the same GALEX eclipse. WCSCache keys WCS objects
+by a canonical hash of the trimmed WCS keywords of a header (see
+subset.utilz.fits.extract_wcs_keywords), so such files all get the same
+WCS object. because it is shared, callers must treat it as read-only (copy
+it before modifying it).
+"""
+from collections import OrderedDict
+import hashlib
+import numbers
+import threading
+from typing import Mapping
+
+DEFAULT_MAX_SYSTEMS = 256
+
+
+def canonical_wcs_key(keywords: Mapping) -> str:
+    """
+    hash of a dict of WCS keywords that does not depend on keyword order,
+    on padding of string values, or on the numeric types chosen by the
+    header parser (e.g. numpy vs. builtin floats, 6250 vs. 6250.0)
+    """
+    canonical = []
+    for keyword in sorted(keywords):
+        value = keywords[keyword]
+        if isinstance(value, str):
+            value = value.strip()
+        elif isinstance(value, numbers.Real) and not isinstance(value, bool):
+            value = float(value)
+        canonical.append(f"{keyword.strip().upper()}={value!r}")
+    return hashlib.sha1("\n".join(canonical).encode()).hexdigest()
+
+
+class WCSCache:
+    """
+    bounded, thread-safe LRU cache of astropy.wcs.WCS objects keyed by
+    canonical WCS keywords. counts of hits and misses are kept in
+    self.counts.
+    """
+
+    def __init__(self, max_systems: int = DEFAULT_MAX_SYSTEMS):
+        self.max_systems = max_systems
+        self._systems = OrderedDict()
+        self._pending = {}
+        self.counts = {"hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+
+    def lookup(self, header: Mapping):
+        """
+        get the WCS described by a header (any mapping of keywords to
+        values). returns the WCS and whether it came from the cache.
+        """
+        import astropy.wcs
+
+        from subset.utilz.fits import extract_wcs_keywords
+
+        keywords = extract_wcs_keywords(header)
+        key = canonical_wcs_key(keywords)
+        while True:
+            with self._lock:
+                if key in self._systems:
+                    self._systems.move_to_end(key)
+                    self.counts["hits"] += 1
+                    return self._systems[key], True
+                pending = self._pending.get(key)
+                if pending is None:
+                    # this thread builds it; others asking meanwhile wait
+                    self._pending[key] = threading.Event()
+                    self.counts["misses"] += 1
+                    break
+            pending.wait()
+        try:
+            # build outside the lock: this is the slow part
+            system = astropy.wcs.WCS(keywords)
+            with self._lock:
+                self._systems[key] = system
+                while len(self._systems) > self.max_systems:
+                    self._systems.popitem(last=False)
+        finally:
+            with self._lock:
+                self._pending.pop(key).set()
+        return system, False
+
+    def get(self, header: Mapping):
+        """get the WCS described by a header"""
+        return self.lookup(header)[0]
+
+    def clear(self):
+        with self._lock:
+            self._systems.clear()
+            self.counts = {"hits": 0, "misses": 0}
+
+
+_SHARED_CACHE = None
+
+
+def shared_wcs_cache() -> WCSCache:
+    """process-wide WCSCache"""
+    global _SHARED_CACHE
+    if _SHARED_CACHE is None:
+        _SHARED_CACHE = WCSCache()
+    return _SHARED_CACHE
+
+
+def cached_wcs(header: Mapping):
+    """get the WCS described by a header from the process-wide WCSCache"""
+    return shared_wcs_cache().get(header)
@@ -0,0 +1,129 @@
+"""
+long-lived worker pools for the science handlers. creating a fresh
+multiprocessing.Pool for every chunk costs process start-up time and
+discards everything workers have warmed up -- imported modules, open
+connections and s3fs instances, and the process-wide block and WCS caches
+(subset.utilz.block_cache, subset.utilz.wcs_cache). make_worker_pools()
+creates executors once, so that they can be shared by every chunk and by
+both the header-skimming ("image") and cutting ("cut") stages.
+"""
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+import contextvars
+from typing import Callable, Literal, Mapping, Optional
+
+from subset.utilz.tracing import Tracer, active_tracer, run_traced
+
+WORKER_MODES = ("thread", "process", "hybrid")
+
+
+def make_worker_pools(
+    mode: Literal["thread", "process", "hybrid"],
+    threads: Mapping[str, Optional[int]],
+) -> dict[str, Optional[Executor]]:
+    """
+    make executors for the "image" and "cut" stages, sized by the
+    corresponding values of threads (None to run that stage serially).
+    "thread" and "process" modes share one thread or process pool between
+    the stages. "hybrid" mode skims headers, which is mostly waiting on
+    I/O, in threads, and cuts in processes.
+    """
+    if mode not in WORKER_MODES:
+        raise ValueError(f"mode must be one of {WORKER_MODES}, not {mode}")
+    sizes = {stage: threads.get(stage) for stage in ("image", "cut")}
+    if mode == "hybrid":
+        kinds = {"image": ThreadPoolExecutor, "cut": ProcessPoolExecutor}
+        return {
+            stage: None if size is None else kinds[stage](size)
+            for stage, size in sizes.items()
+        }
+    active = [size for size in sizes.values() if size is not None]
+    if len(active) == 0:
+        return {"image": None, "cut": None}
+    kind = ThreadPoolExecutor if mode == "thread" else ProcessPoolExecutor
+    shared = kind(max(active))
+    return {
+        stage: None if size is None else shared
+        for stage, size in sizes.items()
+    }
+
+
+def _merged_future(future: Future, tracer: Tracer) -> Future:
+    """future for the result of a run_traced() future, merging its spans"""
+    merged = Future()
+
+    def finish(done: Future):
+        try:
+            result, spans = done.result()
+        except BaseException as ex:
+            merged.set_exception(ex)
+            return
+        tracer.merge(spans)
+        merged.set_result(result)
+
+    future.add_done_callback(finish)
+    return merged
+
+
+def submit_in_context(
+    executor: Executor, func: Callable, /, *args, **kwargs
+) -> Future:
+    """
+    executor.submit(), except that a thread pool runs func in a copy of the
+    caller's context, so context-local state like the active IOMeter
+    (subset.utilz.io_meter) follows the work. contexts cannot be sent to
+    other processes, so process pools get a plain submit() -- but if a
+    tracer is active (subset.utilz.tracing), func is traced in the worker
+    and its spans are merged into the tracer when it finishes.
+    """
+    if isinstance(executor, ThreadPoolExecutor):
+        context = contextvars.copy_context()
+        return executor.submit(context.run, func, *args, **kwargs)
+    tracer = active_tracer()
+    if tracer is None:
+        return executor.submit(func, *args, **kwargs)
+    return _merged_future(
+        executor.submit(run_traced, func, *args, **kwargs), tracer
+    )
+
+
+class _MergedResult:
+    """AsyncResult for a run_traced() call that merges its spans on get()"""
+
+    def __init__(self, result, tracer: Tracer):
+        self.result, self.tracer = result, tracer
+        self._value, self._merged = None, False
+
+    def get(self, timeout: Optional[float] = None):
+        if self._merged is False:
+            self._value, spans = self.result.get(timeout)
+            self.tracer.merge(spans)
+            self._merged = True
+        return self._value
+
+
+def apply_in_context(
+    pool, func: Callable, args: tuple = (), kwds: Optional[dict] = None
+):
+    """
+    pool.apply_async() for a multiprocessing.Pool, tracing func in the
+    worker if a tracer is active (see submit_in_context())
+    """
+    kwds = {} if kwds is None else kwds
+    tracer = active_tracer()
+    if tracer is None:
+        return pool.apply_async(func, args, kwds)
+    return _MergedResult(
+        pool.apply_async(run_traced, (func, *args), kwds), tracer
+    )
+
+
+def shutdown_worker_pools(pools: Mapping[str, Optional[Executor]]):
+    """shut down each distinct executor made by make_worker_pools()"""
+    executors = {id(e): e for e in pools.values() if e is not None}
+    for executor in executors.values():
+        executor.shutdown()